@@ -9,20 +9,14 @@ Authors:
   M. Nowak, and the exoGravity team.
 """
 
-# import ESO P2 api and getpass to manage user password
-import p2api
-from getpass import getpass
-
-# ruamel or yaml to read config yml file
-import ruamel.yaml as yaml
-    
-# import this package
+# import this package. Heavy dependencies (matplotlib, p2api, astroquery, etc.) are only imported when needed,
+# so that --generate or --help are instant
 import p2Gravity as p2g
 from p2Gravity.common import *
-from p2Gravity.plot import *
 
 # import sys and argparse for args
 import sys
+import atexit
 import argparse
 
 # create the parser for command lines arguments
@@ -32,7 +26,7 @@ Generate and send GRAVITY OBs to P2
 """)
 
 # required arguments are the path to the folder containing the data, and the path to the config yml file to write 
-parser.add_argument('file', type=str, nargs="?", help="the path the to input YAML configuration file (or output when using --generate).")
+parser.add_argument('file', type=str, nargs="*", help="the path the to input YAML configuration file (or output when using --generate). Several files or glob patterns can be given, and are then processed as a single campaign.")
 
 # some optional arguments
 parser.add_argument("--generate", metavar="TYPE", type=str, default=argparse.SUPPRESS, choices=["dual_on", "dual_off", "dual_off_calib", "dual_wide_off", "dual_wide_on", "single_on"], nargs = 1,
@@ -56,23 +50,86 @@ parser.add_argument("--ft_color", metavar="COLOR", type=str, default="C0",
 parser.add_argument("--acq_only", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
                     help="if set, only plot the acquition and not the individual subplots and text info")
 
+parser.add_argument("--render", metavar="DIR", type=str, default=argparse.SUPPRESS,
+                    help="if set, do not send anything to P2, but write the preview of each OB as a png in this directory, and all previews in a multipage pdf (DIR/obs.pdf). The previews are rendered in parallel without any display")
+
+parser.add_argument("--overview", metavar="FILE", type=str, default=argparse.SUPPRESS,
+                    help="if set, do not send anything to P2, but draw a thumbnail of each OB (acquisition, fibers, mode and exposure time) on a single page, written to this file (png, pdf, etc.)")
+
 parser.add_argument("--demo", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
                     help="if set, send the OBs to the P2 demo server")
 
+parser.add_argument("--p2_url", metavar="URL", type=str, default=argparse.SUPPRESS,
+                    help="send the OBs to a local fake P2 server (see p2Gravity/fakeP2.py) instead of P2: 'memory' for a server in this process, or the url of a server, e.g. http://localhost:5000")
+
 parser.add_argument("--nogui", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
                     help="if set, do not plot a visual summary of the OBs before sending to P2, but send them without warning")
 
 parser.add_argument("--dit", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
                     help="if set, just show show the DIT delection figure and exit")
 
+parser.add_argument("--jobs", metavar="N", type=int, default=1,
+                    help="number of OBs uploaded to P2 concurrently (at least 2 in the review GUI, so that uploads do not block it). Default is 1")
+
+parser.add_argument("--clone", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="if set (with nogui), OBs with the same templates as a previous OB are created by duplicating it on P2, and only the parameters which differ are sent")
+
+parser.add_argument("--resume", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="if set (with nogui), continue an interrupted upload: the OBs already uploaded according to the local upload journal are skipped, and the ones partially created are completed")
+
+parser.add_argument("--offline", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="if set, targets are only resolved from the local target cache, and Simbad is never queried. Fails if a target is not in the cache")
+
+parser.add_argument("--refresh_cache", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="if set, ignore the targets already in the local target cache and resolve them again on Simbad, and list again the runs and folders on P2")
+
+parser.add_argument("--no_cache", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="if set, do not use the local target cache (targets, and runs and folders listed on P2) at all")
+
+parser.add_argument("--cache_ttl", metavar="DAYS", type=float, default=p2g.targetCache.DEFAULT_TTL,
+                    help="number of days after which a target in the local cache is resolved again on Simbad. Default is {} days".format(p2g.targetCache.DEFAULT_TTL))
+
+parser.add_argument("--cache_size", metavar="N", type=int, default=p2g.targetCache.DEFAULT_MAX_ENTRIES,
+                    help="maximum number of targets kept in the local cache. Default is {}".format(p2g.targetCache.DEFAULT_MAX_ENTRIES))
+
+parser.add_argument("--container_ttl", metavar="MINUTES", type=float, default=p2g.containerCache.DEFAULT_TTL,
+                    help="number of minutes during which the content of the runs and folders listed on P2 is kept in the local cache for the next runs. Default is {} minutes".format(p2g.containerCache.DEFAULT_TTL))
+
+parser.add_argument("--sync", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="if set (with nogui), OBs which already exist in the folder (matched by label) are updated in place if they changed, and left untouched otherwise, instead of being created again")
+
+parser.add_argument("--dry_run", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="with sync, only print which OBs would be created, updated, skipped or deleted, and exit without changing anything on P2")
+
+parser.add_argument("--prune", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="with sync, delete the OBs previously created by p2Gravity in the folder which are not in the YML anymore")
+
+parser.add_argument("--check", metavar="FILE", type=str, nargs="+", default=argparse.SUPPRESS,
+                    help="check the given yml files (templates sequences, objects, and ranges of all parameters) without Simbad or P2, report all the problems, and exit")
+
+parser.add_argument("--batch", metavar="EMPTY or TRUE/FALSE", type=bool, nargs="?", default=argparse.SUPPRESS, const = True,
+                    help="if set (with nogui), an error on an OB does not stop the run: the OB is skipped, and all errors are reported at the end")
+
+parser.add_argument("--ambiguity", type=str, choices = p2g.common.AMBIGUITY_POLICIES, default=argparse.SUPPRESS,
+                    help="what to do when Simbad returns several objects for a target: ask, use the first one, use the brightest in K, or fail. Default is ask, or fail in batch mode")
+
+parser.add_argument("--profile", metavar="FILE", type=str, nargs="?", default=argparse.SUPPRESS, const = p2g.profiling.DEFAULT_PROFILE_FILE,
+                    help="if set, time all phases and external calls (P2, Simbad, etc.), print a summary at the end, and write a json file which can be opened as a Chrome trace. Default file is {}".format(p2g.profiling.DEFAULT_PROFILE_FILE))
+
 # load arguments into a dictionnary
 args = parser.parse_args()
 dargs = vars(args) # to treat as a dictionnary
 
+# the profile is reported at exit, whatever the way we exit
+if "profile" in dargs:
+    p2g.profiling.PROFILER.enable()
+    atexit.register(p2g.profiling.PROFILER.report, dargs["profile"])
+
 WHEREAMI = os.path.dirname(__file__)
 
 # if DIT keyworg, show image
 if "dit" in dargs:
+    from p2Gravity.plot import *
     fig = plt.figure(figsize=(15, 8))
     ax = fig.add_subplot(111)
     ax.imshow(mpimg.imread(WHEREAMI+'/selecting_dit_values.jpg'))
@@ -85,12 +142,16 @@ if "dit" in dargs:
     plt.tight_layout()
     plt.show()
     sys.exit()
+elif "check" in dargs:
+    report = p2g.validate.check_files(dargs["check"])
+    report.print_report()
+    sys.exit(1 if len(report.errors) > 0 else 0)
 else:
-    if dargs["file"] is None:
+    if len(dargs["file"]) == 0:
         raise Exception("The following arguments are required: file")
 
 # get filename and load yml
-filename = dargs["file"]
+filename = dargs["file"][0]
 
 # is this a "generate" command?
 if "generate" in dargs:
@@ -107,12 +168,15 @@ if "generate" in dargs:
         f.close()
     sys.exit()
 
-if not(os.path.isfile(dargs["file"])):
-    printerr("{} not found, or is not a file".format(dargs["file"]))
+# all the files (or patterns) given are processed as a single campaign
+filenames = p2g.pipeline.expand_files(dargs["file"])
 
-# LOAD CONFIG FILE
+# PARSE: load config files
+with p2g.profiling.span("parse"):
+    cfgs = [p2g.pipeline.load_yml(filename) for filename in filenames]
+# ruamel to read the credentials yml file
+import ruamel.yaml as yaml
 loader = yaml.YAML(typ = "rt")
-cfg = loader.load(open(filename, "r"))
 try:
     credentials = loader.load(open("credentials.yml", "r"))
 except FileNotFoundError:
@@ -138,18 +202,6 @@ if "acq_only" in dargs:
 else:
     acq_only = False    
 
-if demo:
-    # setup for testing on P2 demo server
-    api = p2api.ApiConnection('demo', 52052, "tutorial")
-else:
-    if credentials is None:
-        user = input("ESO P2 username: ")
-        password = getpass("ESO P2 password: ")
-    else:
-        user = credentials["username"]
-        password = credentials["password"]
-    api = p2api.ApiConnection('production', user, password)
-
 if "bg" in dargs:
     if not("bglim" in dargs):
         printerr("bg keyword (specify a background image) cannot be used without a bglim keyword to specify the limits of the image: Use bglim=[xleft,xright,yleft,yright] in mas")
@@ -167,83 +219,255 @@ if "ft_color" in dargs:
     FT_COLOR = dargs["ft_color"]
 if "sc_color" in dargs:
     SC_COLOR = dargs["sc_color"]
-    
-# Create OB
-run_id = cfg["setup"]["run_id"]
-folder_name = cfg["setup"]["folder"]
-date = cfg["setup"]["date"]
-# user friendly
-if type(date) != str:
-    date = date.isoformat()
-    cfg["setup"]["date"] = date
-    
-# create the folder if it does not exist
-myrun = None
-runs, _ = api.getRuns()
-for thisrun in runs:
-    if thisrun['progId'] == run_id:
-        myrun = thisrun
-if myrun is None:
-    printinf("Available runs are: {}".format([r["progId"] for r in runs]))                
-    printerr("Run '{}' not found".format(run_id))
-folder_info = find_item(folder_name, myrun["containerId"], api, "Folder")
-if folder_info is None:
-    printinf("Creating folder '{}' in run '{}'".format(folder_name, run_id))            
-    folder_info, version = api.createFolder(myrun["containerId"], folder_name)
-container_id = folder_info["containerId"]
-
-# if concatenation is not none, we need to create a concatenation
-concatenation = cfg["setup"]["concatenation"].rstrip().lstrip()
-if concatenation.lower() != "none":
-    printinf("Creating concatenation '{}' in folder '{}'".format(concatenation, folder_name))                
-    con, conVersion = api.createConcatenation(container_id, concatenation)
-    container_id = con["containerId"]  # new container where to put OBs
-
-# loop through all OBs
-for ob_name in cfg["ObservingBlocks"]:
-    ob = cfg["ObservingBlocks"][ob_name]
-    mode = ob["mode"]
-    if mode == "single_on":
-        p2ob = p2g.ob.SingleOnOb(ob, cfg["setup"], label = ob_name, iscalib = ob["calib"])
-    elif mode == "single_off":
-        p2ob = p2g.ob.SingleOffOb(ob, cfg["setup"], label = ob_name)
-    elif mode == "dual_on":
-        p2ob = p2g.ob.DualOnOb(ob, cfg["setup"], label = ob_name)
-    elif mode == "dual_off":
-        p2ob = p2g.ob.DualOffOb(ob, cfg["setup"], label = ob_name, iscalib = ob["calib"])
-    elif mode == "dual_wide_off":
-        p2ob = p2g.ob.DualWideOffOb(ob, cfg["setup"], label = ob_name, iscalib = ob["calib"])
-    elif mode == "dual_wide_on":
-        p2ob = p2g.ob.DualWideOnOb(ob, cfg["setup"], label = ob_name)
-    else:
-        printerr("Mode {} is unknown.".format(mode))
-    p2ob.generate_templates()
-    p2ob.simbad_resolve(ob)
-    # in nogui mode, we upload straight to p2    
-    if nogui:
-        p2ob.p2_create(api, container_id)
-        p2ob.p2_update(api)
-    # in gui mode, we lpot the OB and wait for user input
-    else:
-        def send_p2(event, fig):
-            p2ob.p2_create(api, container_id)
-            p2ob.p2_update(api)
-            printinf("OB {} sent to run {}".format(ob_name, run_id))
-            plt.close(fig)
-            return None
-        def cancel(event, fig):
-            printwar("OB {} was not sent to P2".format(ob_name))
-            plt.close(fig)
-            return None
-        # plot this OB
-        fig, gs = plot_ob(p2ob, title = "run: {}        folder: {}\nob: {}        date: {}".format(run_id, folder_name, ob_name, date), fov=fov, bg=bg, bglim=bglim, ft_c = FT_COLOR, sc_c = SC_COLOR, acq_only = acq_only)
-        # add buttons:
-        axConfirm = fig.add_subplot(gs[0, 4])
-        axCancel = fig.add_subplot(gs[0, 5])
-        bConfirm = Button(axConfirm, 'Send to P2', color="C2")
-        bCancel = Button(axCancel, 'Cancel', color="C3")
-        bConfirm.on_clicked(lambda event: send_p2(event, fig))
-        bCancel.on_clicked(lambda event: cancel(event, fig))
-        plt.show() # wait for the user to confirm sending or cancel
 
+if "offline" in dargs:
+    offline = dargs["offline"]
+else:
+    offline = False
+
+if "refresh_cache" in dargs:
+    refresh_cache = dargs["refresh_cache"]
+else:
+    refresh_cache = False
+
+if "no_cache" in dargs:
+    no_cache = dargs["no_cache"]
+else:
+    no_cache = False
+
+if "clone" in dargs:
+    clone = dargs["clone"]
+else:
+    clone = False
+
+if "resume" in dargs:
+    resume = dargs["resume"]
+else:
+    resume = False
+
+if "sync" in dargs:
+    sync = dargs["sync"]
+else:
+    sync = False
+
+if "dry_run" in dargs:
+    dry_run = dargs["dry_run"]
+else:
+    dry_run = False
+
+if "prune" in dargs:
+    prune = dargs["prune"]
+else:
+    prune = False
+
+if "batch" in dargs:
+    batch = dargs["batch"]
+else:
+    batch = False
+
+if "ambiguity" in dargs:
+    ambiguity = dargs["ambiguity"]
+elif batch:
+    ambiguity = "fail"
+else:
+    ambiguity = "ask"
+
+if sync and not(nogui):
+    printerr("sync mode can only be used with nogui")
+if batch and not(nogui):
+    printerr("batch mode can only be used with nogui")
+if batch and (ambiguity == "ask"):
+    printerr("batch mode cannot ask which Simbad result to use. Use another ambiguity policy")
+if (dry_run or prune) and not(sync):
+    printerr("dry_run and prune can only be used with sync")
+if "render" in dargs:
+    render = dargs["render"]
+else:
+    render = None
+
+if "overview" in dargs:
+    overview = dargs["overview"]
+else:
+    overview = None
+
+if (sync or resume) and not(render is None and overview is None):
+    printerr("render and overview modes do not send anything to P2, and cannot be used with sync or resume")
+if resume and not(nogui):
+    printerr("resume can only be used with nogui")
+if resume and sync:
+    printerr("resume cannot be used with sync, which already updates the OBs found on P2")
+
+# the resolver is shared by all OBs, so that each target is only resolved once
+if no_cache:
+    if offline:
+        printerr("offline mode requires the local target cache, and cannot be used with no_cache")
+    target_cache = None
+else:
+    target_cache = p2g.targetCache.TargetCache(ttl = dargs["cache_ttl"], max_entries = dargs["cache_size"])
+    # defaults of the P2 templates, used to only send the parameters which differ
+    p2g.tpl.template.DEFAULT_TEMPLATE_DEFAULTS.load(os.path.join(get_cache_dir(), "template_defaults.json"))
+    # predictions of whereistheplanet, which are expensive to compute
+    p2g.planets.DEFAULT_PREDICTION_CACHE.load(os.path.join(get_cache_dir(), "planet_predictions.json"), ttl = dargs["cache_ttl"])
+resolver = p2g.resolver.SimbadResolver(cache = target_cache, offline = offline, refresh = refresh_cache, ambiguity = ambiguity)
+
+# planets are sampled once over all the time windows of the OBs
+windows, planet_names = [], []
+for cfg in cfgs:
+    if not(cfg["setup"].get("absoluteTimeConstraints", None) is None):
+        windows = windows + [window for window in cfg["setup"]["absoluteTimeConstraints"] if not(window in windows)]
+        planet_names = planet_names + [name for name in p2g.planets.collect_planet_names(cfg) if not(name in planet_names)]
+if len(planet_names) > 0:
+    p2g.planets.DEFAULT_EPHEMERIS_GRID.set_windows(windows)
+    p2g.planets.check_drift(planet_names)
+
+# the modules used by the OBs are loaded now, their external calls can be timed
+p2g.profiling.PROFILER.instrument_loaded()
+
+# in batch mode, errors on an OB are collected and reported at the end instead of stopping the run
+if batch:
+    p2g.common.BATCH_MODE = True
+    report = p2g.pipeline.ErrorReport()
+else:
+    report = None
+
+# GENERATE: create all OBs and their templates. Any error in the yml will stop us here, before anything is sent to P2
+obs = []
+for filename, cfg in zip(filenames, cfgs):
+    obs = obs + list(p2g.pipeline.generate_obs(cfg, resolver = resolver, report = report, filename = filename))
+# CHECK: all OBs are checked against the template schemas before anything is looked up or sent to P2, so that an
+# invalid OB does not stop the run after the others were uploaded (the rules which can stop an OB do not depend
+# on Simbad)
+obs = list(p2g.pipeline.validate_obs(obs, report = report))
+
+# RENDER: the previews of all OBs (or their overview) are written to files, and nothing is sent to P2
+if not(render is None) or not(overview is None):
+    resolved_obs = list(p2g.pipeline.resolve_obs(obs, resolver = resolver, report = report))
+    render_results = []
+    if not(render is None):
+        render_results = p2g.render.render_obs(resolved_obs, render, fov = fov, bg = bg, bglim = bglim, ft_c = FT_COLOR, sc_c = SC_COLOR, acq_only = acq_only)
+        p2g.render.print_report(render_results, render)
+    if not(overview is None):
+        overview_results = p2g.render.render_overview(resolved_obs, overview, fov = fov, ft_c = FT_COLOR, sc_c = SC_COLOR)
+        printinf("Overview of {} OB(s) written to {}".format(len([r for r in overview_results if r["success"]]), overview))
+        render_results = render_results + overview_results
+    if batch:
+        for result in render_results:
+            if not(result["success"]):
+                report.add(result["label"], "render", p2g.common.OBError(result["error"]))
+        report.print_report()
+    sys.exit(1 if batch and (len(report.errors) > 0) else 0)
+
+# connect to P2
+if "p2_url" in dargs:
+    # local fake server, for testing
+    connection = p2g.fakeP2.connect(dargs["p2_url"], runs = list(dict.fromkeys([cfg["setup"]["run_id"] for cfg in cfgs])))
+elif demo:
+    # import ESO P2 api
+    import p2api
+    # setup for testing on P2 demo server
+    connection = p2api.ApiConnection('demo', 52052, "tutorial")
+else:
+    # import ESO P2 api and getpass to manage user password
+    import p2api
+    from getpass import getpass
+    if credentials is None:
+        user = input("ESO P2 username: ")
+        password = getpass("ESO P2 password: ")
+    else:
+        user = credentials["username"]
+        password = credentials["password"]
+    connection = p2api.ApiConnection('production', user, password)
+# the P2 server and account, as the ids of the containers and OBs only make sense on one of them
+if "p2_url" in dargs:
+    scope = "fake:{}".format(dargs["p2_url"])
+elif demo:
+    scope = "demo"
+else:
+    scope = "production:{}".format(user)
+# the runs and containers listed on P2, kept for a few minutes for the next runs on the same server and account
+containers_cache = p2g.containerCache.ContainerCache()
+# (the in-memory fake server starts empty at each run)
+if not(no_cache) and (dargs["container_ttl"] > 0) and not(dargs.get("p2_url", None) == "memory"):
+    containers_cache.load(os.path.join(get_cache_dir(), "containers.json"), ttl = dargs["container_ttl"], scope = scope, refresh = refresh_cache)
+    # the changes are written at most every few seconds during the run, and at the end of it
+    atexit.register(containers_cache.save)
+# all calls go through a client which retries on transient errors, with a connection pool sized for the upload jobs
+api = p2g.p2client.P2Client(connection, pool_size = dargs["jobs"], containers = containers_cache)
+
+# find or create the folders (and concatenations) where to put the OBs. The runs and folders are only looked up
+# once for all the files
+containers = p2g.pipeline.ContainerIndex(api)
+# (when resuming, the concatenations created by the interrupted run are used again)
+with p2g.profiling.span("container"):
+    for cfg in cfgs:
+        containers.get_container(cfg["setup"], reuse = sync or resume)
+
+# all the objects created on P2 are recorded in the upload journal (not for the in-memory fake server)
+if not(dargs.get("p2_url", None) == "memory"):
+    journal = p2g.journal.UploadJournal(scope = scope)
+    for filename, cfg in zip(filenames, cfgs):
+        journal.record_container(filename, cfg["setup"], containers.get_container(cfg["setup"]))
+else:
+    journal = None
+
+# RESOLVE: the OBs are resolved on Simbad in the background, while the previous ones are reviewed or uploaded
+resolved_obs = p2g.pipeline.resolve_obs(obs, resolver = resolver, report = report)
+if ambiguity == "ask":
+    # the user may be asked which Simbad result to use: all OBs are resolved first, in the main thread, so that
+    # the questions are not asked from a background thread in the middle of the review or of the uploads
+    resolved_obs = list(resolved_obs)
+elif nogui:
+    resolved_obs = p2g.pipeline.prefetch(resolved_obs)
+# (in gui mode, the review prepares the next OBs in the background itself)
+
+# SYNC: compare all OBs with the content of the container, and only send what changed
+if sync:
+    # one plan per container
+    container_obs = dict({})
+    for p2ob in resolved_obs:
+        container_obs.setdefault(containers.get_container(p2ob.setup, reuse = sync), []).append(p2ob)
+    actions = []
+    with p2g.profiling.span("sync_plan"):
+        for container_id in container_obs:
+            actions = actions + [dict(action, container_id = container_id) for action in p2g.sync.plan_sync(api, container_obs[container_id], container_id, prune = prune)]
+    p2g.sync.print_plan(actions)
+    if dry_run:
+        if batch:
+            report.print_report()
+        printinf("Dry run: nothing was sent to P2")
+        sys.exit()
+    upload_pool = p2g.upload.UploadPool(api, jobs = dargs["jobs"], clone = clone, journal = journal)
+    for action in actions:
+        if action["action"] == "create":
+            upload_pool.submit(action["ob"], action["container_id"])
+        elif action["action"] == "update":
+            upload_pool.submit_call(action["label"], p2g.sync.apply_update, action)
+        elif action["action"] == "delete":
+            upload_pool.submit_call(action["label"], p2g.sync.apply_delete, action)
+    upload_results = upload_pool.wait()
+    p2g.upload.print_report(upload_results)
+
+# UPLOAD: in nogui mode, OBs are uploaded through a pool of workers
+elif nogui:
+    upload_pool = p2g.upload.UploadPool(api, jobs = dargs["jobs"], clone = clone, journal = journal, resume = resume)
+    for p2ob in resolved_obs:
+        upload_pool.submit(p2ob, containers.get_container(p2ob.setup))
+    upload_results = upload_pool.wait()
+    p2g.upload.print_report(upload_results)
+
+# REVIEW: in gui mode, we plot each OB and wait for user input. The next OBs are prepared in the background, and
+# the OBs accepted by the user are uploaded in the background while the next ones are reviewed
+else:
+    import p2Gravity.plot
+    p2g.profiling.PROFILER.instrument_loaded()
+    upload_pool = p2g.upload.UploadPool(api, jobs = max(2, dargs["jobs"]), clone = clone, journal = journal)
+    upload_results = p2g.review.review_obs(resolved_obs, upload_pool, lambda p2ob: containers.get_container(p2ob.setup),
+                                           fov = fov, bg = bg, bglim = bglim, ft_c = FT_COLOR, sc_c = SC_COLOR, acq_only = acq_only)
+    p2g.upload.print_report(upload_results)
+
+if batch:
+    report.add_upload_results(upload_results)
+    report.print_report()
 printinf("Done")
+if batch and (len(report.errors) > 0):
+    sys.exit(1)
@@ -1,3 +1,16 @@
 #coding: utf8
-from . import ob
-from . import tpl
+"""Tools to generate GRAVITY OBs and send them to P2.
+
+The submodules are only imported when first used (e.g. p2Gravity.ob, p2Gravity.plot), so that importing the package
+does not pull in astropy, matplotlib, astroquery or p2api.
+"""
+import importlib
+
+SUBMODULES = ["common", "ob", "tpl", "plot", "geometry", "render", "review", "planets", "sequence", "resolver", "targetCache", "containerCache", "upload", "journal", "pipeline", "p2client",
+              "sync", "validate", "fakeP2", "profiling", "benchmark", "version"]
+
+
+def __getattr__(name):
+    if name in SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
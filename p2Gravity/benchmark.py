@@ -0,0 +1,368 @@
+#coding: utf8
+"""Benchmark of the successive stages of create_obs.py on synthetic campaigns.
+
+Synthetic YML files of 10, 100 and 1000 OBs (cycling through all modes: single_on, single_off, dual_on, dual_off,
+dual_wide_on, dual_wide_off) are written to a temporary directory, and each stage is timed separately:
+- load: pipeline.load_yml
+- generate: creation of the OBs and generate_templates
+- resolve: simbad_resolve of all OBs, with a stubbed Simbad which returns synthetic records
+- plot: plot_ob (with the Agg backend) on up to plot_max OBs
+- p2_create and p2_update: upload to an in-memory fake P2 server (see fakeP2.py)
+
+Results are written as json, and can be compared to a previous run:
+
+    python -m p2Gravity.benchmark --sizes 10 100 --output bench.json
+    python -m p2Gravity.benchmark --sizes 10 100 --compare bench.json
+
+The import time of the package is also measured (in a fresh interpreter) against a budget, and heavy dependencies
+must not be imported by the package itself, nor by the commands of create_obs.py which do not need them (e.g.
+--help). This check can be run alone, and fails if a budget is exceeded:
+
+    python -m p2Gravity.benchmark --check_imports
+"""
+
+from . import common
+from . import pipeline
+from . import fakeP2
+from . import resolver as simbad_resolver
+
+import os
+import io
+import sys
+import json
+import time
+import datetime
+import platform
+import tempfile
+import argparse
+import contextlib
+import subprocess
+
+# default number of OBs of the campaigns, and max number of OBs to plot for each campaign
+DEFAULT_SIZES = [10, 100, 1000]
+DEFAULT_PLOT_MAX = 20
+# phases timed in each campaign
+PHASES = ["load", "generate", "resolve", "plot", "p2_create", "p2_update"]
+# a phase is considered as a regression if it is slower than this ratio compared to the reference
+REGRESSION_RATIO = 1.2
+# import time budget (in s) of some modules, and the dependencies which they must not import
+HEAVY_MODULES = ["matplotlib", "astroquery", "p2api", "whereistheplanet"]
+IMPORT_BUDGETS = [("p2Gravity", 0.1, HEAVY_MODULES + ["astropy"]),
+                  ("p2Gravity.targetCache", 0.2, HEAVY_MODULES + ["astropy"]),
+                  ("p2Gravity.pipeline", 3.0, HEAVY_MODULES)]
+# same for the commands of create_obs.py (run in a fresh interpreter, until they exit)
+SCRIPT_BUDGETS = [(["--help"], 1.0, HEAVY_MODULES + ["astropy", "numpy"])]
+# the modules reported as imported
+WATCHED_MODULES = HEAVY_MODULES + ["astropy", "numpy"]
+
+SETUP = dict({"run_id": "60.A-9252(M)",
+              "date": "2023-07-14",
+              "folder": "P2GRAVITY_benchmark",
+              "INS.SPEC.RES": "HIGH",
+              "INS.SPEC.POL": "OUT",
+              "ISS.BASELINE": ["UTs"],
+              "ISS.VLTITYPE": ["astrometry"],
+              "SEQ.MET.MODE": "FAINT",
+              "concatenation": "none",
+              "constraints": dict({"skyTransparency": "Variable, thin cirrus", "airmass": 1.6, "moonDistance": 10, "atm": "85%"})})
+
+
+def _exposure(name, dit = 1, ndit = 32, **kwargs):
+    obj = dict({"name": name, "DET2.DIT": dit, "DET2.NDIT.OBJECT": ndit, "DET2.NDIT.SKY": ndit})
+    obj.update(kwargs)
+    return obj
+
+
+def synthetic_ob(mode, k):
+    """
+    Return the yml dict of a synthetic OB of the given mode
+    @param k: index of the OB, used to give different targets and offsets to all OBs
+    """
+    target = "BENCH-{}".format(k)
+    ob = dict({"description": "Synthetic {} OB {}".format(mode, k), "mode": mode})
+    sep = 100 + (k % 50)*10
+    if mode == "single_on":
+        ob.update(dict({"target": target, "calib": False,
+                        "objects": dict({"s": _exposure(target, dit = 3)}),
+                        "sequence": ["s s sky", "s s"]}))
+    elif mode == "single_off":
+        ob.update(dict({"target": target,
+                        "objects": dict({"star": _exposure(target), "c": _exposure(target+" c", dit = 10, ndit = 16)}),
+                        "sequence": ["c c sky"]}))
+    elif mode == "dual_on":
+        ob.update(dict({"target": target, "calib": False,
+                        "objects": dict({"s": _exposure("star", coord_syst = "pasep", coord = [0, 0]),
+                                         "c1": _exposure("c1", dit = 30, ndit = 16, coord_syst = "pasep", coord = [sep, 100]),
+                                         "c2": _exposure("c2", dit = 30, ndit = 16, coord_syst = "radec", coord = [sep, -sep])}),
+                        "sequence": ["s sky", "c1 c1", "s", "c2 c2 sky", "s"]}))
+    elif mode == "dual_off":
+        ob.update(dict({"target": target, "calib": False, "coord_syst": "radec", "coord": [sep, 2*sep],
+                        "objects": dict({"sA": _exposure("Star_A"), "sB": _exposure("Star_B")}),
+                        "sequence": ["sky sA sA swap sB sB sky"]}))
+    elif mode == "dual_wide_on":
+        ob.update(dict({"ft_target": target+" B", "sc_target": target+" C",
+                        "objects": dict({"s": _exposure("Star_C", coord_syst = "pasep", coord = [0, 0])}),
+                        "sequence": ["s s sky"]}))
+    elif mode == "dual_wide_off":
+        ob.update(dict({"ft_target": target+" B", "sc_target": target+" C", "calib": False,
+                        "objects": dict({"sA": _exposure("Star_A"), "sB": _exposure("Star_B")}),
+                        "sequence": ["sky sA sA swap sB sB sky"]}))
+    return ob
+
+
+def synthetic_campaign(n_obs, modes = None):
+    """ return the yml dict of a campaign of n_obs OBs, cycling through the given modes """
+    if modes is None:
+        modes = list(pipeline.OB_CLASSES.keys())
+    obs = dict({})
+    for k in range(n_obs):
+        mode = modes[k % len(modes)]
+        obs["OB_{}_{}".format(k, mode)] = synthetic_ob(mode, k)
+    return dict({"setup": dict(SETUP), "ObservingBlocks": obs})
+
+
+def write_campaign(cfg, filename):
+    import ruamel.yaml as yaml
+    with open(filename, "w") as f:
+        yaml.YAML().dump(cfg, f)
+    return None
+
+
+def synthetic_record(name):
+    """ a Simbad record with plausible values, which only depends on the name """
+    k = sum([ord(c) for c in name])
+    return dict({"ra": (k*7.3) % 360, "dec": -60 + (k*1.7) % 80, "pmra": 10.0, "pmdec": -5.0, "plx_value": 20.0,
+                 "G": 8.0 + k % 5, "H": 6.0 + k % 5, "K": 6.0 + k % 5, "R": 8.0 + k % 5})
+
+
+class StubResolver(simbad_resolver.SimbadResolver):
+    """ A SimbadResolver which never queries Simbad, and resolves any name to a synthetic record """
+    def resolve_all(self, names):
+        for name in names:
+            if not(name in self.tables):
+                self._store(name, simbad_resolver.table_from_record(synthetic_record(name)))
+        return None
+
+    def _query_object(self, name):
+        return simbad_resolver.table_from_record(synthetic_record(name))
+
+
+class Timer(object):
+    """ accumulate the time spent in each phase, in total and by mode """
+    def __init__(self):
+        self.phases = dict({})
+        self.modes = dict({})
+        return None
+
+    @contextlib.contextmanager
+    def time(self, phase, mode = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[phase] = self.phases.get(phase, 0.) + elapsed
+            if not(mode is None):
+                self.modes.setdefault(mode, dict({}))
+                self.modes[mode][phase] = self.modes[mode].get(phase, 0.) + elapsed
+        return None
+
+
+def run_campaign(n_obs, workdir, plot_max = DEFAULT_PLOT_MAX):
+    """
+    Generate a synthetic campaign of n_obs OBs, and time all the phases from the yml to P2.
+    Return a dict with the time of each phase (total, and per OB), by mode, and the number of P2 calls
+    """
+    filename = os.path.join(workdir, "campaign_{}.yml".format(n_obs))
+    write_campaign(synthetic_campaign(n_obs), filename)
+    timer = Timer()
+    with timer.time("load"):
+        cfg = pipeline.load_yml(filename)
+    resolver = StubResolver()
+    obs = []
+    for ob_name in cfg["ObservingBlocks"]:
+        ob_yml = cfg["ObservingBlocks"][ob_name]
+        with timer.time("generate", ob_yml["mode"]):
+            ob = pipeline.make_ob(ob_name, ob_yml, cfg["setup"], resolver = resolver)
+            ob.generate_templates()
+        obs.append(ob)
+    with timer.time("resolve"):
+        names = simbad_resolver.collect_names(cfg)
+        resolver.resolve_all(names)
+    for ob in obs:
+        with timer.time("resolve", ob.yml["mode"]):
+            ob.simbad_resolve(ob.yml)
+    # plotting
+    from . import plot
+    n_plot = min(len(obs), plot_max)
+    for ob in obs[0:n_plot]:
+        with timer.time("plot", ob.yml["mode"]):
+            fig, gs = plot.plot_ob(ob, title = ob.label)
+            plot.plt.close(fig)
+    # upload to the fake P2
+    api = fakeP2.FakeP2Api(runs = [cfg["setup"]["run_id"]])
+    container_id = pipeline.get_container(api, cfg["setup"])
+    for ob in obs:
+        with timer.time("p2_create", ob.yml["mode"]):
+            ob.p2_create(api, container_id)
+        with timer.time("p2_update", ob.yml["mode"]):
+            ob.p2_update(api)
+    counts = dict({"n_obs": n_obs, "plot": n_plot})
+    result = dict({"n_obs": n_obs,
+                   "phases": dict({phase: dict({"total": timer.phases.get(phase, 0.),
+                                                "per_ob": timer.phases.get(phase, 0.)/max(counts.get(phase, n_obs), 1)}) for phase in PHASES}),
+                   "modes": timer.modes,
+                   "p2_calls": api.calls})
+    return result
+
+
+def _timed(statement):
+    """
+    Run a statement in a fresh interpreter (in the root of the repository), and return the time it took and the
+    list of heavy modules imported
+    """
+    code = ("import sys, time, json\n"
+            "start = time.perf_counter()\n"
+            "{}\n"
+            "print(json.dumps([time.perf_counter() - start, [m for m in {} if m in sys.modules]]))").format(statement, json.dumps(WATCHED_MODULES))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, "-c", code], cwd = root)
+    elapsed, loaded = json.loads(output.decode().strip().split("\n")[-1])
+    return elapsed, loaded
+
+
+def import_time(module_name):
+    """
+    Import a module in a fresh interpreter, and return the time it took and the list of heavy modules imported
+    """
+    return _timed("import {}".format(module_name))
+
+
+def script_time(args):
+    """
+    Run create_obs.py with the given arguments in a fresh interpreter (until it exits), and return the time it took
+    and the list of heavy modules imported
+    """
+    statement = ("import runpy\n"
+                 "sys.argv = {}\n"
+                 "try:\n"
+                 "    runpy.run_path(sys.argv[0], run_name = '__main__')\n"
+                 "except SystemExit:\n"
+                 "    pass").format(json.dumps(["create_obs.py"] + args))
+    return _timed(statement)
+
+
+def check_imports():
+    """
+    Check the import time of the modules in IMPORT_BUDGETS, and of the commands in SCRIPT_BUDGETS. Return a dict
+    with the time, budget and forbidden modules imported for each module or command, and the list of failures
+    """
+    results, failures = dict({}), []
+    checks = [(module_name, budget, forbidden, lambda module_name = module_name: import_time(module_name)) for module_name, budget, forbidden in IMPORT_BUDGETS]
+    checks = checks + [(" ".join(["create_obs.py"] + args), budget, forbidden, lambda args = args: script_time(args)) for args, budget, forbidden in SCRIPT_BUDGETS]
+    for module_name, budget, forbidden, timed in checks:
+        elapsed, loaded = timed()
+        loaded = [m for m in loaded if m in forbidden]
+        results[module_name] = dict({"time": elapsed, "budget": budget, "forbidden": loaded})
+        msg = "{}{}: {:.3f}s (budget {:.3f}s)".format("" if module_name.startswith("create_obs.py") else "import ", module_name, elapsed, budget)
+        if (elapsed > budget) or (len(loaded) > 0):
+            if len(loaded) > 0:
+                msg = msg + ", imports {}".format(loaded)
+            common.printwar(msg)
+            failures.append(module_name)
+        else:
+            common.printinf(msg)
+    return results, failures
+
+
+def git_commit():
+    """ commit of the repository, if available """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd = os.path.dirname(os.path.abspath(__file__)), stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes = DEFAULT_SIZES, plot_max = DEFAULT_PLOT_MAX, repeat = 1, verbose = False):
+    """
+    Run the benchmark for all sizes, and return the results as a json-like dict.
+    If repeat > 1, the best time of each phase is kept.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    results = dict({})
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_obs in sizes:
+            best = None
+            for k in range(repeat):
+                # the package is quite verbose, which we do not want to time
+                output = sys.stdout if verbose else io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    result = run_campaign(n_obs, workdir, plot_max = plot_max)
+                if best is None:
+                    best = result
+                else:
+                    for phase in PHASES:
+                        if result["phases"][phase]["total"] < best["phases"][phase]["total"]:
+                            best["phases"][phase] = result["phases"][phase]
+            results[str(n_obs)] = best
+            common.printinf("{} OBs: ".format(n_obs) + ", ".join(["{} {:.3f}s".format(phase, best["phases"][phase]["total"]) for phase in PHASES]))
+    imports, _ = check_imports()
+    return dict({"date": datetime.datetime.now().isoformat(),
+                 "commit": git_commit(),
+                 "python": platform.python_version(),
+                 "plot_max": plot_max,
+                 "imports": imports,
+                 "results": results})
+
+
+def compare(results, reference, ratio = REGRESSION_RATIO):
+    """
+    Print the time per OB of each phase compared to a reference run, and return the list of regressions
+    as (n_obs, phase, ratio)
+    """
+    regressions = []
+    for n_obs in results["results"]:
+        if not(n_obs in reference["results"]):
+            continue
+        for phase in PHASES:
+            new = results["results"][n_obs]["phases"][phase]["per_ob"]
+            old = reference["results"][n_obs]["phases"][phase]["per_ob"]
+            if old <= 0:
+                continue
+            r = new/old
+            msg = "{:>5} OBs {:>10}: {:.2e}s/OB -> {:.2e}s/OB (x{:.2f})".format(n_obs, phase, old, new, r)
+            if r > ratio:
+                common.printwar(msg)
+                regressions.append((n_obs, phase, r))
+            else:
+                common.printinf(msg)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the generation, resolution, plot and upload of synthetic OBs")
+    parser.add_argument("--sizes", type = int, nargs = "*", default = DEFAULT_SIZES, help = "number of OBs of the campaigns. Default is {}".format(DEFAULT_SIZES))
+    parser.add_argument("--plot_max", type = int, default = DEFAULT_PLOT_MAX, help = "max number of OBs plotted in each campaign. Default is {}".format(DEFAULT_PLOT_MAX))
+    parser.add_argument("--repeat", type = int, default = 1, help = "number of runs of each campaign, the best time of each phase is kept")
+    parser.add_argument("--output", type = str, default = None, help = "json file where to write the results")
+    parser.add_argument("--compare", type = str, default = None, help = "json file of a previous run to compare with")
+    parser.add_argument("--verbose", action = "store_true", help = "show the output of the package during the runs")
+    parser.add_argument("--check_imports", action = "store_true", help = "only check the import time budgets, and exit with 1 if one is exceeded")
+    dargs = vars(parser.parse_args())
+    if dargs["check_imports"]:
+        _, failures = check_imports()
+        sys.exit(1 if len(failures) > 0 else 0)
+    results = run_benchmark(sizes = dargs["sizes"], plot_max = dargs["plot_max"], repeat = dargs["repeat"], verbose = dargs["verbose"])
+    if not(dargs["output"] is None):
+        with open(dargs["output"], "w") as f:
+            json.dump(results, f, indent = 1)
+        common.printinf("Results written to {}".format(dargs["output"]))
+    else:
+        print(json.dumps(results, indent = 1))
+    if not(dargs["compare"] is None):
+        with open(dargs["compare"], "r") as f:
+            reference = json.load(f)
+        regressions = compare(results, reference)
+        if len(regressions) > 0:
+            sys.exit(1)
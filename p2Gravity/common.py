@@ -1,10 +1,26 @@
 #coding: utf8
 
 import sys
+import os
+
+def get_cache_dir():
+    """Return the directory used to store persistent caches, creating it if required.
+    Can be set using the P2GRAVITY_CACHE_DIR environment variable. Default to ~/.cache/p2Gravity
+    """
+    if "P2GRAVITY_CACHE_DIR" in os.environ:
+        cache_dir = os.environ["P2GRAVITY_CACHE_DIR"]
+    else:
+        cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "p2Gravity")
+    if not(os.path.isdir(cache_dir)):
+        os.makedirs(cache_dir)
+    return cache_dir
 
 # a function to find an item on the p2 server.
 # I took this from the old version of the GRAVITY p2 tools
 def find_item(item_name, containerId, api, item_type=None):
+    # the P2Client keeps an index of the containers, which are only listed once
+    if hasattr(api, "find_item"):
+        return api.find_item(item_name, containerId, item_type)
     items, itemsVersion = api.getItems(containerId)
     for it in items:
         b_name = it['name'] == item_name
@@ -40,8 +56,29 @@ def args_to_dict(args):
 def printwar(msg):
     print("[WARNING] " + msg)
 
+class OBError(Exception):
+    """
+    An error on a single OB, raised by printerr in batch mode instead of exiting. ob and stage (generate, resolve,
+    upload) are set by the pipeline when the error is collected
+    """
+    def __init__(self, msg, ob = None, stage = None):
+        super(OBError, self).__init__(msg)
+        self.msg = msg
+        self.ob = ob
+        self.stage = stage
+        return None
+
+# what to do when Simbad returns several objects for a name: ask the user, use the first one, use the brightest
+# one in K, or fail (see resolver.SimbadResolver)
+AMBIGUITY_POLICIES = ["ask", "first", "brightest", "fail"]
+
+# if True, printerr raises an OBError instead of exiting, so that a run can go on with the other OBs
+BATCH_MODE = False
+
 def printerr(msg):
     print("[ERROR] " + msg)
+    if BATCH_MODE:
+        raise OBError(msg)
     sys.exit()
 
 def printinf(msg):
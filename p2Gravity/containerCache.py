@@ -0,0 +1,231 @@
+#coding: utf8
+"""An index of the runs and containers (folders and concatenations) listed on P2.
+
+Each container is only listed once per session (api.getItems), and its items are indexed by name and type, so that
+finding a folder, a concatenation or an OB does not scan the listing again. The index is updated when p2Gravity
+creates, renames or deletes items, so that it stays in sync with P2 without listing the container again.
+
+The index can be kept on disk (containers.json in the p2Gravity cache dir) for a short time (DEFAULT_TTL minutes),
+so that consecutive runs do not list the same large runs again. Items created or deleted by other means (e.g. the
+P2 web interface) during this time are not seen: use create_obs.py --refresh_cache to list all containers again.
+
+The changes are not written at each call, but at most every SAVE_INTERVAL seconds, and when the session ends (see
+ContainerCache.save). The file is replaced atomically, so that an interrupted run does not leave a truncated index.
+"""
+
+from . import common
+
+import os
+import json
+import time
+import threading
+
+# time (in minutes) after which a listing stored on disk is not used anymore
+DEFAULT_TTL = 10
+# minimum time (in s) between two writes of the index to the disk during a session
+SAVE_INTERVAL = 5.
+# the keys of the objects returned by the createXxx calls which are kept in the index
+ITEM_KEYS = ["itemType", "name", "obId", "containerId"]
+
+
+def make_item(obj, item_type):
+    """ return the item (as listed by getItems) of an object returned by a createXxx call of the api """
+    item = dict({key: obj[key] for key in ITEM_KEYS if key in obj})
+    item.setdefault("itemType", item_type)
+    return item
+
+
+class ContainerCache(object):
+    def __init__(self, path = None, ttl = DEFAULT_TTL, scope = ""):
+        """
+        @param path: path to the json file where the index is kept. None to only keep it for the session
+        @param ttl: time (in minutes) after which a listing stored on disk is listed again. None to never expire
+        @param scope: name of the P2 server and account, as the ids of the containers only make sense on one server
+        """
+        self.path = None
+        self.ttl = ttl
+        self.scope = scope
+        self.runs = None
+        self.containers = dict({})
+        self._names = dict({})
+        self._obs = dict({})
+        self._other_scopes = dict({})
+        self._lock = threading.RLock()
+        # only one write of the file at a time, done outside of _lock
+        self._save_lock = threading.Lock()
+        self._dirty = False
+        self._saved = time.time()
+        if not(path is None):
+            self.load(path)
+        return None
+
+    def load(self, path, ttl = None, scope = None, refresh = False):
+        """
+        load the index from a json file, which is then updated with any new listing or item
+        @param ttl: time (in minutes) after which a listing stored on disk is listed again
+        @param scope: name of the P2 server and account
+        @param refresh: if True, nothing is loaded, but the file is still updated
+        """
+        self.path = path
+        if not(ttl is None):
+            self.ttl = ttl
+        if not(scope is None):
+            self.scope = scope
+        if refresh or not(os.path.isfile(path)):
+            return None
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f)
+        except ValueError:
+            common.printwar("Cannot read the container index from {}. Ignoring it".format(path))
+            return None
+        with self._lock:
+            self._other_scopes = dict({key: stored[key] for key in stored if not(key == self.scope)})
+            stored = stored.get(self.scope, dict({}))
+            if not(stored.get("runs", None) is None) and self._valid(stored["runs"]):
+                self.runs = stored["runs"]
+            for container_id in stored.get("containers", dict({})):
+                entry = stored["containers"][container_id]
+                if self._valid(entry):
+                    self.containers[int(container_id)] = entry
+                    self._index(int(container_id))
+        return None
+
+    def _valid(self, entry):
+        return (self.ttl is None) or (time.time() - entry["time"] < self.ttl*60.)
+
+    def save(self):
+        """
+        write the index to its json file (if it changed), with the entries of the other scopes found when loading it.
+        To be called at the end of the session
+        """
+        if self.path is None:
+            return None
+        with self._save_lock:
+            self._write()
+        return None
+
+    def _write(self):
+        """ write the index if it changed. _save_lock must be held """
+        # a snapshot of the index is taken in the lock, and written outside of it, so that the uploads go on
+        with self._lock:
+            if not(self._dirty):
+                return None
+            stored = dict(self._other_scopes)
+            containers = dict({container_id: dict(self.containers[container_id], items = list(self.containers[container_id]["items"])) for container_id in self.containers})
+            stored[self.scope] = dict({"runs": self.runs, "containers": containers})
+            self._dirty = False
+            self._saved = time.time()
+        # the file is replaced at once, and never left truncated
+        tmp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(stored, f)
+        os.replace(tmp_path, self.path)
+        return None
+
+    def _changed(self):
+        """ mark the index as changed, and write it if it was not written for SAVE_INTERVAL seconds """
+        with self._lock:
+            self._dirty = True
+            due = time.time() - self._saved >= SAVE_INTERVAL
+        # (skipped if another thread is already writing it)
+        if due and not(self.path is None) and self._save_lock.acquire(False):
+            try:
+                self._write()
+            finally:
+                self._save_lock.release()
+        return None
+
+    def _index(self, container_id):
+        """ (re)build the map (name, type) -> item of a container. The first item of a given name is kept """
+        names = dict({})
+        for item in self.containers[container_id]["items"]:
+            names.setdefault((item["name"], item["itemType"]), item)
+            names.setdefault((item["name"], None), item)
+            if "obId" in item:
+                self._obs[item["obId"]] = container_id
+        self._names[container_id] = names
+        return None
+
+    def get_runs(self):
+        """ return the runs (as returned by api.getRuns), or None if they have not been listed """
+        with self._lock:
+            if self.runs is None:
+                return None
+            return self.runs["runs"], self.runs["version"]
+
+    def set_runs(self, runs, version):
+        with self._lock:
+            self.runs = dict({"runs": runs, "version": version, "time": time.time()})
+        self._changed()
+        return None
+
+    def get_items(self, container_id):
+        """ return the items of a container (as returned by api.getItems), or None if it has not been listed """
+        with self._lock:
+            if not(container_id in self.containers):
+                return None
+            entry = self.containers[container_id]
+            return [dict(item) for item in entry["items"]], entry["version"]
+
+    def set_items(self, container_id, items, version):
+        with self._lock:
+            self.containers[container_id] = dict({"items": [dict(item) for item in items], "version": version, "time": time.time()})
+            self._index(container_id)
+        self._changed()
+        return None
+
+    def listed(self, container_id):
+        with self._lock:
+            return container_id in self.containers
+
+    def find(self, item_name, container_id, item_type = None):
+        """
+        Return the first item with this name (and type) in a container, or None. The container must have been
+        listed beforehand
+        """
+        with self._lock:
+            return self._names[container_id].get((item_name, item_type), None)
+
+    def add(self, container_id, item):
+        """
+        Add an item created in a container. Containers which have not been listed are left as they are. A new
+        folder or concatenation is known to be empty
+        """
+        with self._lock:
+            if container_id in self.containers:
+                self.containers[container_id]["items"].append(item)
+                self._names[container_id].setdefault((item["name"], item["itemType"]), item)
+                self._names[container_id].setdefault((item["name"], None), item)
+                if "obId" in item:
+                    self._obs[item["obId"]] = container_id
+            if ("containerId" in item) and not(item["itemType"] == "OB"):
+                self.containers[item["containerId"]] = dict({"items": [], "version": None, "time": time.time()})
+                self._index(item["containerId"])
+        self._changed()
+        return None
+
+    def rename(self, ob_id, name):
+        """ record the name of an OB (e.g. after saveOB), if it is in a listed container """
+        with self._lock:
+            container_id = self._obs.get(ob_id, None)
+            if not(container_id in self.containers):
+                return None
+            items = self.containers[container_id]["items"]
+            if all([not(item.get("obId", None) == ob_id) or (item["name"] == name) for item in items]):
+                return None
+            self.containers[container_id]["items"] = [dict(item, name = name) if item.get("obId", None) == ob_id else item for item in items]
+            self._index(container_id)
+        self._changed()
+        return None
+
+    def remove(self, ob_id):
+        """ remove a deleted OB """
+        with self._lock:
+            container_id = self._obs.pop(ob_id, None)
+            if not(container_id in self.containers):
+                return None
+            self.containers[container_id]["items"] = [item for item in self.containers[container_id]["items"] if not(item.get("obId", None) == ob_id)]
+            self._index(container_id)
+        self._changed()
+        return None
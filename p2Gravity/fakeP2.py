@@ -0,0 +1,378 @@
+#coding: utf8
+"""A local stand-in for the subset of the P2 API used by p2Gravity, to test the upload without the P2 servers.
+
+FakeP2Api keeps all runs, folders, concatenations, OBs and templates in memory, and implements the same methods
+(and return values) as p2api.ApiConnection: getRuns, getItems, createFolder, createConcatenation, createOB, getOB,
+saveOB, deleteOB, duplicateOB, createTemplate, getTemplates, getTemplate, setTemplateParams, deleteTemplate,
+and get/saveAbsoluteTimeConstraints. It can be configured with:
+- a latency added to each call,
+- an error rate, to randomly fail calls with a given http status (e.g. 503),
+- version checks, which fail calls made with an outdated version with a 412 status, like P2 does.
+
+It can also be served over http, to test the upload with real connections (and concurrency):
+
+    python -m p2Gravity.fakeP2 --port 5000 --latency 0.05 --error_rate 0.05 --runs "60.A-9252(M)"
+    python create_obs.py my_obs.yml --nogui --p2_url http://localhost:5000
+
+or used directly in the same process with --p2_url memory
+"""
+
+from . import common
+
+import copy
+import json
+import time
+import random
+import threading
+import argparse
+
+try:
+    from p2api import P2Error
+except ImportError:
+    class P2Error(Exception):
+        pass
+
+
+class FakeP2Api(object):
+    def __init__(self, runs = ["60.A-9252(M)"], latency = 0., error_rate = 0., error_status = 503, check_versions = True, seed = None):
+        """
+        @param runs: list of progId of the runs available
+        @param latency: time (in s) added to each call
+        @param error_rate: probability for a call to fail with error_status
+        @param error_status: http status of the injected errors
+        @param check_versions: if True, calls made with an outdated version fail with a 412 status
+        @param seed: seed of the random generator used for error injection
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.check_versions = check_versions
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+        self._next_id = 1000
+        # number of calls by method
+        self.calls = dict({})
+        # all items, by id. Containers have a list of children ids
+        self.runs = []
+        self.containers = dict({})
+        self.obs = dict({})
+        self.templates = dict({})
+        self.constraints = dict({})
+        self.versions = dict({})
+        for run_id in runs:
+            self.add_run(run_id)
+        return None
+
+    def add_run(self, run_id):
+        container_id = self._new_id()
+        self.runs.append(dict({"progId": run_id, "runId": container_id, "containerId": container_id, "instrument": "GRAVITY"}))
+        self.containers[container_id] = dict({"containerId": container_id, "itemType": "Run", "name": run_id, "children": []})
+        return container_id
+
+    def _new_id(self):
+        self._next_id = self._next_id + 1
+        return self._next_id
+
+    def _bump(self, key):
+        """ increase the version of an object, and return it """
+        version = "\"{}\"".format(self._new_id())
+        self.versions[key] = version
+        return version
+
+    def _error(self, status, method, msg):
+        return P2Error(status, method, "fakeP2", msg)
+
+    def _enter(self, method):
+        """ called at the start of each api call: count, sleep, and maybe fail """
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            fail = self._random.random() < self.error_rate
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if fail:
+            raise self._error(self.error_status, method, "Injected error")
+        return None
+
+    def _check(self, method, key, version):
+        if not(key in self.versions):
+            raise self._error(404, method, "Object {} not found".format(key))
+        if self.check_versions and (version != self.versions[key]):
+            raise self._error(412, method, "Precondition failed: version {} is outdated".format(version))
+        return None
+
+    def _container(self, method, container_id):
+        if not(container_id in self.containers):
+            raise self._error(404, method, "Container {} not found".format(container_id))
+        return self.containers[container_id]
+
+    def _item(self, item_id):
+        if item_id in self.obs:
+            ob = self.obs[item_id]
+            return dict({"obId": item_id, "itemType": "OB", "name": ob["name"], "obStatus": ob["obStatus"]})
+        container = self.containers[item_id]
+        return dict({"containerId": item_id, "itemType": container["itemType"], "name": container["name"]})
+
+    # runs and containers
+    def getRuns(self):
+        self._enter("getRuns")
+        with self._lock:
+            return copy.deepcopy(self.runs), self._bump("runs")
+
+    def getItems(self, containerId):
+        self._enter("getItems")
+        with self._lock:
+            container = self._container("getItems", containerId)
+            return [self._item(item_id) for item_id in container["children"]], self._bump(("items", containerId))
+
+    def getContainer(self, containerId):
+        self._enter("getContainer")
+        with self._lock:
+            self._container("getContainer", containerId)
+            if not(containerId in self.versions):
+                # runs
+                self._bump(containerId)
+            return self._item(containerId), self.versions[containerId]
+
+    def _create_container(self, method, containerId, name, item_type):
+        with self._lock:
+            parent = self._container(method, containerId)
+            container_id = self._new_id()
+            self.containers[container_id] = dict({"containerId": container_id, "itemType": item_type, "name": name, "children": []})
+            parent["children"].append(container_id)
+            version = self._bump(container_id)
+            return self._item(container_id), version
+
+    def createFolder(self, containerId, name):
+        self._enter("createFolder")
+        return self._create_container("createFolder", containerId, name, "Folder")
+
+    def createConcatenation(self, containerId, name):
+        self._enter("createConcatenation")
+        return self._create_container("createConcatenation", containerId, name, "Concatenation")
+
+    # OBs
+    def createOB(self, containerId, name):
+        self._enter("createOB")
+        with self._lock:
+            parent = self._container("createOB", containerId)
+            ob_id = self._new_id()
+            self.obs[ob_id] = dict({"obId": ob_id, "itemType": "OB", "name": name, "obStatus": "P",
+                                    "target": dict({"name": "", "ra": "00:00:00.000", "dec": "00:00:00.000", "properMotionRa": 0, "properMotionDec": 0}),
+                                    "constraints": dict({"name": "", "airmass": 2.0, "skyTransparency": "Variable, thin cirrus"}),
+                                    "obsDescription": dict({"name": "", "userComments": None})})
+            self.templates[ob_id] = []
+            self.constraints[ob_id] = []
+            self._bump(("atc", ob_id))
+            parent["children"].append(ob_id)
+            return copy.deepcopy(self.obs[ob_id]), self._bump(ob_id)
+
+    def getOB(self, obId):
+        self._enter("getOB")
+        with self._lock:
+            if not(obId in self.obs):
+                raise self._error(404, "getOB", "OB {} not found".format(obId))
+            return copy.deepcopy(self.obs[obId]), self.versions[obId]
+
+    def saveOB(self, ob, version):
+        self._enter("saveOB")
+        with self._lock:
+            self._check("saveOB", ob["obId"], version)
+            self.obs[ob["obId"]] = copy.deepcopy(ob)
+            return copy.deepcopy(ob), self._bump(ob["obId"])
+
+    def deleteOB(self, obId, version):
+        self._enter("deleteOB")
+        with self._lock:
+            self._check("deleteOB", obId, version)
+            del self.obs[obId]
+            del self.templates[obId]
+            for container in self.containers.values():
+                if obId in container["children"]:
+                    container["children"].remove(obId)
+            return None
+
+    def duplicateOB(self, obId, containerId = 0):
+        self._enter("duplicateOB")
+        with self._lock:
+            if not(obId in self.obs):
+                raise self._error(404, "duplicateOB", "OB {} not found".format(obId))
+            parent = self._container("duplicateOB", containerId)
+            ob_id = self._new_id()
+            ob = copy.deepcopy(self.obs[obId])
+            ob["obId"] = ob_id
+            self.obs[ob_id] = ob
+            self.templates[ob_id] = []
+            for template in self.templates[obId]:
+                template = copy.deepcopy(template)
+                template["templateId"] = self._new_id()
+                self._bump((ob_id, template["templateId"]))
+                self.templates[ob_id].append(template)
+            self.constraints[ob_id] = copy.deepcopy(self.constraints[obId])
+            self._bump(("atc", ob_id))
+            parent["children"].append(ob_id)
+            return copy.deepcopy(ob), self._bump(ob_id)
+
+    # templates
+    def _template(self, method, obId, templateId):
+        if not(obId in self.templates):
+            raise self._error(404, method, "OB {} not found".format(obId))
+        for template in self.templates[obId]:
+            if template["templateId"] == templateId:
+                return template
+        raise self._error(404, method, "Template {} not found".format(templateId))
+
+    def createTemplate(self, obId, templateName):
+        self._enter("createTemplate")
+        with self._lock:
+            if not(obId in self.templates):
+                raise self._error(404, "createTemplate", "OB {} not found".format(obId))
+            template_id = self._new_id()
+            template = dict({"templateId": template_id, "templateName": templateName, "type": "science", "parameters": []})
+            self.templates[obId].append(template)
+            return copy.deepcopy(template), self._bump((obId, template_id))
+
+    def getTemplates(self, obId):
+        self._enter("getTemplates")
+        with self._lock:
+            if not(obId in self.templates):
+                raise self._error(404, "getTemplates", "OB {} not found".format(obId))
+            return copy.deepcopy(self.templates[obId]), self._bump(("templates", obId))
+
+    def getTemplate(self, obId, templateId):
+        self._enter("getTemplate")
+        with self._lock:
+            template = self._template("getTemplate", obId, templateId)
+            return copy.deepcopy(template), self.versions[(obId, templateId)]
+
+    def setTemplateParams(self, obId, template, params, version):
+        self._enter("setTemplateParams")
+        with self._lock:
+            current = self._template("setTemplateParams", obId, template["templateId"])
+            self._check("setTemplateParams", (obId, template["templateId"]), version)
+            # the fake templates have no schema, and accept any parameter
+            values = dict({param["name"]: param["value"] for param in template["parameters"]})
+            values.update(params)
+            current["parameters"] = [dict({"name": key, "value": values[key]}) for key in values]
+            return copy.deepcopy(current), self._bump((obId, template["templateId"]))
+
+    def deleteTemplate(self, obId, templateId, version):
+        self._enter("deleteTemplate")
+        with self._lock:
+            template = self._template("deleteTemplate", obId, templateId)
+            self._check("deleteTemplate", (obId, templateId), version)
+            self.templates[obId].remove(template)
+            return None
+
+    # time constraints
+    def getAbsoluteTimeConstraints(self, obId):
+        self._enter("getAbsoluteTimeConstraints")
+        with self._lock:
+            if not(obId in self.constraints):
+                raise self._error(404, "getAbsoluteTimeConstraints", "OB {} not found".format(obId))
+            return copy.deepcopy(self.constraints[obId]), self.versions[("atc", obId)]
+
+    def saveAbsoluteTimeConstraints(self, obId, timeConstraints, version):
+        self._enter("saveAbsoluteTimeConstraints")
+        with self._lock:
+            self._check("saveAbsoluteTimeConstraints", ("atc", obId), version)
+            self.constraints[obId] = copy.deepcopy(timeConstraints)
+            return copy.deepcopy(timeConstraints), self._bump(("atc", obId))
+
+
+# methods which can be called through the http server
+METHODS = ["getRuns", "getItems", "getContainer", "createFolder", "createConcatenation", "createOB", "getOB", "saveOB", "deleteOB", "duplicateOB",
+           "createTemplate", "getTemplates", "getTemplate", "setTemplateParams", "deleteTemplate",
+           "getAbsoluteTimeConstraints", "saveAbsoluteTimeConstraints"]
+
+
+def make_server(api, host = "localhost", port = 5000):
+    """
+    Create an http server exposing the given FakeP2Api. Each method is called with a POST on /<method>, with
+    a json body {"args": [...]}, and returns {"result": ...}, or {"error": message} with the http status of the error
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # keep-alive
+        def do_POST(self):
+            method = self.path.strip("/")
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or "{}")
+            status, answer = 200, None
+            if not(method in METHODS):
+                status, answer = 404, dict({"error": "Unknown method {}".format(method)})
+            else:
+                try:
+                    answer = dict({"result": getattr(api, method)(*body.get("args", []))})
+                except P2Error as e:
+                    status, answer = e.args[0], dict({"error": e.args[3]})
+            data = json.dumps(answer).encode("utf8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return None
+        def log_message(self, *args):
+            return None
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+class FakeP2Connection(object):
+    def __init__(self, url):
+        """
+        A connection to a fake P2 server started with make_server, with the same methods as p2api.ApiConnection
+        @param url: url of the server, e.g. http://localhost:5000
+        """
+        import requests
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        return None
+
+    def _call(self, method, *args):
+        r = self.session.post("{}/{}".format(self.url, method), data = json.dumps(dict({"args": list(args)})), headers = dict({"Content-Type": "application/json"}))
+        answer = r.json()
+        if r.status_code != 200:
+            raise P2Error(r.status_code, method, self.url, answer["error"])
+        # methods return a (value, version) tuple, sent as a list
+        if answer["result"] is None:
+            return None
+        return tuple(answer["result"])
+
+    def __getattr__(self, name):
+        if not(name in METHODS):
+            raise AttributeError(name)
+        def method(*args):
+            return self._call(name, *args)
+        return method
+
+
+def connect(url, runs = []):
+    """
+    Return an api object for the given --p2_url: a FakeP2Api in this process if url is 'memory', or a connection
+    to a fake P2 server otherwise
+    @param runs: runs to create in the in-memory api
+    """
+    if url == "memory":
+        common.printinf("Using an in-memory fake P2 server")
+        return FakeP2Api(runs = runs)
+    common.printinf("Using the fake P2 server at {}".format(url))
+    return FakeP2Connection(url)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Start a local fake P2 server")
+    parser.add_argument("--host", type = str, default = "localhost")
+    parser.add_argument("--port", type = int, default = 5000)
+    parser.add_argument("--runs", type = str, nargs = "*", default = ["60.A-9252(M)"], help = "progId of the runs available on the server")
+    parser.add_argument("--latency", type = float, default = 0., help = "time (in s) added to each call")
+    parser.add_argument("--error_rate", type = float, default = 0., help = "probability for a call to fail with error_status")
+    parser.add_argument("--error_status", type = int, default = 503, help = "http status of the injected errors")
+    parser.add_argument("--no_version_check", action = "store_true", help = "do not check the versions given in the calls")
+    dargs = vars(parser.parse_args())
+    api = FakeP2Api(runs = dargs["runs"], latency = dargs["latency"], error_rate = dargs["error_rate"], error_status = dargs["error_status"],
+                    check_versions = not(dargs["no_version_check"]))
+    server = make_server(api, host = dargs["host"], port = dargs["port"])
+    common.printinf("Fake P2 server listening on http://{}:{}".format(dargs["host"], dargs["port"]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        common.printinf("Calls received: {}".format(api.calls))
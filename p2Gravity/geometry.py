@@ -0,0 +1,115 @@
+#coding: utf8
+"""The geometry of an OB, as shown in its preview.
+
+ObGeometry gathers, once per OB, everything the plot functions need: the positions of the FT and SC fibers, the
+direction of the acquisition, and for each template its swap state, the positions of the SC fiber (cumulative
+SEQ.RELOFF offsets), and the exposure times. The coordinates of the targets (for GRAVITY-wide) are parsed in a
+single SkyCoord, and the offsets of all exposures are computed with numpy.
+"""
+
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+import numpy as np
+
+WIDE_TYPES = ["DualWideOnOb", "DualWideOffOb"]
+DUAL_TYPES = ["DualOffOb", "DualOnOb"]
+SWAP_TEMPLATE = "GRAVITY_dual_obs_swap"
+
+
+def wide_positions(ob):
+    """
+    Return the positions (xft, yft), (xsc, ysc) of the FT and SC fibers of a GRAVITY-wide OB, relative to the
+    acquisition target (in arcsec)
+    """
+    coords = SkyCoord([ob.acquisition["COU.FTS.ALPHA"], ob.target["ra"]], [ob.acquisition["COU.FTS.DELTA"], ob.target["dec"]], unit = (u.hourangle, u.deg))
+    pa = coords[0].position_angle(coords[1]).to(u.rad).value
+    sep = coords[0].separation(coords[1]).to(u.arcsec).value
+    if ob.acquisition["COU.NGS.SOURCE"] == "FT":
+        return (0, 0), (np.sin(pa)*sep, np.cos(pa)*sep)
+    elif ob.acquisition["COU.NGS.SOURCE"] == "SCIENCE":
+        return (-np.sin(pa)*sep, -np.cos(pa)*sep), (0, 0)
+    # not implemented
+    return (0, 0), (0, 0)
+
+
+def pa_sep(x, y):
+    """ position angles (deg) and separations of offsets, rounded to 0.01 """
+    return np.round(np.rad2deg(np.arctan2(x, y)), 2), np.round(np.hypot(x, y), 2)
+
+
+class ObGeometry(object):
+    def __init__(self, ob):
+        """
+        @param ob: a generated (and resolved, for GRAVITY-wide) ObservingBlock
+        """
+        self.ob = ob
+        self.wide = ob.ob_type in WIDE_TYPES
+        # fiber fov from telescope type
+        if "UTs" in ob.acquisition["ISS.BASELINE"]:
+            self.fiber_fov = 30
+        else: # ATs
+            self.fiber_fov = 120
+        if ob.ob_type in DUAL_TYPES:
+            self.sobj = (ob.acquisition["SEQ.INS.SOBJ.X"], ob.acquisition["SEQ.INS.SOBJ.Y"])
+        else:
+            self.sobj = (0, 0)
+        if self.wide:
+            self.ft, self.sc = wide_positions(ob)
+        else:
+            self.ft, self.sc = (0, 0), self.sobj
+        # swap state in which each template is done
+        is_swap = np.array([template.template_name == SWAP_TEMPLATE for template in ob.templates], dtype = bool)
+        self.swaps = (-1)**np.concatenate([[0], np.cumsum(is_swap)[:-1]]) if len(is_swap) > 0 else np.zeros(0, dtype = int)
+        self.templates = [self._template(ob.templates[k], int(self.swaps[k])) for k in range(len(ob.templates))]
+        return None
+
+    def _template(self, template, swap):
+        """ the geometry of a template done in the given swap state """
+        geometry = dict({"swap": swap, "sobj": (swap*self.sobj[0], swap*self.sobj[1]) if self.ob.ob_type in DUAL_TYPES else (0, 0)})
+        if "SEQ.RELOFF.X" in template:
+            dx, dy = np.array(template["SEQ.RELOFF.X"], dtype = float), np.array(template["SEQ.RELOFF.Y"], dtype = float)
+            geometry["reloff"] = (dx, dy)
+            geometry["reloff_pa"], geometry["reloff_sep"] = pa_sep(dx, dy)
+            geometry["positions"] = self.positions(geometry["sobj"], geometry["reloff"])
+        if "DET2.DIT" in template:
+            sequence = template["SEQ.OBSSEQ"]
+            geometry["exptime"] = sequence.count("O")*template["DET2.DIT"]*template["DET2.NDIT.OBJECT"]
+            geometry["exptime_sky"] = sequence.count("S")*template["DET2.DIT"]*template["DET2.NDIT.SKY"]
+        return geometry
+
+    @staticmethod
+    def positions(sobj, reloff):
+        """
+        The positions of the SC fiber (x, y, pa, sep) at each exposure of a template, from the offset sobj of the
+        object and the cumulative relative offsets reloff = (dx, dy)
+        """
+        dx, dy = reloff
+        x = np.cumsum(np.concatenate([[sobj[0]], dx]))[1:]
+        y = np.cumsum(np.concatenate([[sobj[1]], dy]))[1:]
+        pa, sep = pa_sep(x, y)
+        return x, y, pa, sep
+
+    def template(self, template):
+        """ return the geometry of a template of the OB """
+        for k in range(len(self.ob.templates)):
+            if self.ob.templates[k] is template:
+                return self.templates[k]
+        raise KeyError("Template {} is not in OB '{}'".format(template.template_name, self.ob.label))
+
+    def acq_direction(self):
+        """ the direction (x, y) of the line shown through the acquisition, or None """
+        if self.wide:
+            if self.ob.ob_type == "DualWideOnOb":
+                return (np.mean(np.array([tpl["SEQ.RELOFF.X"] for tpl in self.ob.templates])),
+                        np.mean(np.array([tpl["SEQ.RELOFF.Y"] for tpl in self.ob.templates])))
+            return (self.sc[0] - self.ft[0], self.sc[1] - self.ft[1])
+        if self.ob.acquisition.template_name in ["GRAVITY_dual_onaxis_acq", "GRAVITY_dual_offaxis_acq"]:
+            return (self.ob.acquisition["SEQ.INS.SOBJ.X"], self.ob.acquisition["SEQ.INS.SOBJ.Y"])
+        return None
+
+    def total_exptime(self):
+        """ total exposure time (object, sky) of the OB, in s """
+        exptime = sum([geometry.get("exptime", 0) for geometry in self.templates])
+        exptime_sky = sum([geometry.get("exptime_sky", 0) for geometry in self.templates])
+        return exptime, exptime_sky
@@ -0,0 +1,116 @@
+#coding: utf8
+"""An append-only journal of the objects created on P2 during the uploads.
+
+Each line of the journal is a json record of one step of an upload, for an OB identified by its yml file and label:
+
+    {"scope": "demo", "file": "/path/to/obs.yml", "ob": "GJ65", "event": "ob", "ob_id": 1234, "container_id": 12, ...}
+
+with the events:
+- container: the folder (and concatenation) where the OBs of the file are put
+- ob: the OB has been created on P2 (empty, or duplicated from a prototype)
+- templates: all the templates of the OB have been created (template_ids)
+- done: all the parameters have been sent (version is the last version of the OB)
+
+Lines are only appended (and flushed to the disk) as the uploads progress, so that the journal is still valid if the
+run is interrupted. With create_obs.py --resume, the OBs which are done are skipped, and the OBs which were only
+partially created are completed instead of being created again (see UploadPool).
+"""
+
+from . import common
+
+import os
+import json
+import time
+import threading
+
+# default file of the journal, in the p2Gravity cache dir
+DEFAULT_JOURNAL_FILE = "upload_journal.jsonl"
+
+
+class UploadJournal(object):
+    def __init__(self, path = None, scope = ""):
+        """
+        @param path: path to the journal file. Default to upload_journal.jsonl in the p2Gravity cache dir
+        @param scope: name of the P2 server and account, as the ids of the OBs only make sense on one server
+        """
+        if path is None:
+            path = os.path.join(common.get_cache_dir(), DEFAULT_JOURNAL_FILE)
+        self.path = path
+        self.scope = scope
+        # last state of each OB, merged from all its records
+        self.states = dict({})
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(path, "a")
+        return None
+
+    def _load(self):
+        if not(os.path.isfile(self.path)):
+            return None
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # last line of an interrupted run
+                    continue
+                if record.get("scope", None) == self.scope:
+                    self._apply(record)
+        return None
+
+    def _apply(self, record):
+        key = (record["file"], record["ob"])
+        if record["event"] == "ob":
+            # a new OB on P2: forget the previous one
+            self.states[key] = dict(record)
+        else:
+            self.states.setdefault(key, dict({})).update(record)
+        return None
+
+    @staticmethod
+    def source(ob):
+        """ the yml file of an OB, as stored in the journal """
+        if ob.filename is None:
+            return None
+        return os.path.abspath(ob.filename)
+
+    def record(self, filename, label, event, **values):
+        """
+        Append a record to the journal
+        @param filename: the yml file of the OB
+        @param label: label of the OB (or None for a container)
+        @param event: container, ob, templates or done
+        """
+        record = dict({"time": time.time(), "scope": self.scope, "file": filename, "ob": label, "event": event})
+        record.update(values)
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._apply(record)
+        return None
+
+    def record_ob(self, ob, event, **values):
+        """ append a record about an OB (see record) """
+        return self.record(self.source(ob), ob.label, event, **values)
+
+    def record_container(self, filename, setup, container_id):
+        """ append the container where the OBs of a yml file are put """
+        return self.record(os.path.abspath(filename), None, "container", container_id = container_id, run_id = setup["run_id"],
+                           folder = setup["folder"], concatenation = setup["concatenation"].strip())
+
+    def get(self, ob):
+        """
+        Return the last state of an OB (a dict with its event, ob_id, container_id, template_ids and version), or
+        None if it was never created
+        """
+        with self._lock:
+            state = self.states.get((self.source(ob), ob.label), None)
+            if (state is None) or not("ob_id" in state):
+                return None
+            return dict(state)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        return None
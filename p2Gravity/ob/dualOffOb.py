@@ -4,19 +4,11 @@
 
 from .. import tpl
 from .. import common
+from .. import sequence
 from .observingBlock import ObservingBlock
 
-# import re to properly split swap in sequence
-import re
 import numpy as np
 
-# to resolve planet position
-try:
-    import whereistheplanet
-    WHEREISTHEPLANET = True    
-except:
-    common.printwar("Cannot load whereistheplanet module. 'whereistheplanet' will not be available as a coord_syst.")
-    WHEREISTHEPLANET = False    
 
 class DualOffOb(ObservingBlock):
     def __init__(self, *args, **kwargs):
@@ -56,66 +48,32 @@ class DualOffOb(ObservingBlock):
         self.acquisition.populate_from_yml(self.setup)
         self.acquisition.populate_from_yml(self.yml)
         if "coord_syst" in self.yml:
-            if self.yml["coord_syst"] == "radec":
-                self.acquisition["SEQ.INS.SOBJ.X"] = round(self.yml["coord"][0], 2)
-                self.acquisition["SEQ.INS.SOBJ.Y"] = round(self.yml["coord"][1], 2)
-            elif self.yml["coord_syst"] == "pasep":
-                pa, sep = self.yml["coord"]
-                ra, dec = np.sin(np.deg2rad(pa))*sep, np.cos(np.deg2rad(pa))*sep
-                self.acquisition["SEQ.INS.SOBJ.X"] = round(ra, 2)
-                self.acquisition["SEQ.INS.SOBJ.Y"] = round(dec, 2)
-            elif self.yml["coord_syst"] == "whereistheplanet":
-                if WHEREISTHEPLANET:
-                    common.printinf("Resolution of {} with whereistheplanet:".format(self.yml["coord"]))
-                    ra, dec, sep, pa = whereistheplanet.predict_planet(self.yml["coord"], self.setup["date"])
-                    self.acquisition["SEQ.INS.SOBJ.X"] = round(ra[0], 2)
-                    self.acquisition["SEQ.INS.SOBJ.Y"] = round(dec[0], 2)                  
-                else: 
-                    common.printerr("whereistheplanet used as a coord_syst, but whereistheplanet module could not be loaded")
-            else:
-                common.printerr("Unknown coordinate system {}".format(self.yml["coord_syst"]))
+            ra, dec = sequence.object_offset(self.yml, date = self.setup["date"])
+            self.acquisition["SEQ.INS.SOBJ.X"] = round(ra, 2)
+            self.acquisition["SEQ.INS.SOBJ.Y"] = round(dec, 2)
         return None
 
-    def _generate_template(self, exposures):
+    def _generate_template(self, seq, offsets):
         """
-        generate the template from the given yml dict and exposure 
+        generate the template from the given compiled sequence and offsets of the objects
         """        
-        if exposures == "swap":
+        if seq.is_swap():
             template = tpl.DualObsSwap()            
             template.populate_from_yml(self.yml)
         else:
             template = tpl.DualObsExp(iscalib = self.iscalib)
-            template.populate_offsets_from_object_yml(exposures, self.objects, date = self.setup["date"])
+            template.populate_offsets_from_sequence(seq, self.objects, offsets)
         return template
 
     def generate_templates(self):
         """
         generate the sequence of templates corresponding to the OB. Nothing is send to P2 at this point
         """
-        # split sequences on swaps:
-        sequences = []
-        for seq in self.yml["sequence"]:
-            for dummy in re.split("(\W|\A)(swap)", seq.rstrip().lstrip()):
-                dummy = dummy.rstrip().lstrip()
-                if dummy != "":
-                    sequences.append(dummy)
+        # swaps are templates on their own
+        sequences = sequence.compile_sequences(self.yml["sequence"], self.objects, ob_label = self.label, split_swap = True)
+        offsets = sequence.object_offsets(self.objects, sequences, date = self.setup["date"])
         for seq in sequences:
-            exposures = seq.rstrip().lstrip().split(" ")
-            if exposures == ["swap"]: # no test in this case
-                self.templates.append(self._generate_template("swap"))
-            else:
-                if len(set([dummy for dummy in exposures if dummy != "sky"])) > 1: # more than one object which is not sky
-                    if len(set([self.objects[dummy]["DET2.DIT"] for dummy in exposures if dummy != "sky"])) > 1 : # check if all dits are the same
-                        common.printerr("Sequence '{}' in OB '{}' contains objects with different DET2.DIT. Please split them on different lines.".format(exposures, self.label))
-                    if len(set([self.objects[dummy]["DET2.NDIT.SKY"] for dummy in exposures if dummy != "sky"])) > 1 : # check if all dits are the same
-                        common.printerr("Sequence '{}' in OB '{}' contains objects with different DET2.NDIT.SKY.. Please split them on different lines.".format(exposures, self.label))
-                    if len(set([self.objects[dummy]["DET2.NDIT.OBJECT"] for dummy in exposures if dummy != "sky"])) > 1 : # check if all dits are the same
-                        common.printerr("Sequence '{}' in OB '{}' contains objects with different DET2.NDIT.OBJECT. Please split them on different lines.".format(exposures, self.label))
-                if not("sky" in exposures):
-                    common.printwar("No sky in sequence {} in OB '{}'".format(exposures, self.label))
-                self.templates.append(self._generate_template(exposures))
+            self.templates.append(self._generate_template(seq, offsets))
         # now we can generate acquisition                
         self._generate_acquisition()
         return None
-            
-
@@ -4,6 +4,7 @@
 
 from .. import tpl
 from .. import common
+from .. import sequence
 from .observingBlock import ObservingBlock
 import numpy as np
 
@@ -58,32 +59,22 @@ class DualOnOb(ObservingBlock):
         self.acquisition.populate_from_yml(self.setup)
         return None
 
-    def _generate_template(self, exposures):
+    def _generate_template(self, seq, offsets):
         """
-        geneate the template from the given yml dict and exposure 
+        geneate the template from the given compiled sequence and offsets of the objects
         """
         template = tpl.DualObsExp(iscalib = self.iscalib)
-        template.populate_offsets_from_object_yml(exposures, self.objects, date = self.setup["date"])
+        template.populate_offsets_from_sequence(seq, self.objects, offsets)
         return template
 
     def generate_templates(self):
         """
         generate the sequence of templates corresponding to the OB. Nothing is send to P2 at this point
         """
-        for seq in self.yml["sequence"]:
-            exposures = seq.split()
-            if not("sky" in exposures):
-                common.printwar("No sky in sequence {} in OB '{}'".format(exposures, self.label))
-            if len(set([dummy for dummy in exposures if dummy != "sky"])) > 1: # more than one object which is not sky
-                if len(set([self.objects[dummy]["DET2.DIT"] for dummy in exposures if dummy != "sky"])) > 1 : # check if all dits are the same
-                    common.printerr("Sequence '{}' in OB '{}' contains objects with different DET2.DIT. Please split them on different lines.".format(exposures, self.label))
-                if len(set([self.objects[dummy]["DET2.NDIT.SKY"] for dummy in exposures if dummy != "sky"])) > 1 : # check if all dits are the same
-                    common.printerr("Sequence '{}' in OB '{}' contains objects with different DET2.NDIT.SKY.. Please split them on different lines.".format(exposures, self.label))
-                if len(set([self.objects[dummy]["DET2.NDIT.OBJECT"] for dummy in exposures if dummy != "sky"])) > 1 : # check if all dits are the same
-                    common.printerr("Sequence '{}' in OB '{}' contains objects with different DET2.NDIT.OBJECT. Please split them on different lines.".format(exposures, self.label))
-            self.templates.append(self._generate_template(exposures))
+        sequences = sequence.compile_sequences(self.yml["sequence"], self.objects, ob_label = self.label)
+        offsets = sequence.object_offsets(self.objects, sequences, date = self.setup["date"])
+        for seq in sequences:
+            self.templates.append(self._generate_template(seq, offsets))
         # now we can generate acquisition
         self._generate_acquisition()
         return None
-            
-
@@ -4,39 +4,16 @@
 
 from .. import tpl
 from .. import common
+from .. import planets
 from .observingBlock import ObservingBlock
 from .dualOffOb import DualOffOb
 from .dualOnOb import DualOnOb
 
-# we need astroquery to get magnitudes, coordinates, etc.
-from astroquery.simbad import Simbad
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 
-# going for 0.4.7 to 0.4.8 has changed case in some astroquery fields. We need to take care of it.
-import astroquery
-from packaging.version import Version
-ASTROQUERY_OLD = Version(astroquery.__version__) < Version("0.4.8")
-ASTROQUERY_TRANSLATION = dict({"RA": "ra",
-                               "DEC": "dec",
-                               "PMRA": "pmra",
-                               "PMDEC": "pmdec",
-                               "PLX": "plx",
-                               "FLUX_G": "G",
-                               "FLUX_H": "H",
-                               "FLUX_K": "K",
-                               "FLUX_R": "R"})
-
 import math
 
-# to resolve planet position
-try:
-    import whereistheplanet
-    WHEREISTHEPLANET = True    
-except:
-    common.printwar("Cannot load whereistheplanet module. 'whereistheplanet' will not be available as a coord_syst.")
-    WHEREISTHEPLANET = False    
-
 
 class DualWideOb(ObservingBlock):
     def __init__(self, *args, **kwargs):
@@ -82,28 +59,8 @@ class DualWideOb(ObservingBlock):
 
         # RESOLVE SC TARGET
         target_name = ob["sc_target"]
-        common.printinf("Resolving target {} on Simbad".format(target_name))
-        target_table = Simbad.query_object(target_name)
-        if target_table is None:
-            raise ValueError('Input not known by Simbad')
-        common.printinf("Simbad resolution of {}: \n {}".format(target_name, target_table))
-        if len(target_table) > 1:
-            printwar("There are multiple results from Simbad. Which one should I use? (1, 2, etc.?)")
-            stop()
-
-        # to ensure compatibility with all versions of astroquery
-        table_d = dict(target_table)
-        if ASTROQUERY_OLD:
-            table_translated = dict({})
-            for key in table_d:
-                if key in ASTROQUERY_TRANSLATION:
-                    table_translated[ASTROQUERY_TRANSLATION[key]] = table_d[key]
-                else:
-                    table_translated[key] = table_d[key]
-        else:
-            table_translated = table_d            
-        target_table = table_translated
-        
+        target_table = self.simbad_get_table(target_name)
+
         # populate the "target" tab using the SC target
         self.target = dict({})
         self.target["name"] = target_name 
@@ -113,28 +70,8 @@ class DualWideOb(ObservingBlock):
 
         # now we resolve FT target
         target_name = ob["ft_target"]
-        common.printinf("Resolving target {} on Simbad".format(target_name))
-        target_table = Simbad.query_object(target_name)
-        if target_table is None:
-            raise ValueError('Input not known by Simbad')
-        common.printinf("Simbad resolution of {}: \n {}".format(target_name, target_table))
-        if len(target_table) > 1:
-            printwar("There are multiple results from Simbad. Which one should I use? (1, 2, etc.?)")
-            stop()
-
-        # to ensure compatibility with all versions of astroquery
-        table_d = dict(target_table)
-        if ASTROQUERY_OLD:
-            table_translated = dict({})
-            for key in table_d:
-                if key in ASTROQUERY_TRANSLATION:
-                    table_translated[ASTROQUERY_TRANSLATION[key]] = table_d[key]
-                else:
-                    table_translated[key] = table_d[key]
-        else:
-            table_translated = table_d            
-        target_table = table_translated
-            
+        target_table = self.simbad_get_table(target_name)
+
         # populate FT in the acq template
         self.acquisition._populate_ft_target_from_simbad(target_table = target_table, target_name = target_name)
         
@@ -180,13 +117,9 @@ class DualWideOnOb(DualOnOb, DualWideOb):
                 pa, sep = ob["coord"]
                 dra, ddec = math.sin(pa/180.0*math.pi)*sep, math.cos(pa/180.0*math.pi)*sep
             elif ob["coord_syst"] == "whereistheplanet":
-                if WHEREISTHEPLANET:
-                    common.printinf("Resolution of {} with whereistheplanet:".format(ob["coord"]))
-                    dra, ddec, sep, pa = whereistheplanet.predict_planet(ob["coord"], self.setup["date"])
-                    sep = sep[0]
-                    pa = pa[0]
-                else: 
-                    common.printerr("whereistheplanet used as a coord_syst, but whereistheplanet module could not be loaded")
+                dra, ddec, sep, pa = planets.predict_planet(ob["coord"], self.setup["date"])
+                sep = sep[0]
+                pa = pa[0]
             else:
                 common.printerr("Unknown coordinate system {}".format(obj_yml["coord_syst"]))
             # now we have dra, ddec, we need to recalculate SC position
@@ -7,50 +7,40 @@ An object of this class will have a p2_create and p2_update method to create or
 # import the template and common functions of this package
 from .. import common
 from .. import tpl
+from .. import sync
 from ..version import VERSION
 
-# we need astroquery to get magnitudes, coordinates, etc.
-from astroquery.simbad import Simbad
+# to get the Simbad tables of targets and guide stars
+from .. import resolver as simbad_resolver
+
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 
 # to define abstract method
 from abc import ABC, abstractmethod
 
-# going for 0.4.7 to 0.4.8 has changed case in some astroquery fields. We need to take care of it.
-import astroquery
-from packaging.version import Version
-ASTROQUERY_OLD = Version(astroquery.__version__) < Version("0.4.8")
-ASTROQUERY_TRANSLATION = dict({"RA": "ra",
-                               "DEC": "dec",
-                               "PMRA": "pmra",
-                               "PMDEC": "pmdec",
-                               "PLX": "plx",
-                               "FLUX_G": "G",
-                               "FLUX_H": "H",
-                               "FLUX_K": "K",
-                               "FLUX_R": "R"})
-
-# add some votable fields to get the magnitudes, proper motion, and plx required in acq template
-Simbad.add_votable_fields('flux(G)')
-Simbad.add_votable_fields('flux(K)')
-Simbad.add_votable_fields('flux(H)')
-Simbad.add_votable_fields('flux(R)')
-Simbad.add_votable_fields('pmdec')
-Simbad.add_votable_fields('pmra')
-Simbad.add_votable_fields('plx')
+import copy
+
+# the fields of the OB set by p2Gravity, with their values in an OB just created on P2. They are all written when
+# the OB is saved, so that an OB copied from another one (see p2_duplicate_ob) or updated in place (sync mode) does
+# not keep the values of the other OB for the fields which are not set for this one (e.g. a missing proper motion)
+OB_FIELDS = dict({"target": dict({"name": "", "ra": "00:00:00.000", "dec": "00:00:00.000", "properMotionRa": 0, "properMotionDec": 0}),
+                  "obsDescription": dict({"name": ""})})
 
 
 class ObservingBlock(object):
-    def __init__(self, yml, setup, label = "", iscalib = False):
+    def __init__(self, yml, setup, label = "", iscalib = False, resolver = None):
         """
         @param yml: dict containing all the info loaded from the YML of this OB
         @param setup: dict containing all the info loaded from the setup part of the YML
         @param label: a label for the OB (as it will appear in P2)
+        @param resolver: SimbadResolver used to get the tables of the targets. If None, a default resolver shared by all OBs is used
         """
         self.label = label
         self.setup = setup
         self.yml = yml
+        # the yml file of the OB, if known (used by the upload journal)
+        self.filename = None
         self.objects = yml["objects"]        
         self.acquisition = None
         self.templates = []
@@ -58,8 +48,17 @@ class ObservingBlock(object):
         self.target = dict({})
         self.ob_type = "ObservingBlock"
         self.iscalib = iscalib
+        if resolver is None:
+            resolver = simbad_resolver.get_default_resolver()
+        self.resolver = resolver
         return None
 
+    def __getstate__(self):
+        # the resolver (with its cache and locks) is not sent to other processes, e.g. to render the OB once resolved
+        state = dict(self.__dict__)
+        state["resolver"] = None
+        return state
+
     def _fill_magnitudes(self, yml):
         """ check if magnitudes are in the given yml. If so, put them in their proper locations in acq template """
         if "k_mag" in yml:
@@ -106,41 +105,25 @@ class ObservingBlock(object):
                 self.ob["constraints"][key] = yml["constraints"][key]
         return None
 
-    def simbad_get_table(self, name):       
-        common.printinf("Resolving target {} on Simbad".format(name))
-        table = Simbad.query_object(name)
-        if table is None:
-            raise ValueError('Input not known by Simbad')
-        common.printinf("Simbad resolution of {}: \n {}".format(name, table))
-        if len(table) > 1:
-            success = False
-            common.printwar("There are multiple results from Simbad. Which one should I use? (1, 2, etc.?)")
-            inp = input(">>")
-            while not(success):
-                try:
-                    inp = int(inp)
-                except: 
-                    common.printwar("Please enter an integer value.")
-                    inp = input(">>")
-                    continue
-                if (inp>=1) and (inp<=len(table)):
-                    target_table = table[[inp-1]]
-                    success = True
-                else:
-                    common.printwar("Please enter an integer between 1 and {}".format(len(table)))
-                    inp = input(">>")
-        # to ensure compatibility with all versions of astroquery
-        table_d = dict(table)
-        if ASTROQUERY_OLD:
-            table_translated = dict({})
-            for key in table_d:
-                if key in ASTROQUERY_TRANSLATION:
-                    table_translated[ASTROQUERY_TRANSLATION[key]] = table_d[key]
-                else:
-                    table_translated[key] = table_d[key]
-        else:
-            table_translated = table_d            
-        return table_translated
+    def p2_fields(self):
+        """
+        Return the values of the fields of OB_FIELDS for this OB, as a dict with the same structure. The fields
+        which are not set for this OB keep the values of a new OB
+        """
+        fields = copy.deepcopy(OB_FIELDS)
+        for key in self.target:
+            fields["target"][key] = self.target[key]
+        # the yml has priority over the setup
+        for yml in [self.setup, self.yml]:
+            if "description" in yml:
+                fields["obsDescription"]["name"] = yml["description"]
+        return fields
+
+    def simbad_get_table(self, name):
+        """
+        Get the Simbad table of the given name from the resolver (which only queries Simbad if needed)
+        """
+        return self.resolver.get_table(name)
     
     def simbad_resolve(self, ob):
         """
@@ -172,12 +155,102 @@ class ObservingBlock(object):
         @param api: the p2 api object to send data to p2 (must be initialized beforehand)
         @param container_id: id of the container where to put the OB
         """
+        self.p2_create_ob(api, container_id)
+        self.p2_create_templates(api)
+        return None
+
+    def p2_create_ob(self, api, container_id):
+        """
+        Create the (empty) OB on P2. OBs are ordered in their container according to the order of creation.
+        @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+        @param container_id: id of the container where to put the OB
+        """
         common.printinf("Creating OB '{}'".format(self.label))        
         ob, version = api.createOB(container_id, self.label)
         self.ob_id = ob["obId"]
         self.version = version
         self.ob = ob
-        # create templates
+        return None
+
+    def check_params(self, strict = True):
+        """
+        Return the list of parameters of the acquisition and templates which do not follow the schemas of the
+        templates (see Template.check_params). Nothing is sent to P2
+        @param strict: if True, only check the strict rules (errors). If False, only the other rules (warnings)
+        """
+        problems = []
+        templates = [self.acquisition] + self.templates if not(self.acquisition is None) else self.templates
+        for k in range(len(templates)):
+            name = "acquisition" if (templates[k] is self.acquisition) else "template {}".format(k)
+            problems = problems + ["{} ({}): {}".format(name, templates[k].template_name, problem) for problem in templates[k].check_params(strict = strict)]
+        return problems
+
+    def layout(self):
+        """
+        Return a key describing the skeleton of this OB: its templates and constraints (from the setup and the yml).
+        OBs with the same layout can be created by duplicating one another
+        """
+        constraints = []
+        for yml in [self.setup, self.yml]:
+            if yml.get("constraints", None) is None:
+                constraints.append(None)
+            else:
+                constraints.append(tuple(sorted([(key, str(yml["constraints"][key])) for key in yml["constraints"]])))
+        return tuple([self.acquisition.template_name] + [template.template_name for template in self.templates] + constraints)
+
+    def p2_duplicate_ob(self, api, prototype_id, container_id):
+        """
+        Create the OB on P2 as a copy of an OB already on P2 with the same layout. The templates are attached
+        to the ones of the copy, so that p2_update only sends the parameters which differ from the prototype.
+        @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+        @param prototype_id: id of the OB to duplicate
+        @param container_id: id of the container where to put the OB
+        """
+        common.printinf("Creating OB '{}' from OB {}".format(self.label, prototype_id))
+        ob, version = api.duplicateOB(prototype_id, container_id)
+        self.ob_id = ob["obId"]
+        self.version = version
+        self.ob = ob
+        self.ob["name"] = self.label
+        tpls, _ = api.getTemplates(self.ob_id)
+        for template, tpl in zip([self.acquisition] + self.templates, tpls):
+            template.ob_id = self.ob_id
+            template.tpl = tpl
+            template.version = None # will be retrieved if an update is required
+        return None
+
+    def p2_resume(self, api, ob_id):
+        """
+        Attach the OB to an OB partially created on P2 (e.g. by an interrupted upload), and create the templates
+        which are missing. The parameters are then sent by p2_update.
+        @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+        @param ob_id: id of the OB on P2
+        """
+        common.printinf("Resuming OB '{}' ({})".format(self.label, ob_id))
+        ob, version = api.getOB(ob_id)
+        tpls, _ = api.getTemplates(ob_id)
+        templates = [self.acquisition] + self.templates
+        for template, tpl in zip(templates, tpls):
+            if not(tpl["templateName"] == template.template_name):
+                common.printerr("OB {} on P2 has a template {} instead of {}. Cannot resume OB '{}'".format(ob_id, tpl["templateName"], template.template_name, self.label))
+        if len(tpls) > len(templates):
+            common.printerr("OB {} on P2 has more templates than OB '{}'. Cannot resume it".format(ob_id, self.label))
+        self.ob_id = ob_id
+        self.version = version
+        self.ob = ob
+        for template, tpl in zip(templates, tpls):
+            template.ob_id = ob_id
+            template.tpl = tpl
+            template.version = None # will be retrieved if an update is required
+        for template in templates[len(tpls):]:
+            template.p2_create(api, ob_id)
+        return None
+
+    def p2_create_templates(self, api):
+        """
+        Create the templates of the OB on P2. The OB must have been created beforehand with p2_create_ob.
+        @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+        """
         common.printinf("Creating templates for OB '{}'".format(self.label))
         self.acquisition.p2_create(api, self.ob_id)
         for template in self.templates:
@@ -194,26 +267,45 @@ class ObservingBlock(object):
         absTCs, atcVersion = api.saveAbsoluteTimeConstraints(self.ob_id, constraints, atcVersion)
         return None
                                                              
-    def p2_update(self, api):
+    def p2_update(self, api, utctime = True):
         """
         Update info of the OB on P2
+        @param utctime: if False, the time constraints are not sent (e.g. if they were copied from a duplicated OB)
+        """
+        self.p2_save_ob(api)
+        common.printinf("Updating templates in run OB '{}'".format(self.label))
+        self.acquisition.p2_update(api)
+        for template in self.templates:
+            template.p2_update(api)
+        if utctime:
+            self.p2_update_utctime(api)
+        return None
+
+    def p2_save_ob(self, api):
+        """
+        Update the OB itself on P2 (target, constraints and description), without its templates
         """
         common.printinf("Updating OB '{}'".format(self.label))
-        for key in self.target:
-            self.ob["target"][key] = self.target[key]
+        # all the fields are written, and not only the ones set for this OB, in case it was copied from another OB
+        fields = self.p2_fields()
+        for section in fields:
+            for key in fields[section]:
+                self.ob[section][key] = fields[section][key]
         # YML explicit stuff have priority over the auto generated values
         self.populate_from_yml(self.setup)
         self.populate_from_yml(self.yml)
+        # tag the OB with the hashes of its content, so that unchanged OBs can be skipped in sync mode
+        self.ob["obsDescription"]["userComments"] = sync.tag_comments(self.ob["obsDescription"]["userComments"], sync.ob_hashes(self))
         # save updated OB
-        api.saveOB(self.ob, self.version)
-        common.printinf("Updating templates in run OB '{}'".format(self.label))
-        self.acquisition.p2_update(api)
-        for template in self.templates:
-            template.p2_update(api)
-        # add time constraints if required
+        self.ob, self.version = api.saveOB(self.ob, self.version)
+        return None
+
+    def p2_update_utctime(self, api):
+        """
+        Add the time constraints from the setup to the OB, if required
+        """
         if "absoluteTimeConstraints" in self.setup:
             if not(self.setup["absoluteTimeConstraints"] is None):
                 self.p2_add_utctime(api, self.setup["absoluteTimeConstraints"])
         return None
-    
 
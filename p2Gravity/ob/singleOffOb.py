@@ -4,6 +4,7 @@
 
 from .. import tpl
 from .. import common
+from .. import sequence
 from .observingBlock import ObservingBlock
 
 class SingleOffOb(ObservingBlock):
@@ -45,19 +46,10 @@ class SingleOffOb(ObservingBlock):
     def generate_templates(self):
         """
         generate the sequence of templates corresponding to the OB. Nothing is send to P2 at this point
-        """        
-        for seq in self.yml["sequence"]:
-            exposures = seq.split()
-            if not("sky" in exposures):
-                common.printwar("No sky in sequence {} in OB '{}'".format(exposures, self.label))
-            if len(set([dummy for dummy in exposures if dummy != "sky"])) > 1: # number of object different from sky
-                common.printerr("Sequence '{}' in OB '{}' contains more than one object".format(exposures, self.label))
-            obj_label = [dummy for dummy in exposures if dummy != "sky"][0]
-            if not(obj_label in self.objects):
-                common.printerr("Exposure '{}' in OB '{}' does not match any of the objects".format(obj_label, self.label))
-            obj_yml = self.objects[obj_label]
-            exposures = " ".join(exposures).replace(obj_label, "O").replace("sky", "S") # exposure in ESO format
-            self.templates.append(self._generate_template(obj_yml, exposures))
+        """
+        for seq in sequence.compile_sequences(self.yml["sequence"], self.objects, ob_label = self.label, single = True):
+            obj_yml = self.objects[seq.objects()[0]]
+            self.templates.append(self._generate_template(obj_yml, seq.eso()))
         # now we can generate acquisition
         self._generate_acquisition()
         return None
@@ -4,6 +4,7 @@
 
 from .. import tpl
 from .. import common
+from .. import sequence
 from .observingBlock import ObservingBlock
 
 class SingleOnOb(ObservingBlock):
@@ -52,15 +53,9 @@ class SingleOnOb(ObservingBlock):
         """
         generate the sequence of templates corresponding to the OB. Nothing is send to P2 at this point
         """
-        for seq in self.yml["sequence"]:
-            exposures = seq.split()
-            if not("sky" in exposures):
-                common.printwar("No sky in sequence {} in OB '{}'".format(exposures, self.label))
-            obj_label = [dummy for dummy in exposures if dummy != "sky"][0]                
-            obj_yml = self.objects[obj_label]
-            dummy_label = "£££"
-            exposures = " ".join(exposures).replace("sky", dummy_label).replace(obj_label, "O").replace(dummy_label, "S") # exposure in ESO format
-            self.templates.append(self._generate_template(obj_yml, exposures))
+        for seq in sequence.compile_sequences(self.yml["sequence"], self.objects, ob_label = self.label, single = True):
+            obj_yml = self.objects[seq.objects()[0]]
+            self.templates.append(self._generate_template(obj_yml, seq.eso()))
         # now we can generate acquisition
         self._generate_acquisition()
         return None
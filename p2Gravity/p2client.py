@@ -0,0 +1,315 @@
+#coding: utf8
+"""A thin client layer around the P2 API connection.
+
+P2Client wraps a p2api.ApiConnection, and can be given everywhere an api object is expected (ObservingBlock,
+Template, common.find_item, etc.). It:
+- configures the underlying requests session with a keep-alive connection pool sized to the upload concurrency
+  and a default timeout,
+- retries calls failing with a retryable error (connection error, timeout, 429, 502, 503, 504) with an exponential
+  backoff and random jitter,
+- only retries the calls which create an object (createOB, duplicateOB, createFolder, createConcatenation,
+  createTemplate) as such if the request never reached the server (connection refused, 429, 503). Otherwise (e.g.
+  a timeout or a 504 after the object was created), the container (or the templates of the OB) is listed again, and
+  the object created is used instead of creating a duplicate,
+- retries saveOB, setTemplateParams and saveAbsoluteTimeConstraints on a version conflict, after re-fetching the
+  current version of the object. Conflicts and transient errors share the same number of retries,
+- only lists the runs and each container once (getRuns, getItems), and keeps the listings up to date when folders,
+  concatenations and OBs are created, renamed or deleted (see containerCache).
+"""
+
+from . import common
+from . import profiling
+from . import containerCache
+
+import time
+import random
+
+# http status which are worth retrying, and status returned by P2 when the version (ETag) given is outdated
+RETRYABLE_STATUS = [429, 502, 503, 504]
+CONFLICT_STATUS = [412]
+# http status for which the request was rejected without being processed
+REJECTED_STATUS = [429, 503]
+
+
+def is_create(method):
+    """ True for the calls which create an object on P2, and cannot be sent twice """
+    return method.startswith("create") or method.startswith("duplicate")
+
+
+def item_id(item):
+    """ the id of an item listed by getItems (OB or container) """
+    return item.get("obId", item.get("containerId", None))
+
+
+def status_of(error):
+    """ return the http status of a P2Error (which are raised as P2Error(status, method, url, message)), or None """
+    if len(error.args) > 0 and isinstance(error.args[0], int):
+        return error.args[0]
+    return None
+
+
+def _requests_errors():
+    """ the connection errors from requests which should be retried """
+    try:
+        import requests
+    except ImportError:
+        return ()
+    return (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+def _never_sent(error):
+    """ True if a connection error happened before the request was sent (the connection could not be opened) """
+    try:
+        import requests
+        from urllib3.exceptions import NewConnectionError
+    except ImportError:
+        return False
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and (len(error.args) > 0):
+        return isinstance(getattr(error.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+def configure_session(session, pool_size = 10, timeout = 60):
+    """
+    Mount a pooled keep-alive adapter with a default timeout on a requests session
+    @param session: the requests.Session used by the api connection
+    @param pool_size: max number of connections kept open to the server
+    @param timeout: default timeout (in s) of each request
+    """
+    from requests.adapters import HTTPAdapter
+    class TimeoutAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            if kwargs.get("timeout", None) is None:
+                kwargs["timeout"] = timeout
+            return super(TimeoutAdapter, self).send(request, **kwargs)
+    adapter = TimeoutAdapter(pool_connections = 1, pool_maxsize = pool_size, max_retries = 0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return None
+
+
+class P2Client(object):
+    def __init__(self, api, pool_size = 1, retries = 5, backoff = 0.5, max_backoff = 30., timeout = 60, containers = None):
+        """
+        @param api: the p2api.ApiConnection to wrap (must be initialized beforehand)
+        @param pool_size: number of concurrent users of this client (e.g. number of upload jobs)
+        @param retries: max number of retries of a call
+        @param backoff: base delay (in s) of the exponential backoff
+        @param max_backoff: max delay (in s) between two retries
+        @param timeout: default timeout (in s) of each request
+        @param containers: the ContainerCache where the listings are kept. Default to a new one, for the session only
+        """
+        self.api = api
+        self.containers = containerCache.ContainerCache() if containers is None else containers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        if not(getattr(api, "session", None) is None):
+            configure_session(api.session, pool_size = max(pool_size, 1), timeout = timeout)
+        self._connection_errors = _requests_errors()
+        # ids of the templates known to be in each OB, to find the template created by a lost createTemplate
+        self._templates = dict({})
+        return None
+
+    def _is_retryable(self, error):
+        if isinstance(error, self._connection_errors):
+            return True
+        return status_of(error) in RETRYABLE_STATUS
+
+    def _never_sent(self, error):
+        return (status_of(error) in REJECTED_STATUS) or _never_sent(error)
+
+    def _delay(self, attempt):
+        """ exponential backoff with full jitter """
+        return random.uniform(0, min(self.max_backoff, self.backoff*2**attempt))
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call the given method of the api, retrying on retryable errors
+        @param method: name of the p2api method (e.g. 'createOB')
+        """
+        return self._call(method, args, kwargs)
+
+    def _call(self, method, args, kwargs = None, refresh = None, reconcile = None):
+        """
+        Call a method of the api, with at most self.retries retries in total
+        @param refresh: for a method whose last argument is the version of the object, a function returning the args
+        with the current version, called on a version conflict
+        @param reconcile: for a method creating an object, a function called when the request may have reached the
+        server: it returns the object created (as returned by the method), or None if it was not created
+        """
+        kwargs = dict({}) if kwargs is None else kwargs
+        attempt = 0
+        while True:
+            try:
+                with profiling.span(method, "p2"):
+                    return getattr(self.api, method)(*args, **kwargs)
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise
+                if not(refresh is None) and (status_of(e) in CONFLICT_STATUS):
+                    common.printwar("Version conflict on P2 call {}. Retrying with the current version".format(method))
+                    args = refresh()
+                    attempt = attempt + 1
+                    continue
+                if not(self._is_retryable(e)):
+                    raise
+                # an object may have been created even if the answer was lost
+                sent = is_create(method) and not(self._never_sent(e))
+                if sent and (reconcile is None):
+                    raise
+                delay = self._delay(attempt)
+                common.printwar("P2 call {} failed ({}). Retrying in {:.1f}s".format(method, e, delay))
+                time.sleep(delay)
+                attempt = attempt + 1
+                if sent:
+                    try:
+                        created = reconcile()
+                    except Exception:
+                        # cannot tell whether the object was created: do not risk a duplicate
+                        raise e
+                    if not(created is None):
+                        common.printinf("P2 call {} had created the object before failing".format(method))
+                        return created
+
+    def _call_versioned(self, method, refresh, *args):
+        """
+        Call a method whose last argument is the version of the object, and retry with a fresh version
+        (given by refresh(), which returns the new args) on a version conflict
+        """
+        return self._call(method, args, refresh = refresh)
+
+    def _create_item(self, method, args, containerId, item_type, name):
+        """
+        Call a method creating an item in a container. If the answer is lost, the container is listed again, and the
+        item with this name and type which was not there before is returned
+        @param name: name of the item, or a function returning it
+        """
+        # the items known before the call
+        self.getItems(containerId)
+        known = set([item_id(item) for item in self.containers.get_items(containerId)[0]])
+        def reconcile():
+            item_name = name() if callable(name) else name
+            # (the items created meanwhile by other calls of this client are known too)
+            known.update([item_id(item) for item in self.containers.get_items(containerId)[0]])
+            items, _ = self.call("getItems", containerId)
+            created = [item for item in items if (item["name"] == item_name) and (item["itemType"] == item_type) and not(item_id(item) in known)]
+            if len(created) == 0:
+                return None
+            if len(created) > 1:
+                raise common.OBError("Several new items '{}' in container {}".format(item_name, containerId))
+            if item_type == "OB":
+                return self.call("getOB", created[0]["obId"])
+            return self.call("getContainer", created[0]["containerId"])
+        return self._call(method, args, reconcile = reconcile)
+
+    def saveOB(self, ob, version):
+        def refresh():
+            _, new_version = self.call("getOB", ob["obId"])
+            return (ob, new_version)
+        result = self._call_versioned("saveOB", refresh, ob, version)
+        self.containers.rename(ob["obId"], ob["name"])
+        return result
+
+    def setTemplateParams(self, obId, template, params, version):
+        def refresh():
+            new_template, new_version = self.call("getTemplate", obId, template["templateId"])
+            return (obId, new_template, params, new_version)
+        return self._call_versioned("setTemplateParams", refresh, obId, template, params, version)
+
+    def saveAbsoluteTimeConstraints(self, obId, timeConstraints, version):
+        def refresh():
+            _, new_version = self.call("getAbsoluteTimeConstraints", obId)
+            return (obId, timeConstraints, new_version)
+        return self._call_versioned("saveAbsoluteTimeConstraints", refresh, obId, timeConstraints, version)
+
+    # listings of the runs and containers
+    def getRuns(self):
+        runs = self.containers.get_runs()
+        if runs is None:
+            runs = self.call("getRuns")
+            self.containers.set_runs(*runs)
+        return runs
+
+    def getItems(self, containerId):
+        items = self.containers.get_items(containerId)
+        if items is None:
+            items = self.call("getItems", containerId)
+            self.containers.set_items(containerId, *items)
+        return items
+
+    def find_item(self, item_name, containerId, item_type = None):
+        """ see common.find_item. The container is only listed once """
+        if not(self.containers.listed(containerId)):
+            self.getItems(containerId)
+        return self.containers.find(item_name, containerId, item_type)
+
+    def createFolder(self, containerId, name):
+        folder, version = self._create_item("createFolder", (containerId, name), containerId, "Folder", name)
+        self.containers.add(containerId, containerCache.make_item(folder, "Folder"))
+        return folder, version
+
+    def createConcatenation(self, containerId, name):
+        concatenation, version = self._create_item("createConcatenation", (containerId, name), containerId, "Concatenation", name)
+        self.containers.add(containerId, containerCache.make_item(concatenation, "Concatenation"))
+        return concatenation, version
+
+    def createOB(self, containerId, name):
+        ob, version = self._create_item("createOB", (containerId, name), containerId, "OB", name)
+        self.containers.add(containerId, containerCache.make_item(ob, "OB"))
+        # a new OB has no template
+        self._templates[ob["obId"]] = set([])
+        return ob, version
+
+    def duplicateOB(self, obId, containerId):
+        # the copy has the name of the original OB
+        name = lambda: self.call("getOB", obId)[0]["name"]
+        ob, version = self._create_item("duplicateOB", (obId, containerId), containerId, "OB", name)
+        self.containers.add(containerId, containerCache.make_item(ob, "OB"))
+        return ob, version
+
+    def deleteOB(self, obId, version):
+        result = self.call("deleteOB", obId, version)
+        self.containers.remove(obId)
+        return result
+
+    # templates
+    def getTemplates(self, obId):
+        templates, version = self.call("getTemplates", obId)
+        self._templates[obId] = set([template["templateId"] for template in templates])
+        return templates, version
+
+    def createTemplate(self, obId, templateName):
+        """ if the answer is lost, the templates of the OB are listed again to find the template created """
+        if not(obId in self._templates):
+            self.getTemplates(obId)
+        known = set(self._templates[obId])
+        def reconcile():
+            templates, _ = self.call("getTemplates", obId)
+            created = [template for template in templates if (template["templateName"] == templateName) and not(template["templateId"] in known)]
+            if len(created) == 0:
+                return None
+            if len(created) > 1:
+                raise common.OBError("Several new templates {} in OB {}".format(templateName, obId))
+            return self.call("getTemplate", obId, created[0]["templateId"])
+        template, version = self._call("createTemplate", (obId, templateName), reconcile = reconcile)
+        self._templates[obId].add(template["templateId"])
+        return template, version
+
+    def deleteTemplate(self, obId, templateId, version):
+        result = self.call("deleteTemplate", obId, templateId, version)
+        self._templates.get(obId, set([])).discard(templateId)
+        return result
+
+    def __getattr__(self, name):
+        # all other api methods are called with the retry policy
+        if name == "api":
+            raise AttributeError(name)
+        attr = getattr(self.api, name)
+        if not(callable(attr)):
+            return attr
+        def method(*args, **kwargs):
+            return self.call(name, *args, **kwargs)
+        return method
@@ -0,0 +1,301 @@
+#coding: utf8
+"""The successive stages used to go from a YML file to OBs on P2.
+
+parse -> generate -> resolve -> (review) -> upload
+
+Each stage is a function which can be used on its own from Python. The generate and resolve stages are
+generators, so that they can be chained in a streaming fashion, and prefetch can be used to run a stage in
+a background thread (e.g. to resolve OB k+1 on Simbad while OB k is being uploaded). For example:
+
+    cfg = pipeline.load_yml("my_obs.yml")
+    obs = list(pipeline.generate_obs(cfg, resolver = resolver))   # fails early on any error in the yml
+    container_id = pipeline.get_container(api, cfg["setup"])
+    pool = upload.UploadPool(api, jobs = 4)
+    for ob in pipeline.prefetch(pipeline.resolve_obs(obs, resolver = resolver)):
+        pool.submit(ob, container_id)
+    upload.print_report(pool.wait())
+
+Several yml files can be processed as a single campaign: the OBs of all files go through the same stages, resolver
+and upload pool, and a ContainerIndex is used so that the runs and folders are only looked up once on P2.
+
+In batch mode (see common.BATCH_MODE), errors on an OB do not stop the run: the generate and resolve stages skip
+the OB and collect the error in an ErrorReport, which is printed once at the end with the upload failures.
+"""
+
+from . import common
+from . import profiling
+from . import ob as p2ob
+from . import resolver as simbad_resolver
+
+import os
+import glob
+import threading
+import queue
+
+# ruamel to read config yml file
+import ruamel.yaml as yaml
+
+# the class to use for each mode, and the modes which use the 'calib' keyword
+OB_CLASSES = dict({"single_on": p2ob.SingleOnOb,
+                   "single_off": p2ob.SingleOffOb,
+                   "dual_on": p2ob.DualOnOb,
+                   "dual_off": p2ob.DualOffOb,
+                   "dual_wide_off": p2ob.DualWideOffOb,
+                   "dual_wide_on": p2ob.DualWideOnOb})
+CALIB_MODES = ["single_on", "dual_off", "dual_wide_off"]
+
+
+class ErrorReport(object):
+    """ The errors of all the OBs which were skipped during a run, by stage """
+    def __init__(self):
+        self.errors = []
+        self._lock = threading.Lock()
+        return None
+
+    def add(self, ob_label, stage, error):
+        """
+        Record an error on an OB
+        @param error: the exception raised (an OBError from printerr, or any other exception)
+        """
+        if not(isinstance(error, common.OBError)):
+            error = common.OBError("{}: {}".format(type(error).__name__, error))
+        error.ob = ob_label
+        error.stage = stage
+        with self._lock:
+            self.errors.append(error)
+        return None
+
+    def add_upload_results(self, results):
+        """ record the failures in the results of an UploadPool """
+        for result in results:
+            if not(result["success"]):
+                self.add(result["label"], "upload", common.OBError(result["error"]))
+        return None
+
+    def failed(self):
+        """ return the labels of the OBs with an error """
+        return [error.ob for error in self.errors]
+
+    def print_report(self):
+        if len(self.errors) == 0:
+            common.printinf("All OBs were processed without error")
+            return None
+        common.printwar("{} OB(s) were skipped because of errors:".format(len(self.errors)))
+        for error in self.errors:
+            print("    {:<30} {:<10} {}".format(error.ob, error.stage, error.msg))
+        return None
+
+
+def expand_files(patterns):
+    """
+    Return the list of yml files given as paths or glob patterns (e.g. 'P112/*.yml'), in the given order and
+    without duplicates
+    @param patterns: list of paths or patterns
+    """
+    filenames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if len(matches) == 0:
+            common.printerr("No file matches {}".format(pattern))
+        for filename in matches:
+            if not(os.path.isfile(filename)):
+                common.printerr("{} not found, or is not a file".format(filename))
+            if not(filename in filenames):
+                filenames.append(filename)
+    return filenames
+
+
+def load_yml(filename):
+    """
+    Load a yml configuration file (parse stage)
+    @param filename: path to the yml file
+    """
+    loader = yaml.YAML(typ = "rt")
+    cfg = loader.load(open(filename, "r"))
+    # user friendly
+    date = cfg["setup"]["date"]
+    if type(date) != str:
+        cfg["setup"]["date"] = date.isoformat()
+    return cfg
+
+
+def make_ob(ob_name, ob_yml, setup, resolver = None):
+    """
+    Create the ObservingBlock corresponding to the mode of the given OB yml
+    @param ob_name: label of the OB
+    @param ob_yml: dict containing all the info loaded from the YML of this OB
+    @param setup: dict containing all the info loaded from the setup part of the YML
+    @param resolver: SimbadResolver to use for this OB
+    """
+    mode = ob_yml["mode"]
+    if not(mode in OB_CLASSES):
+        common.printerr("Mode {} is unknown.".format(mode))
+    if mode in CALIB_MODES:
+        return OB_CLASSES[mode](ob_yml, setup, label = ob_name, iscalib = ob_yml["calib"], resolver = resolver)
+    return OB_CLASSES[mode](ob_yml, setup, label = ob_name, resolver = resolver)
+
+
+def generate_obs(cfg, resolver = None, report = None, filename = None):
+    """
+    Create all the OBs of a yml configuration and generate their templates (generate stage). Nothing is sent
+    to Simbad or P2 at this point.
+    @param cfg: dict containing the full yml configuration
+    @param resolver: SimbadResolver to give to the OBs
+    @param report: if an ErrorReport is given, OBs which fail are skipped and their errors collected in the report
+    @param filename: path of the yml file, kept in the OBs
+    """
+    for ob_name in cfg["ObservingBlocks"]:
+        try:
+            with profiling.span("generate", ob = ob_name):
+                ob = make_ob(ob_name, cfg["ObservingBlocks"][ob_name], cfg["setup"], resolver = resolver)
+                ob.filename = filename
+                ob.generate_templates()
+        except Exception as e:
+            if report is None:
+                raise
+            report.add(ob_name, "generate", e)
+            continue
+        yield ob
+
+
+def resolve_obs(obs, resolver = None, report = None):
+    """
+    Resolve the targets and guide stars of the given OBs on Simbad (resolve stage).
+    If a resolver is given, all the names are first resolved in a single bulk query.
+    @param obs: list of generated ObservingBlocks
+    @param resolver: the SimbadResolver used by the OBs
+    @param report: if an ErrorReport is given, OBs which fail are skipped and their errors collected in the report
+    """
+    if not(resolver is None):
+        obs = list(obs)
+        names = []
+        for ob in obs:
+            names = names + [name for name in simbad_resolver.collect_ob_names(ob.yml) if not(name in names)]
+        try:
+            with profiling.span("resolve_all"):
+                resolver.resolve_all(names)
+        except Exception as e:
+            if report is None:
+                raise
+            # the names which could not be resolved are reported by each OB
+            common.printwar("Bulk resolution failed ({}). Targets will be resolved one by one.".format(e))
+    for ob in obs:
+        try:
+            with profiling.span("resolve", ob = ob.label):
+                ob.simbad_resolve(ob.yml)
+        except Exception as e:
+            if report is None:
+                raise
+            report.add(ob.label, "resolve", e)
+            continue
+        yield ob
+
+
+def validate_obs(obs, report = None):
+    """
+    Check the parameters of the OBs against the schemas of their templates, so that invalid OBs are not sent to P2.
+    Only the strict rules of the schemas make an OB invalid, the other ones give warnings
+    @param obs: iterable of ObservingBlocks
+    @param report: if an ErrorReport is given, invalid OBs are skipped and reported. Otherwise, the run stops on
+    the first invalid OB
+    """
+    for ob in obs:
+        for problem in ob.check_params(strict = False):
+            common.printwar("OB '{}' may not be valid: {}".format(ob.label, problem))
+        problems = ob.check_params()
+        if len(problems) > 0:
+            msg = "OB '{}' is not valid: {}".format(ob.label, "; ".join(problems))
+            if report is None:
+                common.printerr(msg)
+            report.add(ob.label, "check", common.OBError(msg))
+            continue
+        yield ob
+
+
+def prefetch(iterable, size = 1):
+    """
+    Consume the given iterable in a background thread, keeping up to size items ready in advance.
+    Exceptions raised by the iterable are raised again in the consumer.
+    """
+    items = queue.Queue(maxsize = size)
+    def producer():
+        try:
+            for item in iterable:
+                items.put((True, item))
+            items.put((False, None))
+        except BaseException as e:
+            items.put((False, e))
+        return None
+    thread = threading.Thread(target = producer, daemon = True)
+    thread.start()
+    while True:
+        success, item = items.get()
+        if not(success):
+            if not(item is None):
+                raise item
+            break
+        yield item
+    return None
+
+
+def get_container(api, setup, reuse = False, runs = None):
+    """
+    Find (or create) the folder given in setup in the correct run, and the concatenation if requested.
+    Return the id of the container where the OBs should be put.
+    @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+    @param setup: dict containing all the info loaded from the setup part of the YML
+    @param reuse: if True, an existing concatenation with the same name is used instead of creating a new one
+    @param runs: the list of runs returned by api.getRuns, if already known
+    """
+    run_id = setup["run_id"]
+    folder_name = setup["folder"]
+    # create the folder if it does not exist
+    myrun = None
+    if runs is None:
+        runs, _ = api.getRuns()
+    for thisrun in runs:
+        if thisrun['progId'] == run_id:
+            myrun = thisrun
+    if myrun is None:
+        common.printinf("Available runs are: {}".format([r["progId"] for r in runs]))
+        common.printerr("Run '{}' not found".format(run_id))
+    folder_info = common.find_item(folder_name, myrun["containerId"], api, "Folder")
+    if folder_info is None:
+        common.printinf("Creating folder '{}' in run '{}'".format(folder_name, run_id))
+        folder_info, version = api.createFolder(myrun["containerId"], folder_name)
+    container_id = folder_info["containerId"]
+    # if concatenation is not none, we need to create a concatenation
+    concatenation = setup["concatenation"].rstrip().lstrip()
+    if concatenation.lower() != "none":
+        if reuse:
+            con = common.find_item(concatenation, container_id, api, "Concatenation")
+            if not(con is None):
+                return con["containerId"]
+        common.printinf("Creating concatenation '{}' in folder '{}'".format(concatenation, folder_name))
+        con, conVersion = api.createConcatenation(container_id, concatenation)
+        container_id = con["containerId"]  # new container where to put OBs
+    return container_id
+
+
+class ContainerIndex(object):
+    """
+    The runs and the containers found (or created) on P2 during a session, so that several setups (e.g. one per
+    yml file) using the same run, folder and concatenation only look them up once
+    """
+    def __init__(self, api):
+        """
+        @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+        """
+        self.api = api
+        self.runs = None
+        self.containers = dict({})
+        return None
+
+    def get_container(self, setup, reuse = False):
+        """ see get_container """
+        key = (setup["run_id"], setup["folder"], setup["concatenation"].strip())
+        if not(key in self.containers):
+            if self.runs is None:
+                self.runs, _ = self.api.getRuns()
+            self.containers[key] = get_container(self.api, setup, reuse = reuse, runs = self.runs)
+        return self.containers[key]
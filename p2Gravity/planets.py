@@ -0,0 +1,309 @@
+#coding: utf8
+"""Access to the whereistheplanet package, used by the 'whereistheplanet' coord_syst.
+
+whereistheplanet is optional, and only imported the first time a planet position is needed. As the orbit sampling
+is expensive, each prediction is computed only once per (planet, date) and shared by the templates, acquisitions
+and plots of all OBs. The predictions can also be kept on disk (see PredictionCache.load).
+
+For time-critical companions, an EphemerisGrid can be set with the absoluteTimeConstraints windows: the orbits of
+each planet are then sampled once, on a grid of dates covering all the windows, and the positions at any date within
+these windows are interpolated on this grid (so changing the date of a campaign does not require any new orbit
+sampling). check_drift warns if the position of a planet moves by more than a fiber radius within a window.
+"""
+
+from . import common
+from . import profiling
+
+import os
+import json
+import time
+import threading
+
+# the module, once loaded, or False if it cannot be loaded
+_WHEREISTHEPLANET = None
+
+
+def load_whereistheplanet():
+    """ import whereistheplanet on first use, and return the module (or None if it is not available) """
+    global _WHEREISTHEPLANET
+    if _WHEREISTHEPLANET is None:
+        try:
+            import whereistheplanet
+            _WHEREISTHEPLANET = whereistheplanet
+        except ImportError:
+            common.printwar("Cannot load whereistheplanet module. 'whereistheplanet' will not be available as a coord_syst.")
+            _WHEREISTHEPLANET = False
+    if _WHEREISTHEPLANET is False:
+        return None
+    return _WHEREISTHEPLANET
+
+
+class PredictionCache(object):
+    """
+    The predictions of whereistheplanet, by planet and date. Kept for the session, and also on disk if a path is given.
+    """
+    def __init__(self, path = None, ttl = None):
+        self.path = None
+        self.ttl = ttl
+        self.predictions = dict({})
+        self._lock = threading.Lock()
+        if not(path is None):
+            self.load(path)
+        return None
+
+    @staticmethod
+    def key(name, date):
+        return "{}@{}".format(name, date)
+
+    def load(self, path, ttl = None):
+        """
+        load the predictions from a json file, which is then updated with any new prediction
+        @param ttl: number of days after which a prediction stored on disk is computed again (orbits get updated)
+        """
+        self.path = path
+        if not(ttl is None):
+            self.ttl = ttl
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    predictions = json.load(f)
+            except ValueError:
+                common.printwar("Cannot read planet predictions from {}. Ignoring it".format(path))
+                return None
+            for key in predictions:
+                if (self.ttl is None) or (time.time() - predictions[key]["time"] < self.ttl*86400):
+                    self.predictions[key] = predictions[key]
+        return None
+
+    def get(self, name, date):
+        """ return the stored prediction of this planet at this date, or None """
+        entry = self.predictions.get(self.key(name, date), None)
+        if entry is None:
+            return None
+        return tuple([tuple(values) for values in entry["prediction"]])
+
+    def store(self, name, date, prediction):
+        """ store a prediction, as returned by whereistheplanet.predict_planet """
+        entry = dict({"prediction": [[float(v) for v in values] for values in prediction], "time": time.time()})
+        with self._lock:
+            self.predictions[self.key(name, date)] = entry
+            if not(self.path is None):
+                with open(self.path, "w") as f:
+                    json.dump(self.predictions, f, indent = 1)
+        return None
+
+
+# shared by all OBs
+DEFAULT_PREDICTION_CACHE = PredictionCache()
+# step (in days) of the ephemeris grids, and radius (in mas) of the fiber used to check the drift of the planets
+DEFAULT_GRID_STEP = 1.0
+FIBER_RADIUS = 30
+
+
+def to_mjd(date):
+    """ convert a date (iso string, datetime, or mjd) to mjd """
+    from astropy.time import Time
+    if not("-" in str(date)):
+        return float(date)
+    return Time(date).mjd
+
+
+def sample_orbits(name, mjds, num_samples = 100):
+    """
+    Sample the orbit of a planet at all the given dates in a single pass, using the same draws of the posterior
+    for all dates (so that the positions are smooth in time). Same as whereistheplanet.predict_planet, but vectorized.
+    This relies on the internals of whereistheplanet and orbitize: if they changed, predict_planet is called for each
+    date instead.
+    Return the arrays ra, ra_err, dec, dec_err, sep, sep_err, pa, pa_err (mas and deg)
+    @param name: name of the planet, as known by whereistheplanet (e.g. HR8799b)
+    @param mjds: array of dates (mjd)
+    """
+    import numpy as np
+    whereistheplanet = load_whereistheplanet()
+    if whereistheplanet is None:
+        common.printerr("whereistheplanet used as a coord_syst, but whereistheplanet module could not be loaded")
+    mjds = np.atleast_1d(np.array(mjds, dtype = float))
+    try:
+        return _sample_orbits(whereistheplanet, name.lower(), mjds, num_samples)
+    except (ImportError, AttributeError, KeyError, TypeError) as e:
+        common.printwar("Cannot sample the orbit of {} on all dates at once ({}: {}). Using whereistheplanet.predict_planet for each date".format(name, type(e).__name__, e))
+    predictions = [whereistheplanet.predict_planet(name, mjd, num_samples = num_samples) for mjd in mjds]
+    # ((ra, ra_err), (dec, dec_err), ...) for each date
+    return tuple([np.array([prediction[k][j] for prediction in predictions]) for k in range(4) for j in range(2)])
+
+
+def _sample_orbits(whereistheplanet, name, mjds, num_samples):
+    """ see sample_orbits. This follows whereistheplanet.print_prediction, and uses its internals """
+    import numpy as np
+    from orbitize import kepler
+    chains, tau_ref_epoch = whereistheplanet.get_chains(name)
+    orbits = chains[np.random.randint(0, chains.shape[0], num_samples)]
+    multi = whereistheplanet.multi_dict
+    if not(name in multi):
+        sma, ecc, inc, aop, pan, tau, plx, mtot = orbits[:, 0:8].T
+        if name in whereistheplanet.dyn_mass_single_comp:
+            mtot = np.sum(orbits[:, [-2, -1]], axis = 1)
+        ras, decs, vzs = kepler.calc_orbit(mjds, sma, ecc, inc, aop, pan, tau, plx, mtot, tau_ref_epoch = tau_ref_epoch)
+    else:
+        # multi-planet fits: the inner planets perturb the position of the star
+        planet_num, tot_planets = multi[name]
+        sma, ecc, inc, aop, pan, tau = orbits[:, 6*planet_num:6*planet_num+6].T
+        plx = orbits[:, 6*tot_planets]
+        mass_planets = orbits[:, -1-tot_planets:-1]
+        mass_star = orbits[:, -1]
+        smas = orbits[0, 0:6*tot_planets:6]
+        within = np.where(smas <= smas[planet_num])[0]
+        mtot = mass_star + np.sum(mass_planets[:, within], axis = 1)
+        ras, decs, vzs = kepler.calc_orbit(mjds, sma, ecc, inc, aop, pan, tau, plx, mtot, tau_ref_epoch = tau_ref_epoch)
+        for inner in within:
+            if inner == planet_num:
+                continue
+            inner_mtot = mass_star + np.sum(mass_planets[:, np.where(smas < smas[inner])[0]], axis = 1)
+            mass_inner = mass_planets[:, inner]
+            in_sma, in_ecc, in_inc, in_aop, in_pan, in_tau = orbits[:, 6*inner:6*inner+6].T
+            in_ras, in_decs, in_vzs = kepler.calc_orbit(mjds, in_sma, in_ecc, in_inc, in_aop, in_pan, in_tau, plx, inner_mtot, tau_ref_epoch = tau_ref_epoch)
+            ras = ras + mass_inner/inner_mtot*in_ras
+            decs = decs + mass_inner/inner_mtot*in_decs
+    # one row per date
+    ras, decs = np.reshape(ras, (len(mjds), -1)), np.reshape(decs, (len(mjds), -1))
+    seps = np.sqrt(ras**2 + decs**2)
+    pas = np.degrees(np.arctan2(ras, decs)) % 360
+    return (np.median(ras, axis = 1), np.std(ras, axis = 1), np.median(decs, axis = 1), np.std(decs, axis = 1),
+            np.median(seps, axis = 1), np.std(seps, axis = 1), np.median(pas, axis = 1), np.std(pas, axis = 1))
+
+
+class EphemerisGrid(object):
+    """
+    The positions of the planets sampled on a grid of dates covering some time windows (e.g. the
+    absoluteTimeConstraints), from which the position at any date within the windows is interpolated
+    """
+    def __init__(self, windows = None, step = DEFAULT_GRID_STEP):
+        self.step = step
+        self.windows = []
+        self.mjds = None
+        self.ephemerides = dict({})
+        self._lock = threading.Lock()
+        if not(windows is None):
+            self.set_windows(windows)
+        return None
+
+    def set_windows(self, windows):
+        """
+        Set the time windows covered by the grid. Any grid already computed is dropped.
+        @param windows: list of (from, to) dates, as in absoluteTimeConstraints
+        """
+        import numpy as np
+        with self._lock:
+            self.windows = [(to_mjd(start), to_mjd(end)) for start, end in windows]
+            mjds = []
+            for start, end in self.windows:
+                mjds = mjds + list(np.linspace(start, end, max(2, int(np.ceil((end - start)/self.step)) + 1)))
+            self.mjds = np.unique(mjds) if len(mjds) > 0 else None
+            self.ephemerides = dict({})
+        return None
+
+    def covers(self, mjd):
+        """ True if the given date (mjd) is within one of the windows """
+        return any([(start <= mjd) and (mjd <= end) for start, end in self.windows])
+
+    def ephemeris(self, name):
+        """ return the positions of a planet on the grid, as returned by sample_orbits (sampled on first use) """
+        with self._lock:
+            if not(name in self.ephemerides):
+                common.printinf("Sampling the orbit of {} with whereistheplanet on {} dates".format(name, len(self.mjds)))
+                with profiling.span("sample_orbits", "whereistheplanet"):
+                    self.ephemerides[name] = sample_orbits(name, self.mjds)
+            return self.ephemerides[name]
+
+    def predict(self, name, date):
+        """
+        Return the position of a planet at a date interpolated on the grid, in the same format as predict_planet,
+        or None if the date is not within the windows of the grid
+        """
+        import numpy as np
+        mjd = to_mjd(date)
+        if not(self.covers(mjd)):
+            return None
+        ra, ra_err, dec, dec_err, sep, sep_err, pa, pa_err = self.ephemeris(name)
+        interp = lambda values: float(np.interp(mjd, self.mjds, values))
+        return ((interp(ra), interp(ra_err)), (interp(dec), interp(dec_err)), (interp(sep), interp(sep_err)),
+                (interp(np.degrees(np.unwrap(np.radians(pa)))) % 360, interp(pa_err)))
+
+    def drift(self, name):
+        """ return the list of (from, to, drift) of the windows, with the max distance (mas) between two positions of the planet within each window """
+        import numpy as np
+        ra, ra_err, dec, dec_err, sep, sep_err, pa, pa_err = self.ephemeris(name)
+        drifts = []
+        for start, end in self.windows:
+            inside = (self.mjds >= start) & (self.mjds <= end)
+            x, y = ra[inside], dec[inside]
+            drifts.append((start, end, float(np.max(np.sqrt((x[:, None] - x[None, :])**2 + (y[:, None] - y[None, :])**2)))))
+        return drifts
+
+
+# used by predict_planet if windows are set (see create_obs.py)
+DEFAULT_EPHEMERIS_GRID = EphemerisGrid()
+
+
+def collect_planet_names(cfg):
+    """
+    Walk through all the ObservingBlocks of a yml config and return the list of planets which use the
+    whereistheplanet coord_syst
+    @param cfg: dict containing the full yml configuration
+    """
+    names = []
+    for ob_name in cfg["ObservingBlocks"]:
+        ob = cfg["ObservingBlocks"][ob_name]
+        items = [ob] + [ob["objects"][key] for key in ob.get("objects", dict({}))]
+        for item in items:
+            if (item.get("coord_syst", None) == "whereistheplanet") and not(str(item["coord"]) in names):
+                names.append(str(item["coord"]))
+    return names
+
+
+def check_drift(names, grid = DEFAULT_EPHEMERIS_GRID, fiber_radius = FIBER_RADIUS):
+    """
+    Warn for all the planets whose position moves by more than a fiber radius within one of the windows of the grid
+    @param names: names of the planets
+    """
+    from astropy.time import Time
+    for name in names:
+        for start, end, drift in grid.drift(name):
+            if drift > fiber_radius:
+                common.printwar("{} moves by {:.1f} mas between {} and {}, more than the fiber radius ({} mas). The OBs may need to be split in shorter windows".format(name, drift, Time(start, format = "mjd").isot, Time(end, format = "mjd").isot, fiber_radius))
+    return None
+
+
+# only one prediction is computed at a time, so that two threads never compute the same one
+_PREDICTION_LOCK = threading.Lock()
+
+
+def predict_planet(name, date, cache = DEFAULT_PREDICTION_CACHE, grid = DEFAULT_EPHEMERIS_GRID):
+    """
+    Predict the position of a planet relative to its star with whereistheplanet
+    Return ((ra, ra_err), (dec, dec_err), (sep, sep_err), (pa, pa_err)), in mas and deg
+    @param name: name of the planet, as known by whereistheplanet (e.g. HR8799b)
+    @param date: date of the prediction (iso string)
+    @param cache: the PredictionCache where predictions are reused from, or None to always compute them
+    @param grid: the EphemerisGrid used to interpolate the position if date is within its windows
+    """
+    date = str(date)
+    if not(grid is None) and (len(grid.windows) > 0):
+        prediction = grid.predict(name, date)
+        if not(prediction is None):
+            return prediction
+    with _PREDICTION_LOCK:
+        if not(cache is None):
+            prediction = cache.get(name, date)
+            if not(prediction is None):
+                return prediction
+        whereistheplanet = load_whereistheplanet()
+        if whereistheplanet is None:
+            common.printerr("whereistheplanet used as a coord_syst, but whereistheplanet module could not be loaded")
+        common.printinf("Resolution of {} with whereistheplanet:".format(name))
+        with profiling.span("predict_planet", "whereistheplanet"):
+            prediction = whereistheplanet.predict_planet(name, date)
+        if not(cache is None):
+            cache.store(name, date, prediction)
+            prediction = cache.get(name, date)
+    return prediction
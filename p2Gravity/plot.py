@@ -5,12 +5,12 @@ import matplotlib.patches as patches
 from matplotlib.widgets import Button
 import matplotlib.image as mpimg
 
-from astropy import units as u
-from astropy.coordinates import SkyCoord
-
 import math
 import numpy as np
 
+from . import profiling
+from .geometry import ObGeometry
+
 # to show the DIT JPG
 import os
 WHEREAMI = os.path.dirname(__file__)
@@ -39,177 +39,132 @@ def show_dit_jpg():
     return None
 
 
-def plot_acquisition(ob, ax = None, fiber_fov = 30, ft_c = FT_C, sc_c = SC_C):
+def plot_acquisition(ob, ax = None, fiber_fov = 30, ft_c = FT_C, sc_c = SC_C, geometry = None):
     acqTpl = ob.acquisition
     if ax is None:
         fig = plt.figure()
         ax = fig.add_subplot(111)
+    if geometry is None:
+        geometry = ObGeometry(ob)
     # GWIDE
-    if ob.ob_type in ["DualWideOnOb", "DualWideOffOb"]:
+    if geometry.wide:
         # center of field = acq target = ft target
         ax.plot(0, 0, "*k", markersize=20)        
-        # plot FT fiber            
-        xft, yft = ob.acquisition["COU.FTS.ALPHA"], ob.acquisition["COU.FTS.DELTA"]
-        xsc, ysc = ob.target["ra"], ob.target["dec"]
-        coord_ft = SkyCoord(xft, yft, unit=(u.hourangle, u.deg))
-        coord_sc = SkyCoord(xsc, ysc, unit=(u.hourangle, u.deg))
-        pa = coord_ft.position_angle(coord_sc).to(u.rad).value
-        sep = coord_ft.separation(coord_sc).to(u.arcsec).value
-        if ob.acquisition["COU.NGS.SOURCE"] == "FT":
-            xsc, ysc = math.sin(pa)*sep, math.cos(pa)*sep
-            xft, yft = 0, 0
-        elif ob.acquisition["COU.NGS.SOURCE"] == "SCIENCE":
-            xsc, ysc = 0, 0
-            xft, yft = -math.sin(pa)*sep, -math.cos(pa)*sep
-        else:
-            # not implemented
-            xsc, ysc = 0, 0
-            xft, yft = 0, 0
+        (xft, yft), (xsc, ysc) = geometry.ft, geometry.sc
         # FT fiber
-        fib = plt.plot(xft, yft, color=ft_c, marker="o", ls="")        
+        fib = ax.plot(xft, yft, color=ft_c, marker="o", ls="")        
         # SC fiber is ACQ target
-        fib = plt.plot(xsc, ysc, color=sc_c, marker="o", ls="")
+        fib = ax.plot(xsc, ysc, color=sc_c, marker="o", ls="")
+        x, y = geometry.acq_direction()
+        norm = math.sqrt(x**2+y**2)
         if not(ob.ob_type in ["DualWideOnOb"]):
-            x, y = (xsc - xft), (ysc - yft)
-            norm = math.sqrt(x**2+y**2)
-            plt.plot([-1000*x/norm, 1000*x/norm], [-1000*y/norm, 1000*y/norm], "-k", alpha=0.2)
+            ax.plot([-1000*x/norm, 1000*x/norm], [-1000*y/norm, 1000*y/norm], "-k", alpha=0.2)
         else:
-            x = np.mean(np.array([tpl["SEQ.RELOFF.X"] for tpl in ob.templates]))
-            y = np.mean(np.array([tpl["SEQ.RELOFF.Y"] for tpl in ob.templates]))           
-            norm = math.sqrt(x**2+y**2)
-            plt.plot([-1000*x/norm+xsc, 1000*x/norm+xsc], [-1000*y/norm+ysc, 1000*y/norm+ysc], "-k", alpha=0.2)
+            ax.plot([-1000*x/norm+xsc, 1000*x/norm+xsc], [-1000*y/norm+ysc, 1000*y/norm+ysc], "-k", alpha=0.2)
     # OTHER MODES
     else:
         # plot FT fiber
         ax.plot(0, 0, "*k")
-        fib = plt.Circle((0, 0), fiber_fov, edgecolor=ft_c, facecolor="None", ls = FT_LS)
+        fib = patches.Circle((0, 0), fiber_fov, edgecolor=ft_c, facecolor="None", ls = FT_LS)
         ax.add_patch(fib)        
         # plot science fiber
         if acqTpl.template_name in ["GRAVITY_single_onaxis_acq", "GRAVITY_single_offaxis_acq"]:
-            fib = plt.Circle((0, 0), fiber_fov, edgecolor=sc_c, facecolor="None", ls = SC_LS)
+            fib = patches.Circle((0, 0), fiber_fov, edgecolor=sc_c, facecolor="None", ls = SC_LS)
             ax.add_patch(fib)
         if acqTpl.template_name in ["GRAVITY_dual_onaxis_acq", "GRAVITY_dual_offaxis_acq"]:
-            x, y = acqTpl["SEQ.INS.SOBJ.X"], acqTpl["SEQ.INS.SOBJ.Y"]
-            fib = plt.Circle((x, y), fiber_fov, edgecolor=sc_c, facecolor="None", ls = SC_LS)
+            x, y = geometry.acq_direction()
+            fib = patches.Circle((x, y), fiber_fov, edgecolor=sc_c, facecolor="None", ls = SC_LS)
             ax.add_patch(fib)
             norm = math.sqrt(x**2+y**2)
-            plt.plot([-1000*x/norm, 1000*x/norm], [-1000*y/norm, 1000*y/norm], "-k", alpha=0.2)
+            ax.plot([-1000*x/norm, 1000*x/norm], [-1000*y/norm, 1000*y/norm], "-k", alpha=0.2)
     return None        
 
-def plot_dualObsExp(ob, template, ax = None, fiber_fov = 30, ft_c = FT_C, sc_c = SC_C, ft_ls = FT_LS, sc_ls = SC_LS, sobj = (0, 0), swap = 1):
+def _template_geometry(ob, template, geometry, swap):
+    """ the geometry of the OB (computed if not given), of the template, and the swap state to use """
+    if geometry is None:
+        geometry = ObGeometry(ob)
+    tpl_geometry = geometry.template(template)
+    if swap is None:
+        swap = tpl_geometry["swap"]
+    return geometry, tpl_geometry, swap
+
+def _exposure_text(template):
+    return "$(\mathrm{{DIT}}, \mathrm{{NDIT}}, \mathrm{{NDIT_{{SKY}}}}) = ({}\,\mathrm{{s}}, {}, {})$ \n".format(template["DET2.DIT"], template["DET2.NDIT.OBJECT"], template["DET2.NDIT.SKY"])
+
+def plot_dualObsExp(ob, template, ax = None, fiber_fov = 30, ft_c = FT_C, sc_c = SC_C, ft_ls = FT_LS, sc_ls = SC_LS, sobj = None, swap = None, geometry = None):
+    """
+    Plot a dual field template and return its description
+    @param sobj, swap: position of the object and swap state. Default to the ones of the template in the OB
+    @param geometry: the ObGeometry of the OB, computed if not given
+    """
     if ax is None:
         fig = plt.figure()
         ax = fig.add_subplot(111)
+    geometry, tpl_geometry, swap = _template_geometry(ob, template, geometry, swap)
     # FT fiber
-    if ob.ob_type in ["DualWideOnOb", "DualWideOffOb"]:
+    if geometry.wide:
         # gwide is a pain
-        xft, yft = ob.acquisition["COU.FTS.ALPHA"], ob.acquisition["COU.FTS.DELTA"]
-        xsc, ysc = ob.target["ra"], ob.target["dec"]
-        coord_ft = SkyCoord(xft, yft, unit=(u.hourangle, u.deg))
-        coord_sc = SkyCoord(xsc, ysc, unit=(u.hourangle, u.deg))
-        pa = coord_ft.position_angle(coord_sc).to(u.rad).value
-        sep = coord_ft.separation(coord_sc).to(u.arcsec).value
-        if ob.acquisition["COU.NGS.SOURCE"] == "FT":
-            xsc, ysc = math.sin(pa)*sep, math.cos(pa)*sep
-            xft, yft = 0, 0
-        elif ob.acquisition["COU.NGS.SOURCE"] == "SCIENCE":
-            xsc, ysc = 0, 0
-            xft, yft = -math.sin(pa)*sep, -math.cos(pa)*sep
-        else:
-            # not implemented
-            xsc, ysc = 0, 0
-            xft, yft = 0, 0
+        (xft, yft), (xsc, ysc) = geometry.ft, geometry.sc
         fib = ax.plot(swap*xft, swap*yft, color=FT_C, marker = "o", ls = "")
         if ob.ob_type in ["DualWideOnOb"]:
-            for k in range(len(template["SEQ.RELOFF.X"])):
-                dx, dy = template["SEQ.RELOFF.X"][k], template["SEQ.RELOFF.Y"][k]
-                sep, pa = round(math.sqrt(dx**2+dy**2), 2), round(math.atan2(dx, dy)/math.pi*180, 2)                
-                fib = ax.plot(swap*xsc, swap*ysc, color="k", marker = "+", ls = "")
-                fib = ax.plot(swap*xsc+dx/1000.0, swap*ysc+dy/1000.0, color=sc_c, marker = "o", ls = "")
-                fib = ax.plot([swap*xsc, swap*xsc+dx/1000.0], [swap*ysc, swap*ysc+dy/1000.0], color=sc_c, marker = "", ls = "--") # in WIDE, the unit of plot is as not mas
-                txt = "$(\Delta{{}}\mathrm{{RA}}, \Delta{{}}\mathrm{{DEC}}) = ({}\,\mathrm{{mas}}, {}\,\mathrm{{mas}})$\n".format(dx, dy)
-                txt = txt + "$(\mathrm{{PA}}, \mathrm{{SEP}}) = ({}\,\mathrm{{deg}}, {}\,\mathrm{{mas}})$ \n".format(pa, sep)                
+            dx, dy = tpl_geometry["reloff"]
+            fib = ax.plot(swap*xsc, swap*ysc, color="k", marker = "+", ls = "")
+            fib = ax.plot(swap*xsc+dx/1000.0, swap*ysc+dy/1000.0, color=sc_c, marker = "o", ls = "")
+            fib = ax.plot(np.array([np.full(len(dx), swap*xsc), swap*xsc+dx/1000.0]), np.array([np.full(len(dy), swap*ysc), swap*ysc+dy/1000.0]), color=sc_c, marker = "", ls = "--") # in WIDE, the unit of plot is as not mas
+            # the last offset is described
+            txt = "$(\Delta{{}}\mathrm{{RA}}, \Delta{{}}\mathrm{{DEC}}) = ({}\,\mathrm{{mas}}, {}\,\mathrm{{mas}})$\n".format(template["SEQ.RELOFF.X"][-1], template["SEQ.RELOFF.Y"][-1])
+            txt = txt + "$(\mathrm{{PA}}, \mathrm{{SEP}}) = ({}\,\mathrm{{deg}}, {}\,\mathrm{{mas}})$ \n".format(tpl_geometry["reloff_pa"][-1], tpl_geometry["reloff_sep"][-1])
         else:
             fib = ax.plot(swap*xsc, swap*ysc, color=sc_c, marker = "o", ls = "")
             txt = ""            
     else:
-        fib = plt.Circle((0, 0), fiber_fov, edgecolor=ft_c, facecolor="None", ls = ft_ls)
+        fib = patches.Circle((0, 0), fiber_fov, edgecolor=ft_c, facecolor="None", ls = ft_ls)
         ax.add_patch(fib)
-        # SC fiber
-        x, y = sobj[0], sobj[1]
-        pos = []
-        for k in range(len(template["SEQ.RELOFF.X"])):
-            x, y = x+template["SEQ.RELOFF.X"][k], y+template["SEQ.RELOFF.Y"][k]  # cumulative offsets
-            fib = plt.Circle((x, y), fiber_fov, edgecolor=sc_c, facecolor="None", ls = sc_ls)
+        # SC fiber, at the cumulative offsets
+        if sobj is None:
+            x, y, pa, sep = tpl_geometry["positions"]
+        else:
+            x, y, pa, sep = ObGeometry.positions(sobj, tpl_geometry["reloff"])
+        for k in range(len(x)):
+            fib = patches.Circle((x[k], y[k]), fiber_fov, edgecolor=sc_c, facecolor="None", ls = sc_ls)
             ax.add_patch(fib)
-            sep, pa = round(math.sqrt(x**2+y**2), 2), round(math.atan2(x, y)/math.pi*180, 2)
-            pos.append([x, y, pa, sep])
         txt = "$(\Delta{{}}\mathrm{{RA}}, \Delta{{}}\mathrm{{DEC}})$ ="
-        for p in pos:
+        for p in zip(x.tolist(), y.tolist()):
             txt = txt+" ({}, {})".format(p[0], p[1])
         txt = txt + "\n$(\mathrm{{PA}}, \mathrm{{SEP}})$ ="
-        for p in pos:
-            txt = txt+" ({}, {}) ".format(p[2], p[3])
+        for p in zip(pa.tolist(), sep.tolist()):
+            txt = txt+" ({}, {}) ".format(p[0], p[1])
         txt = txt+"\n"
-    dit, ndit, ndit_sky = template["DET2.DIT"], template["DET2.NDIT.OBJECT"], template["DET2.NDIT.SKY"]
-    exptime = 0
-    exptime_sky = 0
-    for o in template["SEQ.OBSSEQ"]:
-        if o == "O":
-            exptime = exptime+dit*ndit
-        if o == "S":
-            exptime_sky = exptime_sky+dit*ndit_sky            
-    txt = txt + "$(\mathrm{{DIT}}, \mathrm{{NDIT}}, \mathrm{{NDIT_{{SKY}}}}) = ({}\,\mathrm{{s}}, {}, {})$ \n".format(dit, ndit, ndit_sky)    
+    txt = txt + _exposure_text(template)
     txt = txt+"Sequence: {}\n".format(template["SEQ.OBSSEQ"])
-#    txt = txt+"Exposure time (object, sky): $({}\,\mathrm{{s}}, {}\,\mathrm{{s}})$\n".format(exptime, exptime_sky)
+#    txt = txt+"Exposure time (object, sky): $({}\,\mathrm{{s}}, {}\,\mathrm{{s}})$\n".format(tpl_geometry["exptime"], tpl_geometry["exptime_sky"])
     return txt
 
-def plot_singleObsExp(ob, template, ax = None, ft_c = FT_C, sc_c = SC_C, fiber_fov = 30, ft_ls = FT_LS, sc_ls = SC_LS, swap = 1):
+def plot_singleObsExp(ob, template, ax = None, ft_c = FT_C, sc_c = SC_C, fiber_fov = 30, ft_ls = FT_LS, sc_ls = SC_LS, swap = None, geometry = None):
     if ax is None:
         fig = plt.figure()
         ax = fig.add_subplot(111)
+    geometry, tpl_geometry, swap = _template_geometry(ob, template, geometry, swap)
     ax.plot(0, 0, "*k")
     # FT fib
-    fib = plt.Circle((0, 0), fiber_fov, edgecolor=ft_c, facecolor="None", ls = ft_ls)
+    fib = patches.Circle((0, 0), fiber_fov, edgecolor=ft_c, facecolor="None", ls = ft_ls)
     ax.add_patch(fib)
     # SC fib
-    fib = plt.Circle((0, 0), fiber_fov, edgecolor=sc_c, facecolor="None", ls = sc_ls)
+    fib = patches.Circle((0, 0), fiber_fov, edgecolor=sc_c, facecolor="None", ls = sc_ls)
     ax.add_patch(fib)    
-    dit, ndit, ndit_sky = template["DET2.DIT"], template["DET2.NDIT.OBJECT"], template["DET2.NDIT.SKY"]
-    exptime = 0
-    exptime_sky = 0    
-    for o in template["SEQ.OBSSEQ"]:
-        if o == "O":
-            exptime = exptime+dit*ndit
-        if o == "S":
-            exptime_sky = exptime_sky+dit*ndit_sky
     txt = "Sequence: {}\n".format(template["SEQ.OBSSEQ"])
-    txt = txt + "$(\mathrm{{DIT}}, \mathrm{{NDIT}}, \mathrm{{NDIT_{{SKY}}}}) = ({}\,\mathrm{{s}}, {}, {})$ \n".format(dit, ndit, ndit_sky)    
-    txt = txt+"Exposure time (object, sky): $({}\,\mathrm{{s}}, {}\,\mathrm{{s}})$\n".format(exptime, exptime_sky)    
+    txt = txt + _exposure_text(template)
+    txt = txt+"Exposure time (object, sky): $({}\,\mathrm{{s}}, {}\,\mathrm{{s}})$\n".format(tpl_geometry["exptime"], tpl_geometry["exptime_sky"])    
     return txt
 
-def plot_dualObsSwap(ob, template, ax = None, fiber_fov = 30, ft_c = FT_C, sc_c = SC_C, ft_ls = FT_LS, sc_ls = SC_LS, sobj = (0, 0), swap = 1):
+def plot_dualObsSwap(ob, template, ax = None, fiber_fov = 30, ft_c = FT_C, sc_c = SC_C, ft_ls = FT_LS, sc_ls = SC_LS, sobj = None, swap = None, geometry = None):
     if ax is None:
         fig = plt.figure()
         ax = fig.add_subplot(111)
-    if ob.ob_type in ["DualWideOnOb", "DualWideOffOb"]:
+    geometry, tpl_geometry, swap = _template_geometry(ob, template, geometry, swap)
+    if geometry.wide:
         # gwide is a pain        
-        xft, yft = ob.acquisition["COU.FTS.ALPHA"], ob.acquisition["COU.FTS.DELTA"]
-        xsc, ysc = ob.target["ra"], ob.target["dec"]
-        coord_ft = SkyCoord(xft, yft, unit=(u.hourangle, u.deg))
-        coord_sc = SkyCoord(xsc, ysc, unit=(u.hourangle, u.deg))
-        pa = coord_ft.position_angle(coord_sc).to(u.rad).value
-        sep = coord_ft.separation(coord_sc).to(u.arcsec).value
-        if ob.acquisition["COU.NGS.SOURCE"] == "FT":
-            xsc, ysc = math.sin(pa)*sep, math.cos(pa)*sep
-            xft, yft = 0, 0
-        elif ob.acquisition["COU.NGS.SOURCE"] == "SCIENCE":
-            xsc, ysc = 0, 0
-            xft, yft = -math.sin(pa)*sep, -math.cos(pa)*sep
-        else:
-            # not implemented
-            xsc, ysc = 0, 0
-            xft, yft = 0, 0
+        (xft, yft), (xsc, ysc) = geometry.ft, geometry.sc
         # plot fibers                        
         fib = ax.plot(xft, yft, color=ft_c, marker = "o", ls="")
         fib = ax.plot(xsc, ysc, color=sc_c, marker = "o", ls="")
@@ -217,11 +172,13 @@ def plot_dualObsSwap(ob, template, ax = None, fiber_fov = 30, ft_c = FT_C, sc_c
         arrow = patches.FancyArrowPatch((0, 0), (xft-xsc, yft-ysc), arrowstyle='<->', mutation_scale=10)
         ax.add_patch(arrow)        
     else:
+        if sobj is None:
+            sobj = tpl_geometry["sobj"]
         # FT pos
-        fib = plt.Circle((0, 0), fiber_fov, edgecolor=ft_c, facecolor="None", ls = ft_ls)
+        fib = patches.Circle((0, 0), fiber_fov, edgecolor=ft_c, facecolor="None", ls = ft_ls)
         ax.add_patch(fib)
         # SC fib
-        fib = plt.Circle(sobj, fiber_fov, edgecolor=sc_c, facecolor="None", ls = sc_ls)
+        fib = patches.Circle(sobj, fiber_fov, edgecolor=sc_c, facecolor="None", ls = sc_ls)
         ax.add_patch(fib)
         # plot an arrow
         arrow = patches.FancyArrowPatch((0, 0), sobj, arrowstyle='<->', mutation_scale=10)
@@ -239,99 +196,208 @@ def plot_template(ob, template, **kwargs):
         return plot_dualObsSwap(ob, template, **kwargs)
     
 
-def plot_ob(ob, title = None, fov = None, bg=None, bglim=None, ft_c = None, sc_c = None, acq_only = False):
-    # default colors
-    if ft_c is None:
-        ft_c = FT_C
-    if sc_c is None:
-        sc_c = SC_C            
-    # prepare figure and gridspec
-    fig = plt.figure(figsize=(12, 7), tight_layout = True)
-    ntpl = len(ob.templates)
-    ncols = 6
-    nrows = 2 + math.ceil(ntpl/6)
-    h_ratios = nrows*[5]
-    h_ratios[0] = 1
-    h_ratios[1] = 30
-    gs = gridspec.GridSpec(nrows, ncols, height_ratios = h_ratios)
-    # get fiber fov from telescope type
-    if "UTs" in ob.acquisition["ISS.BASELINE"]:
-        fiber_fov = 30
-    else: # ATs
-        fiber_fov = 120
-    # default fov is 10 fiber_fov
-    if fov is None:
-        fov = 10*fiber_fov
-    # create main axis for OB plot
-    ax_ob = fig.add_subplot(gs[1, 0:3])
-    # add background if requested
-    if not(bg is None):
-        img = mpimg.imread(bg)
-        imgplot = ax_ob.imshow(img, extent=bglim)
-    ax_ob.grid("both")
-    ax_ob.set_xlim(fov, -fov)
-    ax_ob.set_ylim(-fov, fov)    
-#    ax_ob.invert_xaxis()
-    ax_ob.set_aspect("equal")
-    # now we can plot the acquisition
-    plot_acquisition(ob, fiber_fov = fiber_fov, ax = ax_ob, ft_c = ft_c, sc_c = sc_c)    
-    if ob.ob_type in ["DualWideOnOb", "DualWideOffOb"]:
-        ax_ob.set_xlabel("$\Delta{}\mathrm{RA}$ (mas)")
-        ax_ob.set_ylabel("$\Delta{}\mathrm{DEC}$ (mas)")
-    else:
-        ax_ob.set_xlabel("$\Delta{}\mathrm{RA}$ (as)")
-        ax_ob.set_ylabel("$\Delta{}\mathrm{DEC}$ (as)")    
-
-    # and plot the templates one by one
-    txt_col1 = "" # we'll have two columns of text to explain templates
-    txt_col2 = ""
-    swap = 1 # for dualOff we need to keep track of swap status
-    for k in range(ntpl):
-        # for each template, we add it on top of main plot
-        if ob.ob_type in ["DualOffOb", "DualOnOb"]: # take into account acquisition offset
-            sobj = (swap*ob.acquisition["SEQ.INS.SOBJ.X"], swap*ob.acquisition["SEQ.INS.SOBJ.Y"])
-            plot_template(ob, ob.templates[k], fiber_fov = fiber_fov, ax = ax_ob, sobj = sobj, swap = swap, ft_c = ft_c, sc_c = sc_c)
-        elif ob.ob_type in ["DualWideOnOb", "DualWideOffOb"]:
-            plot_template(ob, ob.templates[k], fiber_fov = fiber_fov, ax = ax_ob, swap = swap, ft_c = ft_c, sc_c = sc_c)
-        else:
-            plot_template(ob, ob.templates[k], fiber_fov = fiber_fov, ax = ax_ob, swap = swap, ft_c = ft_c, sc_c = sc_c)
-        # and we plot it as an individual subplot at bottom
-        if not(acq_only):
-            row, col = k//ncols, k - ncols*(k//ncols)
-            ax_tpl = fig.add_subplot(gs[2+row, col])
-            ax_tpl.grid("both")
-            ax_tpl.set_xlim(fov, -fov)
-            ax_tpl.set_ylim(-fov, fov)
-            ax_tpl.set_aspect("equal")
-            ax_tpl.set_title("TPL {}".format(k+1))
-            if ob.ob_type in ["DualOffOb", "DualOnOb"]: # take into account acquisition offset
-                sobj = (swap*ob.acquisition["SEQ.INS.SOBJ.X"], swap*ob.acquisition["SEQ.INS.SOBJ.Y"])
-                txt_tpl = plot_template(ob, ob.templates[k], ax = ax_tpl, ft_ls = "-", sc_ls = "-", sobj = sobj, ft_c = ft_c, sc_c = sc_c)
-            elif ob.ob_type in ["DualWideOnOb", "DualWideOffOb"]:
-                txt_tpl = plot_template(ob, ob.templates[k], fiber_fov = fiber_fov, ax = ax_tpl, swap = swap, ft_c = ft_c, sc_c = sc_c)                        
-            else:
-                txt_tpl = plot_template(ob, ob.templates[k], ax = ax_tpl, ft_ls = "-", sc_ls = "-", ft_c = ft_c, sc_c = sc_c)            
-            if k%2==0:
-                txt_col1 = txt_col1+"TPL {}:\n{}\n".format(k+1, txt_tpl)
+def ob_title(ob):
+    """ the title of the figure of an OB: its run, folder, label and date """
+    return "run: {}        folder: {}\nob: {}        date: {}".format(ob.setup["run_id"], ob.setup["folder"], ob.label, ob.setup["date"])
+
+# decoded background images, by file
+_BACKGROUNDS = dict({})
+
+def load_background(bg):
+    """ return the image of a background file, which is only read once """
+    if not(bg in _BACKGROUNDS):
+        _BACKGROUNDS[bg] = mpimg.imread(bg)
+    return _BACKGROUNDS[bg]
+
+def _clear_axis(ax, keep = None):
+    """ remove all the artists drawn on an axis (except the ones in keep), but keep the axis itself """
+    keep = [] if keep is None else keep
+    for artist in list(ax.lines) + list(ax.patches) + list(ax.collections) + list(ax.images):
+        if not(any([artist is kept for kept in keep])):
+            artist.remove()
+    if not(ax.get_legend() is None):
+        ax.get_legend().remove()
+    return None
+
+def _set_fov(ax, fov):
+    ax.set_xlim(fov, -fov)
+    ax.set_ylim(-fov, fov)
+    ax.set_aspect("equal")
+    return None
+
+
+class ObFigure(object):
+    """
+    The figure of an OB: the acquisition with all the templates on top of it, a panel and a description for each
+    template, and a title. The axes are created once, and kept when another OB is drawn on the same figure: only
+    the artists are drawn again (and the grid is only changed if the number of rows of templates changes)
+    """
+    NCOLS = 6
+
+    def __init__(self, fig = None):
+        """
+        @param fig: the Figure to draw on. By default, a new pyplot figure is created
+        """
+        if fig is None:
+            fig = plt.figure(figsize=(12, 7), tight_layout = True)
+        self.fig = fig
+        self.gs = None
+        self.nrows = None
+        self.axes = dict({})
+        # the text artists of the description of the templates, and of the title
+        self._txt = None
+        self._title = None
+        # the background image: (file, extent, AxesImage)
+        self._bg = None
+        return None
+
+    def spec(self, key):
+        """ the position of an axis in the grid """
+        if key == "ob":
+            return self.gs[1, 0:3]
+        if key == "txt":
+            return self.gs[1, 3:6]
+        if key == "title":
+            return self.gs[0, 0:4]
+        k = key[1] # a template
+        return self.gs[2 + k//self.NCOLS, k%self.NCOLS]
+
+    def layout(self, ntpl):
+        """ prepare the grid for ntpl templates. Return True if the grid changed """
+        nrows = 2 + math.ceil(ntpl/self.NCOLS)
+        if nrows == self.nrows:
+            return False
+        self.nrows = nrows
+        h_ratios = nrows*[5]
+        h_ratios[0] = 1
+        h_ratios[1] = 30
+        self.gs = gridspec.GridSpec(nrows, self.NCOLS, height_ratios = h_ratios, figure = self.fig)
+        for key in self.axes:
+            self.axes[key].set_subplotspec(self.spec(key))
+        return True
+
+    def axis(self, key):
+        """ return an axis of the figure, created if needed """
+        if not(key in self.axes):
+            ax = self.fig.add_subplot(self.spec(key))
+            if key in ["txt", "title"]:
+                ax.axis("off")
             else:
-                txt_col2 = txt_col2+"TPL {}:\n{}\n".format(k+1, txt_tpl)
-            # now we can add the text
-            ax_txt = fig.add_subplot(gs[1, 3:6])
-            ax_txt.axis("off")
-            ax_txt.text(0, 1, txt_col1, fontsize=8, va="top", ha="left")
-            ax_txt.text(0.5, 1, txt_col2, fontsize=8, va="top", ha="left")
-        # if this template was a swap, swap the swap value
-        if ob.templates[k].template_name == "GRAVITY_dual_obs_swap":
-            swap = -swap
-
-    # and a title if requested
-    if not(title is None):
-        ax_title = fig.add_subplot(gs[0, 0:4])
-        ax_title.axis("off")        
-        ax_title.text(0.1, 0, title, fontsize=12, va="center", ha="left")
-
-    ax_ob.legend(["Acq tgt", "FT fiber", "SC fiber", "Acq direction"])        
-    return fig, gs
+                ax.grid("both")
+            self.axes[key] = ax
+        self.show_axis(key, True)
+        return self.axes[key]
+
+    def show_axis(self, key, visible):
+        if key in self.axes:
+            self.axes[key].set_visible(visible)
+            self.axes[key].set_in_layout(visible)
+        return None
+
+    def _background(self, ax, bg, bglim):
+        """ show a background image, kept if it is the same as for the previous OB """
+        key = None if bg is None else (bg, None if bglim is None else tuple(bglim))
+        if not(self._bg is None) and (self._bg[0] == key):
+            return None
+        if not(self._bg is None):
+            self._bg[1].remove()
+            self._bg = None
+        if not(key is None):
+            self._bg = (key, ax.imshow(load_background(bg), extent=bglim))
+        return None
+
+    def draw(self, ob, title = None, fov = None, bg=None, bglim=None, ft_c = None, sc_c = None, acq_only = False, geometry = None):
+        """
+        Draw the acquisition and templates of an OB, in place of the previous OB if any
+        @param geometry: the ObGeometry of the OB, if already computed
+        """
+        # default colors
+        if ft_c is None:
+            ft_c = FT_C
+        if sc_c is None:
+            sc_c = SC_C
+        ntpl = len(ob.templates)
+        self.layout(ntpl)
+        # positions of the fibers and offsets of all templates, computed once for all the panels
+        if geometry is None:
+            geometry = ObGeometry(ob)
+        fiber_fov = geometry.fiber_fov
+        # default fov is 10 fiber_fov
+        if fov is None:
+            fov = 10*fiber_fov
+        # main axis for OB plot, with the background if requested
+        ax_ob = self.axis("ob")
+        self._background(ax_ob, bg, bglim)
+        _clear_axis(ax_ob, keep = None if self._bg is None else [self._bg[1]])
+        _set_fov(ax_ob, fov)
+        # now we can plot the acquisition
+        plot_acquisition(ob, fiber_fov = fiber_fov, ax = ax_ob, ft_c = ft_c, sc_c = sc_c, geometry = geometry)
+        if geometry.wide:
+            ax_ob.set_xlabel("$\Delta{}\mathrm{RA}$ (mas)")
+            ax_ob.set_ylabel("$\Delta{}\mathrm{DEC}$ (mas)")
+        else:
+            ax_ob.set_xlabel("$\Delta{}\mathrm{RA}$ (as)")
+            ax_ob.set_ylabel("$\Delta{}\mathrm{DEC}$ (as)")
+
+        # and plot the templates one by one
+        txt_col1 = "" # we'll have two columns of text to explain templates
+        txt_col2 = ""
+        # the swap status and the acquisition offset of each template are in the geometry
+        for k in range(ntpl):
+            # for each template, we add it on top of main plot
+            plot_template(ob, ob.templates[k], fiber_fov = fiber_fov, ax = ax_ob, ft_c = ft_c, sc_c = sc_c, geometry = geometry)
+            # and we plot it as an individual subplot at bottom
+            if not(acq_only):
+                ax_tpl = self.axis(("tpl", k))
+                _clear_axis(ax_tpl)
+                _set_fov(ax_tpl, fov)
+                ax_tpl.set_title("TPL {}".format(k+1))
+                if geometry.wide:
+                    txt_tpl = plot_template(ob, ob.templates[k], fiber_fov = fiber_fov, ax = ax_tpl, ft_c = ft_c, sc_c = sc_c, geometry = geometry)
+                else:
+                    txt_tpl = plot_template(ob, ob.templates[k], ax = ax_tpl, ft_ls = "-", sc_ls = "-", ft_c = ft_c, sc_c = sc_c, geometry = geometry)
+                if k%2==0:
+                    txt_col1 = txt_col1+"TPL {}:\n{}\n".format(k+1, txt_tpl)
+                else:
+                    txt_col2 = txt_col2+"TPL {}:\n{}\n".format(k+1, txt_tpl)
+        # hide the panels of the templates of a previous OB
+        for key in self.axes:
+            if (key[0] == "tpl") and (acq_only or (key[1] >= ntpl)):
+                self.show_axis(key, False)
+        # now we can add the text
+        if not(acq_only) and (ntpl > 0):
+            ax_txt = self.axis("txt")
+            if self._txt is None:
+                self._txt = (ax_txt.text(0, 1, "", fontsize=8, va="top", ha="left"), ax_txt.text(0.5, 1, "", fontsize=8, va="top", ha="left"))
+            self._txt[0].set_text(txt_col1)
+            self._txt[1].set_text(txt_col2)
+        else:
+            self.show_axis("txt", False)
+
+        # and a title if requested
+        if not(title is None):
+            ax_title = self.axis("title")
+            if self._title is None:
+                self._title = ax_title.text(0.1, 0, "", fontsize=12, va="center", ha="left")
+            self._title.set_text(title)
+        else:
+            self.show_axis("title", False)
+
+        ax_ob.legend(["Acq tgt", "FT fiber", "SC fiber", "Acq direction"])
+        return None
+
+
+def plot_ob(ob, title = None, fov = None, bg=None, bglim=None, ft_c = None, sc_c = None, acq_only = False, fig = None, geometry = None):
+    """
+    Plot the acquisition and templates of an OB. Return the figure and its gridspec
+    @param fig: the Figure to draw on (e.g. a matplotlib.figure.Figure, for rendering without pyplot). By default,
+    a new pyplot figure is created
+    @param geometry: the ObGeometry of the OB, if already computed
+    """
+    with profiling.span("plot_ob", ob = ob.label):
+        ob_fig = ObFigure(fig)
+        ob_fig.draw(ob, title = title, fov = fov, bg = bg, bglim = bglim, ft_c = ft_c, sc_c = sc_c, acq_only = acq_only, geometry = geometry)
+        return ob_fig.fig, ob_fig.gs
     
 
 
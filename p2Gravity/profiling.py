@@ -0,0 +1,184 @@
+#coding: utf8
+"""Timing of the phases of a run, and of all the calls to external services (P2, Simbad, whereistheplanet, astropy).
+
+The package is instrumented with spans:
+
+    with profiling.span("resolve", ob = ob.label):
+        ...
+    with profiling.span("createOB", "p2"):
+        ...
+
+which do nothing (and cost a single test) unless the profiler is enabled, e.g. with create_obs.py --profile.
+Once enabled, all spans are recorded with their thread, and report prints a summary table (time per phase, per OB,
+and number and time of external calls by endpoint) and writes a json file which can be opened as a Chrome trace
+(chrome://tracing or https://ui.perfetto.dev).
+"""
+
+from . import common
+
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+
+# default file where the profile is written
+DEFAULT_PROFILE_FILE = "p2Gravity_profile.json"
+# functions of other packages which are timed when the profiler is enabled: (module, attribute, category)
+EXTERNAL_FUNCTIONS = [("p2Gravity.resolver", "SkyCoord", "astropy"),
+                      ("p2Gravity.ob.observingBlock", "SkyCoord", "astropy"),
+                      ("p2Gravity.ob.dualWideOb", "SkyCoord", "astropy"),
+                      ("p2Gravity.tpl.acquisitionTemplates", "SkyCoord", "astropy"),
+                      ("p2Gravity.geometry", "SkyCoord", "astropy")]
+
+# returned by span when the profiler is disabled
+NULL_SPAN = contextlib.nullcontext()
+
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._patched = []
+        return None
+
+    def enable(self):
+        """ start recording spans, and time the external functions """
+        self.enabled = True
+        self._start = time.perf_counter()
+        self.instrument_loaded()
+        return None
+
+    def instrument_loaded(self):
+        """
+        Time the external functions in the modules which are loaded. As modules are imported lazily, this should
+        be called again once the modules of interest have been imported
+        """
+        if not(self.enabled):
+            return None
+        patched = [(module.__name__, attribute) for module, attribute, function in self._patched]
+        for module_name, attribute, category in EXTERNAL_FUNCTIONS:
+            if not((module_name, attribute) in patched):
+                self.instrument(module_name, attribute, category)
+        return None
+
+    def disable(self):
+        """ stop recording, and restore the external functions """
+        self.enabled = False
+        for module, attribute, function in self._patched:
+            setattr(module, attribute, function)
+        self._patched = []
+        return None
+
+    def span(self, name, category = "phase", ob = None):
+        """
+        Return a context manager timing its block
+        @param name: name of the phase, or of the endpoint for external calls
+        @param category: 'phase' for the phases of the run, or the name of the external service
+        @param ob: label of the OB processed in this block, if any
+        """
+        if not(self.enabled):
+            return NULL_SPAN
+        return self._span(name, category, ob)
+
+    @contextlib.contextmanager
+    def _span(self, name, category, ob):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, category, start, time.perf_counter() - start, ob)
+
+    def record(self, name, category, start, duration, ob = None):
+        event = dict({"name": name, "cat": category, "start": start - self._start, "duration": duration,
+                      "tid": threading.get_ident(), "ob": ob})
+        with self._lock:
+            self.events.append(event)
+        return None
+
+    def instrument(self, module_name, attribute, category):
+        """ replace module.attribute by a timed version of it, if the module is loaded """
+        module = sys.modules.get(module_name, None)
+        if (module is None) or not(hasattr(module, attribute)):
+            return None
+        function = getattr(module, attribute)
+        def timed(*args, **kwargs):
+            with self.span(attribute, category):
+                return function(*args, **kwargs)
+        setattr(module, attribute, timed)
+        self._patched.append((module, attribute, function))
+        return None
+
+    def summary(self):
+        """
+        Return the profile as a dict with:
+        - phases: count, total and max time of each phase
+        - calls: count, total and max time of the external calls, by category and endpoint
+        - obs: total time of the phases of each OB
+        """
+        phases, calls, obs = dict({}), dict({}), dict({})
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            if event["cat"] == "phase":
+                stats = phases.setdefault(event["name"], dict({"count": 0, "total": 0., "max": 0.}))
+                if not(event["ob"] is None):
+                    obs[event["ob"]] = obs.get(event["ob"], 0.) + event["duration"]
+            else:
+                stats = calls.setdefault(event["cat"], dict({})).setdefault(event["name"], dict({"count": 0, "total": 0., "max": 0.}))
+            stats["count"] = stats["count"] + 1
+            stats["total"] = stats["total"] + event["duration"]
+            stats["max"] = max(stats["max"], event["duration"])
+        return dict({"wall_time": time.perf_counter() - self._start, "phases": phases, "calls": calls, "obs": obs})
+
+    def print_summary(self, max_obs = 10):
+        """ print the summary table of the profile (with the max_obs slowest OBs) """
+        summary = self.summary()
+        common.printinf("Profile of the run ({:.2f}s in total)".format(summary["wall_time"]))
+        print("{:<36} {:>7} {:>10} {:>10} {:>10}".format("phase / call", "count", "total (s)", "mean (s)", "max (s)"))
+        for name in summary["phases"]:
+            stats = summary["phases"][name]
+            print("{:<36} {:>7} {:>10.3f} {:>10.4f} {:>10.4f}".format(name, stats["count"], stats["total"], stats["total"]/stats["count"], stats["max"]))
+        for category in summary["calls"]:
+            for name in summary["calls"][category]:
+                stats = summary["calls"][category][name]
+                print("{:<36} {:>7} {:>10.3f} {:>10.4f} {:>10.4f}".format(category+"."+name, stats["count"], stats["total"], stats["total"]/stats["count"], stats["max"]))
+        slowest = sorted(summary["obs"], key = lambda label: -summary["obs"][label])[0:max_obs]
+        if len(slowest) > 0:
+            print("{:<36} {:>10}".format("slowest OBs", "total (s)"))
+            for label in slowest:
+                print("{:<36} {:>10.3f}".format(label, summary["obs"][label]))
+        return None
+
+    def write(self, filename):
+        """ write the summary and all events in the Chrome trace format """
+        with self._lock:
+            events = list(self.events)
+        pid = os.getpid()
+        trace = [dict({"name": event["name"], "cat": event["cat"], "ph": "X", "pid": pid, "tid": event["tid"],
+                       "ts": event["start"]*1e6, "dur": event["duration"]*1e6,
+                       "args": dict({}) if event["ob"] is None else dict({"ob": event["ob"]})}) for event in events]
+        with open(filename, "w") as f:
+            json.dump(dict({"traceEvents": trace, "summary": self.summary()}), f, default = str)
+        return None
+
+    def report(self, filename = None):
+        """ print the summary and write the trace, if the profiler is enabled """
+        if not(self.enabled):
+            return None
+        self.print_summary()
+        if not(filename is None):
+            self.write(filename)
+            common.printinf("Profile written to {}".format(filename))
+        return None
+
+
+# the profiler used by the whole package
+PROFILER = Profiler()
+
+def span(name, category = "phase", ob = None):
+    """ see Profiler.span """
+    return PROFILER.span(name, category = category, ob = ob)
@@ -0,0 +1,267 @@
+#coding: utf8
+"""Headless rendering of the previews of the OBs.
+
+The preview of each OB (the same figure as in the review GUI, see plot.plot_ob) is drawn on a matplotlib Figure with
+the Agg canvas, without pyplot, in a pool of processes, and written as one PNG per OB. A multi-page PDF with the
+previews of all OBs (in the order of the yml) is then assembled from these images:
+
+    create_obs.py obs.yml --render previews/
+
+Nothing is sent to P2 in this mode.
+
+An overview of all the OBs can also be drawn on a single page (render_overview), with a small thumbnail of the
+acquisition and of the positions of the fibers of each OB, its label, mode and total exposure time:
+
+    create_obs.py "P112/*.yml" --overview overview.pdf
+
+The thumbnails of all OBs are drawn on one axis, with a few collections of patches and lines for all of them, so
+that hundreds of OBs are drawn at once.
+"""
+
+from . import common
+from . import profiling
+
+import os
+import re
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+# size (in inches) and resolution of the previews, and name of the multi-page PDF
+FIGSIZE = (12, 7)
+DEFAULT_DPI = 100
+DEFAULT_PDF = "obs.pdf"
+# number of columns of the overview, and size (in inches) of each of its cells
+OVERVIEW_NCOLS = 8
+OVERVIEW_CELL = 1.6
+# height of the cells of the overview (the thumbnail is 1x1, with the description below it)
+OVERVIEW_HEIGHT = 1.25
+# half size of the thumbnails, in the cells
+THUMBNAIL_SIZE = 0.45
+
+
+def _init_worker():
+    """ the workers never open a window """
+    import matplotlib
+    matplotlib.use("Agg")
+    return None
+
+
+def preview_filename(k, label):
+    """ the name of the file of the k-th OB, which keeps the files in the order of the OBs """
+    return "{:03d}_{}.png".format(k+1, re.sub(r"[^\w.+-]", "_", label))
+
+
+def render_ob(ob, filename, dpi = DEFAULT_DPI, **kwargs):
+    """
+    Render the preview of an OB to a file, with the Agg canvas
+    @param ob: a resolved ObservingBlock
+    @param filename: the image file to write
+    @param kwargs: other arguments of plot.plot_ob (title, fov, bg, bglim, ft_c, sc_c, acq_only)
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from . import plot
+    fig = Figure(figsize = FIGSIZE, tight_layout = True)
+    FigureCanvasAgg(fig)
+    plot.plot_ob(ob, fig = fig, **kwargs)
+    fig.savefig(filename, dpi = dpi)
+    return None
+
+
+def _render(task):
+    """ render one OB in a worker, and return (filename, error) """
+    ob, filename, dpi, kwargs = task
+    try:
+        render_ob(ob, filename, dpi = dpi, **kwargs)
+    except (Exception, SystemExit) as e:
+        return filename, "{}: {}".format(type(e).__name__, e)
+    return filename, None
+
+
+def write_pdf(images, filename):
+    """
+    Write a multi-page PDF with one image per page
+    @param images: list of paths to the images
+    @param filename: the PDF file to write
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_pdf import PdfPages
+    import matplotlib.image as mpimg
+    with PdfPages(filename) as pdf:
+        for image in images:
+            img = mpimg.imread(image)
+            fig = Figure(figsize = FIGSIZE)
+            ax = fig.add_axes([0, 0, 1, 1])
+            ax.axis("off")
+            ax.imshow(img)
+            pdf.savefig(fig)
+    return None
+
+
+def render_obs(obs, directory, jobs = None, dpi = DEFAULT_DPI, pdf = DEFAULT_PDF, **kwargs):
+    """
+    Render the previews of OBs in a directory, as one PNG per OB and a multi-page PDF.
+    Return the list of results (one dict per OB, with label, file and error, in the order of the OBs)
+    @param obs: an iterable of resolved ObservingBlocks
+    @param directory: directory where the files are written (created if required)
+    @param jobs: number of processes. Default to the number of cpus
+    @param pdf: name of the multi-page PDF in directory, or None to skip it
+    @param kwargs: other arguments of plot.plot_ob (fov, bg, bglim, ft_c, sc_c, acq_only). The title of each OB
+    is given by plot.ob_title
+    """
+    from . import plot
+    if not(os.path.isdir(directory)):
+        os.makedirs(directory)
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    obs = list(obs)
+    tasks = []
+    for k in range(len(obs)):
+        ob_kwargs = dict(kwargs, title = plot.ob_title(obs[k]))
+        tasks.append((obs[k], os.path.join(directory, preview_filename(k, obs[k].label)), dpi, ob_kwargs))
+    with profiling.span("render"):
+        if (jobs > 1) and (len(tasks) > 1):
+            with ProcessPoolExecutor(max_workers = min(jobs, len(tasks)), initializer = _init_worker) as executor:
+                rendered = list(executor.map(_render, tasks))
+        else:
+            rendered = [_render(task) for task in tasks]
+    results = []
+    for ob, (filename, error) in zip(obs, rendered):
+        results.append(dict({"label": ob.label, "file": filename, "success": error is None, "error": error}))
+        if not(error is None):
+            common.printwar("Preview of OB '{}' could not be rendered ({})".format(ob.label, error))
+    if not(pdf is None):
+        with profiling.span("render_pdf"):
+            write_pdf([result["file"] for result in results if result["success"]], os.path.join(directory, pdf))
+    return results
+
+
+def print_report(results, directory, pdf = DEFAULT_PDF):
+    """ print a summary of the results returned by render_obs """
+    failed = [r for r in results if not(r["success"])]
+    common.printinf("{} OB preview(s) rendered in {}, {} failed".format(len(results) - len(failed), directory, len(failed)))
+    if not(pdf is None):
+        common.printinf("All previews are in {}".format(os.path.join(directory, pdf)))
+    return None
+
+
+def thumbnail(geometry, fov):
+    """
+    Return the elements of the thumbnail of an OB, in the coordinates of its preview (see plot.plot_acquisition and
+    plot.plot_template): a dict of lists of positions (stars, ft_points, sc_points, ft_circles, sc_circles), and
+    of segments (lines). The positions out of the field of view are not kept
+    @param geometry: the ObGeometry of the OB
+    @param fov: half size of the field of view
+    """
+    ob = geometry.ob
+    elements = dict({"stars": [(0, 0)], "ft_points": [], "sc_points": [], "ft_circles": [], "sc_circles": [], "lines": []})
+    direction = geometry.acq_direction()
+    if geometry.wide:
+        elements["ft_points"].append(geometry.ft)
+        elements["sc_points"].append(geometry.sc)
+        # the line goes through the SC fiber for on-axis, and the acquisition target otherwise
+        center = geometry.sc if ob.ob_type == "DualWideOnOb" else (0, 0)
+        for tpl_geometry in geometry.templates:
+            swap = tpl_geometry["swap"]
+            elements["ft_points"].append((swap*geometry.ft[0], swap*geometry.ft[1]))
+            if (ob.ob_type == "DualWideOnOb") and ("reloff" in tpl_geometry):
+                dx, dy = tpl_geometry["reloff"]
+                elements["sc_points"] = elements["sc_points"] + list(zip(swap*geometry.sc[0] + dx/1000.0, swap*geometry.sc[1] + dy/1000.0))
+            else:
+                elements["sc_points"].append((swap*geometry.sc[0], swap*geometry.sc[1]))
+    else:
+        elements["ft_circles"].append((0, 0))
+        center = (0, 0)
+        if ob.acquisition.template_name in ["GRAVITY_single_onaxis_acq", "GRAVITY_single_offaxis_acq"]:
+            elements["sc_circles"].append((0, 0))
+        elif not(direction is None):
+            elements["sc_circles"].append(direction)
+        for tpl_geometry in geometry.templates:
+            if "positions" in tpl_geometry:
+                x, y, pa, sep = tpl_geometry["positions"]
+                elements["sc_circles"] = elements["sc_circles"] + list(zip(x, y))
+    if not(direction is None):
+        norm = math.sqrt(direction[0]**2 + direction[1]**2)
+        if norm > 0:
+            x, y = fov*direction[0]/norm, fov*direction[1]/norm
+            elements["lines"].append(((center[0]-x, center[1]-y), (center[0]+x, center[1]+y)))
+    # each position is only drawn once, and only if it is in the field of view
+    for key in ["stars", "ft_points", "sc_points", "ft_circles", "sc_circles"]:
+        positions = [(round(float(x), 6), round(float(y), 6)) for x, y in elements[key]]
+        elements[key] = [p for p in dict.fromkeys(positions) if (abs(p[0]) <= fov) and (abs(p[1]) <= fov)]
+    return elements
+
+
+def overview_text(ob, geometry):
+    """ the description of an OB in the overview: its label, mode and total exposure time """
+    exptime, exptime_sky = geometry.total_exptime()
+    return "{}\n{}\n{:.0f} s (sky {:.0f} s)".format(ob.label, ob.ob_type, exptime, exptime_sky)
+
+
+def render_overview(obs, filename, ncols = OVERVIEW_NCOLS, fov = None, ft_c = None, sc_c = None, dpi = DEFAULT_DPI):
+    """
+    Render the overview of OBs on a single page: a thumbnail of each OB, in the order of the OBs.
+    Return the list of results (one dict per OB, with label, file and error, in the order of the OBs)
+    @param obs: an iterable of resolved ObservingBlocks
+    @param filename: the file to write (png, pdf, etc., from its extension)
+    @param ncols: number of thumbnails per row
+    @param fov: half size of the field of view of the thumbnails. Default to 10 fiber fov, as in the previews
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import PatchCollection, LineCollection
+    import matplotlib.patches as patches
+    from . import plot
+    from . import geometry as ob_geometry
+    if ft_c is None:
+        ft_c = plot.FT_C
+    if sc_c is None:
+        sc_c = plot.SC_C
+    obs = list(obs)
+    results = []
+    # all the elements of all thumbnails, in the coordinates of the page
+    stars, ft_points, sc_points, circles, circle_colors, lines, frames, texts = [], [], [], [], [], [], [], []
+    with profiling.span("overview"):
+        for k in range(len(obs)):
+            ob = obs[k]
+            try:
+                geometry = ob_geometry.ObGeometry(ob)
+                ob_fov = 10*geometry.fiber_fov if fov is None else fov
+                elements = thumbnail(geometry, ob_fov)
+            except (Exception, SystemExit) as e:
+                error = "{}: {}".format(type(e).__name__, e)
+                results.append(dict({"label": ob.label, "file": filename, "success": False, "error": error}))
+                common.printwar("OB '{}' could not be drawn in the overview ({})".format(ob.label, error))
+                continue
+            results.append(dict({"label": ob.label, "file": filename, "success": True, "error": None}))
+            # the center of the thumbnail, and the scale from the preview coordinates (RA increases to the left)
+            row, col = k//ncols, k%ncols
+            cx, cy = col + 0.5, -row*OVERVIEW_HEIGHT - 0.5
+            scale = THUMBNAIL_SIZE/ob_fov
+            page = lambda p: (cx - p[0]*scale, cy + p[1]*scale)
+            stars = stars + [page(p) for p in elements["stars"]]
+            ft_points = ft_points + [page(p) for p in elements["ft_points"]]
+            sc_points = sc_points + [page(p) for p in elements["sc_points"]]
+            for key, color in [("ft_circles", ft_c), ("sc_circles", sc_c)]:
+                circles = circles + [patches.Circle(page(p), geometry.fiber_fov*scale) for p in elements[key]]
+                circle_colors = circle_colors + [color]*len(elements[key])
+            lines = lines + [(page(p0), page(p1)) for p0, p1 in elements["lines"]]
+            frames.append(patches.Rectangle((cx - THUMBNAIL_SIZE, cy - THUMBNAIL_SIZE), 2*THUMBNAIL_SIZE, 2*THUMBNAIL_SIZE))
+            texts.append((cx, cy - THUMBNAIL_SIZE - 0.02, overview_text(ob, geometry)))
+        nrows = max(1, math.ceil(len(obs)/ncols))
+        fig = Figure(figsize = (ncols*OVERVIEW_CELL, nrows*OVERVIEW_HEIGHT*OVERVIEW_CELL))
+        FigureCanvasAgg(fig)
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.axis("off")
+        ax.set_xlim(0, ncols)
+        ax.set_ylim(-nrows*OVERVIEW_HEIGHT, 0)
+        ax.add_collection(PatchCollection(frames, facecolor = "none", edgecolor = "0.8", linewidth = 0.5))
+        ax.add_collection(LineCollection(lines, colors = "k", alpha = 0.2, linewidth = 0.5))
+        ax.add_collection(PatchCollection(circles, facecolor = "none", edgecolor = circle_colors, linewidth = 0.5))
+        for points, color, marker in [(ft_points, ft_c, "o"), (sc_points, sc_c, "o"), (stars, "k", "*")]:
+            if len(points) > 0:
+                ax.scatter([p[0] for p in points], [p[1] for p in points], s = 4, color = color, marker = marker, linewidths = 0)
+        for x, y, txt in texts:
+            ax.text(x, y, txt, fontsize = 5, va = "top", ha = "center")
+        fig.savefig(filename, dpi = dpi)
+    return results
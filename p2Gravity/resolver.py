@@ -0,0 +1,297 @@
+#coding: utf8
+"""Resolve targets and guide stars on Simbad.
+
+A SimbadResolver keeps the table of each name it has already resolved, so that a star is only queried once
+per run. All the names used in a YML can be resolved beforehand in a single bulk query using resolve_all.
+If a TargetCache is given, the resolver first looks for the names in this persistent cache, and stores there
+everything it resolves on Simbad.
+"""
+
+from . import common
+from . import profiling
+
+import numpy as np
+
+from astropy import units as u
+from astropy.table import Column
+from astropy.coordinates import SkyCoord
+
+# going for 0.4.7 to 0.4.8 has changed case in some astroquery fields. We need to take care of it.
+ASTROQUERY_TRANSLATION = dict({"RA": "ra",
+                               "DEC": "dec",
+                               "PMRA": "pmra",
+                               "PMDEC": "pmdec",
+                               "PLX": "plx",
+                               "FLUX_G": "G",
+                               "FLUX_H": "H",
+                               "FLUX_K": "K",
+                               "FLUX_R": "R"})
+
+# votable fields to get the magnitudes, proper motion, and plx required in acq template
+VOTABLE_FIELDS = ['flux(G)', 'flux(K)', 'flux(H)', 'flux(R)', 'pmdec', 'pmra', 'plx']
+
+# what to do when Simbad returns several objects for a name (defined in common, which is light to import)
+AMBIGUITY_POLICIES = common.AMBIGUITY_POLICIES
+
+# keys of an OB yml which contain names to resolve on Simbad
+TARGET_KEYS = ["target", "sc_target", "ft_target", "guide_star"]
+# special values of guide_star which are not names
+GUIDE_STAR_KEYWORDS = ["science", "ft"]
+# columns used by the OB and acquisition templates, and their units in the records
+RECORD_UNITS = dict({"ra": u.deg,
+                     "dec": u.deg,
+                     "pmra": u.mas/u.yr,
+                     "pmdec": u.mas/u.yr,
+                     "plx_value": u.mas,
+                     "G": None,
+                     "H": None,
+                     "K": None,
+                     "R": None})
+
+
+# astroquery Simbad, once configured, and whether astroquery is older than 0.4.8
+_SIMBAD = None
+_ASTROQUERY_OLD = None
+
+def get_simbad():
+    """
+    Import astroquery and add the votable fields we need to Simbad. This is only done the first time
+    a target is actually queried, as both the import and the registration of the fields are slow
+    """
+    global _SIMBAD, _ASTROQUERY_OLD
+    if _SIMBAD is None:
+        # we need astroquery to get magnitudes, coordinates, etc.
+        import astroquery
+        from astroquery.simbad import Simbad
+        from packaging.version import Version
+        _ASTROQUERY_OLD = Version(astroquery.__version__) < Version("0.4.8")
+        for field in VOTABLE_FIELDS:
+            Simbad.add_votable_fields(field)
+        _SIMBAD = Simbad
+    return _SIMBAD
+
+
+def translate_table(table):
+    """ to ensure compatibility with all versions of astroquery """
+    table_d = dict(table)
+    if _ASTROQUERY_OLD:
+        table_translated = dict({})
+        for key in table_d:
+            if key in ASTROQUERY_TRANSLATION:
+                table_translated[ASTROQUERY_TRANSLATION[key]] = table_d[key]
+            else:
+                table_translated[key] = table_d[key]
+    else:
+        table_translated = table_d
+    return table_translated
+
+
+def record_from_table(table):
+    """
+    Convert a (translated) Simbad table of a single object to a record, i.e. a dict of plain floats
+    in the units of RECORD_UNITS. Missing values are not included in the record.
+    """
+    record = dict({})
+    if ("ra" in table) and isinstance(table["ra"][0], str):
+        # old versions of astroquery give sexagesimal coordinates
+        coord = SkyCoord(table["ra"][0], table["dec"][0], unit = (u.hourangle, u.deg))
+        record["ra"], record["dec"] = float(coord.ra.deg), float(coord.dec.deg)
+    for key in RECORD_UNITS:
+        if (key in record) or not(key in table):
+            continue
+        value = table[key][0]
+        if np.ma.is_masked(value):
+            continue
+        unit = RECORD_UNITS[key]
+        if not(unit is None) and not(getattr(table[key], "unit", None) is None):
+            value = (value*table[key].unit).to(unit).value
+        value = float(value)
+        if np.isnan(value):
+            continue
+        record[key] = value
+    return record
+
+
+def table_from_record(record):
+    """
+    Convert a record back to a table which can be used as a Simbad table by the OB and acquisition templates
+    """
+    table = dict({})
+    for key in record:
+        table[key] = Column([record[key]], name = key, unit = RECORD_UNITS.get(key, None))
+    return table
+
+
+def collect_ob_names(ob):
+    """
+    Return the list of names (target, sc_target, ft_target and guide_star) of a single OB which need
+    to be resolved on Simbad
+    @param ob: dict containing all the info loaded from the YML of this OB
+    """
+    names = []
+    for key in TARGET_KEYS:
+        if not(key in ob):
+            continue
+        if ob[key] is None:
+            continue
+        name = str(ob[key])
+        if (key == "guide_star") and (name.lower() in GUIDE_STAR_KEYWORDS):
+            continue
+        if not(name in names):
+            names.append(name)
+    return names
+
+
+def collect_names(cfg):
+    """
+    Walk through all the ObservingBlocks of a yml config and return the list of unique names
+    which need to be resolved on Simbad
+    @param cfg: dict containing the full yml configuration
+    """
+    names = []
+    for ob_name in cfg["ObservingBlocks"]:
+        for name in collect_ob_names(cfg["ObservingBlocks"][ob_name]):
+            if not(name in names):
+                names.append(name)
+    return names
+
+
+class SimbadResolver(object):
+    def __init__(self, cache = None, offline = False, refresh = False, ambiguity = "ask"):
+        """
+        Container for all the Simbad tables resolved during a run, indexed by the name given in the yml
+        @param cache: a TargetCache to look for names before querying Simbad. None to always query Simbad
+        @param offline: if True, Simbad is never queried, and any name missing from the cache is an error
+        @param refresh: if True, the entries already in the cache are ignored, and updated from Simbad
+        @param ambiguity: policy used when Simbad returns several objects for a name (see AMBIGUITY_POLICIES)
+        """
+        if not(ambiguity in AMBIGUITY_POLICIES):
+            common.printerr("Unknown ambiguity policy '{}'. Must be one of {}".format(ambiguity, AMBIGUITY_POLICIES))
+        self.tables = dict({})
+        self.cache = cache
+        self.offline = offline
+        self.refresh = refresh
+        self.ambiguity = ambiguity
+        return None
+
+    def _from_cache(self, name):
+        """ load the table of name from the persistent cache if possible. Return True if found """
+        if (self.cache is None) or self.refresh:
+            return False
+        record = self.cache.get(name)
+        if record is None:
+            return False
+        self.tables[name] = table_from_record(record)
+        return True
+
+    def _store(self, name, table):
+        """ store a (translated) table resolved on Simbad """
+        record = record_from_table(table)
+        if not(self.cache is None):
+            self.cache.put(name, record)
+        self.tables[name] = table_from_record(record)
+        return None
+
+    def resolve_all(self, names):
+        """
+        Resolve all the given names at once, using a single bulk query to Simbad.
+        Names which cannot be unambiguously matched to one row of the result are left aside, and will be
+        resolved one by one (with the usual warnings and questions) when get_table is called.
+        @param names: list of names to resolve
+        """
+        names = [name for name in names if not(name in self.tables)]
+        names = [name for name in names if not(self._from_cache(name))]
+        if len(names) == 0:
+            return None
+        if self.offline:
+            common.printerr("Targets {} not found in the target cache, and cannot be resolved on Simbad in offline mode".format(names))
+        common.printinf("Resolving {} targets on Simbad".format(len(names)))
+        with profiling.span("query_objects", "simbad"):
+            table = get_simbad().query_objects(names)
+        if table is None:
+            common.printwar("Bulk resolution on Simbad failed. Targets will be resolved one by one.")
+            return None
+        # find the name used in the query for each row of the result
+        if "user_specified_id" in table.colnames:
+            row_names = [str(name) for name in table["user_specified_id"]]
+        elif "SCRIPT_NUMBER_ID" in table.colnames:
+            row_names = [names[int(k)-1] for k in table["SCRIPT_NUMBER_ID"]]
+        else:
+            common.printwar("Cannot match the bulk resolution from Simbad to the targets. Targets will be resolved one by one.")
+            return None
+        table_translated = translate_table(table)
+        for name in names:
+            rows = [k for k in range(len(row_names)) if row_names[k] == name]
+            if len(rows) != 1:
+                continue
+            # unknown objects are returned as empty rows
+            if np.ma.is_masked(table_translated["ra"][rows[0]]):
+                continue
+            self._store(name, translate_table(table[rows]))
+        common.printinf("{} of {} targets resolved on Simbad".format(len([name for name in names if name in self.tables]), len(names)))
+        return None
+
+    def get_table(self, name):
+        """
+        Return the Simbad table of the given name, querying Simbad if it was not already resolved
+        @param name: the name of the object to resolve
+        """
+        if name in self.tables:
+            return self.tables[name]
+        if self._from_cache(name):
+            return self.tables[name]
+        if self.offline:
+            common.printerr("Target {} not found in the target cache, and cannot be resolved on Simbad in offline mode".format(name))
+        self._store(name, self._query_object(name))
+        return self.tables[name]
+
+    def _query_object(self, name):
+        common.printinf("Resolving target {} on Simbad".format(name))
+        with profiling.span("query_object", "simbad"):
+            table = get_simbad().query_object(name)
+        if table is None:
+            raise ValueError('Input not known by Simbad')
+        common.printinf("Simbad resolution of {}: \n {}".format(name, table))
+        if (len(table) > 1) and (self.ambiguity != "ask"):
+            table = table[[self._choose_row(name, translate_table(table))]]
+        if len(table) > 1:
+            success = False
+            common.printwar("There are multiple results from Simbad. Which one should I use? (1, 2, etc.?)")
+            inp = input(">>")
+            while not(success):
+                try:
+                    inp = int(inp)
+                except:
+                    common.printwar("Please enter an integer value.")
+                    inp = input(">>")
+                    continue
+                if (inp>=1) and (inp<=len(table)):
+                    table = table[[inp-1]]
+                    success = True
+                else:
+                    common.printwar("Please enter an integer between 1 and {}".format(len(table)))
+                    inp = input(">>")
+        return translate_table(table)
+
+    def _choose_row(self, name, table):
+        """ return the index of the row to use in an ambiguous (translated) table, following the ambiguity policy """
+        if self.ambiguity == "fail":
+            common.printerr("There are {} results from Simbad for {}. Please use a more specific name".format(len(table["ra"]), name))
+        if (self.ambiguity == "brightest") and ("K" in table):
+            mags = np.ma.filled(np.ma.masked_invalid(np.ma.array(table["K"], dtype = float)), np.inf)
+            if np.any(np.isfinite(mags)):
+                row = int(np.argmin(mags))
+                common.printwar("There are multiple results from Simbad for {}. Using the brightest in K (row {})".format(name, row+1))
+                return row
+        common.printwar("There are multiple results from Simbad for {}. Using the first one".format(name))
+        return 0
+
+
+# the resolver used by OBs which are not given one explicitly
+DEFAULT_RESOLVER = None
+
+def get_default_resolver():
+    global DEFAULT_RESOLVER
+    if DEFAULT_RESOLVER is None:
+        DEFAULT_RESOLVER = SimbadResolver()
+    return DEFAULT_RESOLVER
@@ -0,0 +1,206 @@
+#coding: utf8
+"""Review of the OBs in the GUI before they are sent to P2.
+
+The OBs are shown one by one, and the user decides for each of them to send it to P2 or not. To keep the review
+limited by the reading speed of the user rather than by the network:
+- the next OBs are resolved on Simbad and their geometry computed (see geometry.ObGeometry)
+  in a background thread while the current one is shown (lookahead OBs are kept ready). If the user may be asked
+  which Simbad result to use, the OBs must be resolved beforehand (e.g. given as a list), so that the questions are
+  not asked from this thread,
+- "Send to P2" only queues the OB in an UploadPool, whose workers upload it in the background, and the next OB is
+  shown at once. The status of the uploads is shown at the bottom of the figure, and updated while it is open,
+- the same window is used for all the OBs: only the artists of the figure are drawn again for each OB, and the
+  background image (--bg) is only read once.
+The figures themselves are drawn in the main thread, as required by matplotlib.
+"""
+
+from . import common
+from . import pipeline
+from . import profiling
+from . import geometry as ob_geometry
+
+import threading
+
+# number of OBs prepared in advance while the user reviews the current one
+DEFAULT_LOOKAHEAD = 3
+# interval (in ms) between two updates of the upload status
+STATUS_INTERVAL = 500
+
+
+class UploadStatus(object):
+    """ the uploads queued during the review, and their state """
+    def __init__(self):
+        self.uploads = []
+        self._lock = threading.Lock()
+        return None
+
+    def add(self, label, future):
+        """
+        @param label: label of the OB
+        @param future: the Future returned by UploadPool.submit
+        """
+        with self._lock:
+            self.uploads.append((label, future))
+        return None
+
+    def counts(self):
+        """ return the number of uploads pending, done and failed """
+        with self._lock:
+            futures = [future for label, future in self.uploads]
+        pending = len([future for future in futures if not(future.done())])
+        failed = len([future for future in futures if future.done() and not(future.result()["success"])])
+        return pending, len(futures) - pending - failed, failed
+
+    def text(self):
+        pending, done, failed = self.counts()
+        if pending + done + failed == 0:
+            return "No OB sent to P2 yet"
+        txt = "Uploads to P2: {} pending, {} done".format(pending, done)
+        if failed > 0:
+            txt = txt + ", {} FAILED".format(failed)
+        return txt
+
+
+def prepare_obs(obs):
+    """ compute the geometry of each OB (run in the background with the resolution) """
+    for ob in obs:
+        yield ob, ob_geometry.ObGeometry(ob)
+    return None
+
+
+class ReviewFigure(object):
+    """
+    The review window, kept open for all the OBs: its axes and buttons are created once, and each OB is drawn in
+    place of the previous one (see plot.ObFigure). The status of the uploads is updated with blitting, so that only
+    this text is drawn again while the user reviews an OB
+    """
+    def __init__(self, status):
+        """
+        @param status: the UploadStatus shown at the bottom of the figure
+        """
+        import matplotlib.pyplot as plt
+        from . import plot
+        self.status = status
+        self.ob_fig = plot.ObFigure(plt.figure(figsize=(12, 7)))
+        self.fig = self.ob_fig.fig
+        self.canvas = self.fig.canvas
+        self.decision = None
+        self.closed = False
+        self.shown = False
+        self._buttons = None
+        self._blit_background = None
+        self._layout = None
+        # status of the uploads running in the background (drawn with blitting, not by the full draws)
+        self.status_text = self.fig.text(0.99, 0.01, status.text(), fontsize=8, va="bottom", ha="right", animated=True)
+        self.canvas.mpl_connect("draw_event", self._on_draw)
+        self.canvas.mpl_connect("close_event", self._on_close)
+        self.timer = self.canvas.new_timer(interval = STATUS_INTERVAL)
+        self.timer.add_callback(self.update_status)
+        return None
+
+    def _add_buttons(self):
+        from matplotlib.widgets import Button
+        axConfirm = self.fig.add_subplot(self.ob_fig.gs[0, 4])
+        axCancel = self.fig.add_subplot(self.ob_fig.gs[0, 5])
+        bConfirm = Button(axConfirm, 'Send to P2', color="C2")
+        bCancel = Button(axCancel, 'Cancel', color="C3")
+        bConfirm.on_clicked(lambda event: self._decide(True))
+        bCancel.on_clicked(lambda event: self._decide(False))
+        self._buttons = (bConfirm, bCancel)
+        return None
+
+    def _decide(self, send):
+        self.decision = send
+        self.canvas.stop_event_loop()
+        return None
+
+    def _on_close(self, event):
+        self.closed = True
+        self.timer.stop()
+        self.canvas.stop_event_loop()
+        return None
+
+    def _on_draw(self, event):
+        """ keep the figure without the status, and draw the status on top of it """
+        self._blit_background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.fig.draw_artist(self.status_text)
+        return None
+
+    def update_status(self):
+        self.status_text.set_text(self.status.text())
+        if self._blit_background is None:
+            self.canvas.draw_idle()
+            return None
+        self.canvas.restore_region(self._blit_background)
+        self.fig.draw_artist(self.status_text)
+        self.canvas.blit(self.fig.bbox)
+        return None
+
+    def review(self, ob, geometry, **kwargs):
+        """
+        Show an OB, and wait for the user to send it to P2 or not. Return True if the user chose to send it (False
+        if cancelled or if the window was closed)
+        @param kwargs: other arguments of plot.ObFigure.draw (fov, bg, bglim, ft_c, sc_c, acq_only)
+        """
+        import matplotlib.pyplot as plt
+        from . import plot
+        with profiling.span("plot_ob", ob = ob.label):
+            self.ob_fig.draw(ob, title = plot.ob_title(ob), geometry = geometry, **kwargs)
+            # the buttons are moved with the grid, which only changes with the number of rows of templates
+            if self._buttons is None:
+                self._add_buttons()
+            else:
+                self._buttons[0].ax.set_subplotspec(self.ob_fig.gs[0, 4])
+                self._buttons[1].ax.set_subplotspec(self.ob_fig.gs[0, 5])
+            # the layout is only computed again if the grid, the visible panels or the field of view changed
+            ax_ob = self.ob_fig.axes["ob"]
+            layout = (self.ob_fig.nrows, ax_ob.get_xlim(), ax_ob.get_ylim(), tuple([key for key in self.ob_fig.axes if self.ob_fig.axes[key].get_visible()]))
+            if not(layout == self._layout):
+                self.fig.tight_layout()
+                self._layout = layout
+        self.status_text.set_text(self.status.text())
+        self._blit_background = None
+        self.decision = None
+        if getattr(self.canvas, "required_interactive_framework", None) is None:
+            # no window to wait for (e.g. Agg backend)
+            plt.show()
+            return False
+        if not(self.shown):
+            plt.show(block = False)
+            self.timer.start()
+            self.shown = True
+        self.canvas.draw_idle()
+        # wait for the user to confirm sending or cancel (or to close the window)
+        self.canvas.start_event_loop(timeout = 0)
+        return self.decision is True
+
+
+def review_obs(obs, upload_pool, container_of, lookahead = DEFAULT_LOOKAHEAD, **kwargs):
+    """
+    Review the OBs one by one, and queue the ones accepted by the user in the upload pool.
+    Return the list of upload results, once all uploads are done
+    @param obs: an iterable of ObservingBlocks, consumed in the background. It must not ask anything to the user
+    @param upload_pool: the UploadPool which uploads the OBs. It should have more than one job, so that uploads
+    do not block the review
+    @param container_of: function returning the id of the container of an OB
+    @param lookahead: number of OBs prepared in advance
+    @param kwargs: other arguments of plot.ObFigure.draw (fov, bg, bglim, ft_c, sc_c, acq_only)
+    """
+    status = UploadStatus()
+    review_fig = None
+    for ob, geometry in pipeline.prefetch(prepare_obs(obs), size = lookahead):
+        # if the user closed the window, the next OB is shown in a new one
+        if (review_fig is None) or review_fig.closed:
+            review_fig = ReviewFigure(status)
+        if review_fig.review(ob, geometry, **kwargs):
+            common.printinf("OB {} queued for upload to run {}".format(ob.label, ob.setup["run_id"]))
+            status.add(ob.label, upload_pool.submit(ob, container_of(ob)))
+        else:
+            common.printwar("OB {} was not sent to P2".format(ob.label))
+    if not(review_fig is None) and not(review_fig.closed):
+        import matplotlib.pyplot as plt
+        plt.close(review_fig.fig)
+    pending, done, failed = status.counts()
+    if pending > 0:
+        common.printinf("Waiting for the last {} upload(s)".format(pending))
+    return upload_pool.wait()
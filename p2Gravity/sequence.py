@@ -0,0 +1,169 @@
+#coding: utf8
+"""Compilation of the exposure sequences of an OB.
+
+The 'sequence' of an OB in the yml is a list of lines such as "sky sA sA swap sB sB sky". All the lines of an OB are
+compiled at once into Sequences (one per template), where each exposure is coded as an integer: the index of the
+object in the 'objects' of the OB, or SKY_CODE / SWAP_CODE. The consistency checks (unknown objects, DIT and NDIT of
+the objects of a same template) are done once, at compilation, and the relative offsets (SEQ.RELOFF) of the dual
+templates are computed from the absolute offsets of the objects with vectorized differences.
+"""
+
+from . import common
+from . import planets
+
+import numpy as np
+
+SKY = "sky"
+SWAP = "swap"
+SKY_CODE = -1
+SWAP_CODE = -2
+# parameters which must be the same for all the objects of a dual template
+CONSISTENT_KEYS = ["DET2.DIT", "DET2.NDIT.SKY", "DET2.NDIT.OBJECT"]
+
+
+class Sequence(object):
+    def __init__(self, labels, codes, object_labels):
+        """
+        @param labels: the labels of the exposures, as given in the yml (e.g. ["sky", "sA", "sA"])
+        @param codes: integer array of the exposures (index of the object, SKY_CODE or SWAP_CODE)
+        @param object_labels: the labels of all the objects of the OB, in the order used by codes
+        """
+        self.labels = labels
+        self.codes = codes
+        self.object_labels = object_labels
+        return None
+
+    def is_swap(self):
+        return (len(self.codes) == 1) and (self.codes[0] == SWAP_CODE)
+
+    def has_sky(self):
+        return bool(np.any(self.codes == SKY_CODE))
+
+    def object_codes(self):
+        """ the codes of the objects of this sequence, ordered by their last exposure """
+        codes = self.codes[self.codes >= 0]
+        last = dict({})
+        for k in range(len(codes)):
+            last[codes[k]] = k
+        return sorted(last, key = lambda code: last[code])
+
+    def objects(self):
+        """ the labels of the objects of this sequence, ordered by their last exposure """
+        return [self.object_labels[code] for code in self.object_codes()]
+
+    def eso(self):
+        """ the sequence in the ESO format (SEQ.OBSSEQ), e.g. "S O O" """
+        return " ".join(np.where(self.codes == SKY_CODE, "S", "O"))
+
+    def relative_offsets(self, x, y):
+        """
+        Return the lists of relative offsets (SEQ.RELOFF.X and Y) of the exposures, rounded to 0.01 mas. The offsets
+        of the objects are cumulative, and the sky exposures have no offset (SEQ.SKY is used instead).
+        @param x, y: arrays of the absolute offsets of the objects (mas), indexed by code
+        """
+        is_object = self.codes >= 0
+        codes = self.codes[is_object]
+        dx, dy = np.zeros(len(self.codes)), np.zeros(len(self.codes))
+        dx[is_object] = np.round(np.diff(np.round(x[codes], 2), prepend = 0.), 2)
+        dy[is_object] = np.round(np.diff(np.round(y[codes], 2), prepend = 0.), 2)
+        return dx.tolist(), dy.tolist()
+
+
+def object_offset(obj_yml, date = None):
+    """
+    Return the absolute offset (ra, dec) in mas of an object from its coord_syst, or (0, 0) if no coord_syst is given
+    @param obj_yml: dict containing the yml of the object
+    @param date: date used if the coord_syst is whereistheplanet
+    """
+    if not("coord_syst" in obj_yml):
+        return 0., 0.
+    if obj_yml["coord_syst"] == "radec":
+        return obj_yml["coord"][0], obj_yml["coord"][1]
+    elif obj_yml["coord_syst"] == "pasep":
+        pa, sep = obj_yml["coord"]
+        return np.sin(np.deg2rad(pa))*sep, np.cos(np.deg2rad(pa))*sep
+    elif obj_yml["coord_syst"] == "whereistheplanet":
+        if date is None:
+            raise Exception("Date not given for Resolution of {} with whereistheplanet:".format(obj_yml["coord"]))
+        ra, dec, sep, pa = planets.predict_planet(obj_yml["coord"], date)
+        return ra[0], dec[0]
+    common.printerr("Unknown coordinate system {}".format(obj_yml["coord_syst"]))
+
+
+def object_offsets(objects, sequences, date = None):
+    """
+    Return the arrays x and y of the absolute offsets of the objects of an OB, indexed by code. Only the objects
+    which are used in the sequences are computed (others are nan)
+    @param objects: dict of the object ymls of the OB
+    @param sequences: the compiled Sequences of the OB
+    """
+    object_labels = list(objects)
+    x, y = np.full(len(object_labels), np.nan), np.full(len(object_labels), np.nan)
+    used = []
+    for seq in sequences:
+        used = used + [code for code in seq.object_codes() if not(code in used)]
+    for code in used:
+        x[code], y[code] = object_offset(objects[object_labels[code]], date = date)
+    return x, y
+
+
+def _tokens(lines, split_swap):
+    """ split the lines of a sequence in the lists of exposure labels of each template """
+    for line in lines:
+        labels = []
+        for label in str(line).split():
+            if split_swap and (label == SWAP):
+                if len(labels) > 0:
+                    yield labels
+                yield [SWAP]
+                labels = []
+            else:
+                labels.append(label)
+        if len(labels) > 0:
+            yield labels
+    return None
+
+
+def compile_sequences(lines, objects, ob_label = "", split_swap = False, single = False):
+    """
+    Compile the sequence of an OB into a list of Sequences (one per template), and check it
+    @param lines: the 'sequence' of the OB yml (list of strings)
+    @param objects: dict of the object ymls of the OB
+    @param ob_label: label of the OB, used in the messages
+    @param split_swap: if True, 'swap' is a template on its own (dual field off-axis)
+    @param single: if True, each template must contain a single object (single field). Otherwise, all the objects of
+    a template must have the same DIT and NDITs
+    """
+    object_labels = list(objects)
+    index = dict({})
+    for k in range(len(object_labels)):
+        index[object_labels[k]] = k
+    index[SKY] = SKY_CODE
+    index[SWAP] = SWAP_CODE
+    # the values of the parameters which must be consistent, coded as integers once for all objects
+    values = dict({})
+    for key in CONSISTENT_KEYS:
+        column = [objects[label].get(key, None) for label in object_labels]
+        values[key] = np.array([column.index(value) for value in column], dtype = int)
+    sequences = []
+    for labels in _tokens(lines, split_swap):
+        for label in labels:
+            if not(label in index) or ((label == SWAP) and not(split_swap)):
+                common.printerr("Exposure '{}' in OB '{}' does not match any of the objects".format(label, ob_label))
+        seq = Sequence(labels, np.array([index[label] for label in labels], dtype = int), object_labels)
+        sequences.append(seq)
+        if seq.is_swap():
+            continue
+        codes = np.unique(seq.codes[seq.codes >= 0])
+        if single:
+            if len(codes) > 1:
+                common.printerr("Sequence '{}' in OB '{}' contains more than one object".format(labels, ob_label))
+            if len(codes) == 0:
+                common.printerr("Sequence '{}' in OB '{}' does not contain any object".format(labels, ob_label))
+        else:
+            for key in CONSISTENT_KEYS:
+                if len(np.unique(values[key][codes])) > 1:
+                    common.printerr("Sequence '{}' in OB '{}' contains objects with different {}. Please split them on different lines.".format(labels, ob_label, key))
+        if not(seq.has_sky()):
+            common.printwar("No sky in sequence {} in OB '{}'".format(labels, ob_label))
+    return sequences
@@ -0,0 +1,192 @@
+#coding: utf8
+"""Incremental synchronisation of generated OBs with the content of a P2 container.
+
+Each OB uploaded by p2Gravity is tagged (in its userComments) with short hashes of its content: the OB itself
+(target, constraints, description, time constraints), the acquisition template, and each science template.
+In sync mode, the container is listed once and OBs are matched by label:
+- OBs which do not exist yet are created,
+- OBs whose hashes are all identical are skipped, unless the fields of the OB set by p2Gravity were changed on P2,
+- OBs which changed are patched in place, only updating the templates which changed. All the fields of the OB set
+  by p2Gravity are written again (see ObservingBlock.p2_fields), so that the OB is the same as a new one,
+- tagged OBs which are no longer in the yml can be deleted (only if requested).
+"""
+
+from . import common
+
+import re
+import json
+import hashlib
+
+# tag appended to the userComments of the OBs
+SYNC_TAG = "[p2Gravity-sync {}]"
+SYNC_TAG_REGEXP = re.compile(r"\s*\[p2Gravity-sync ([^\]]*)\]")
+
+
+def hash_content(content):
+    """ short hash of any json-like content """
+    txt = json.dumps(content, sort_keys = True, default = str)
+    return hashlib.sha1(txt.encode("utf8")).hexdigest()[0:8]
+
+
+def _template_content(template):
+    template.pad_offsets()
+    return dict({"name": template.template_name, "params": template.params})
+
+
+def ob_hashes(ob):
+    """
+    Return the hashes of the content of a generated (and resolved) ObservingBlock
+    as a dict with keys 'ob', 'acq' and 'tpl' (list of the hashes of the science templates)
+    """
+    ob_content = dict({"fields": ob.p2_fields(),
+                       "setup_constraints": ob.setup.get("constraints", None),
+                       "constraints": ob.yml.get("constraints", None),
+                       "absoluteTimeConstraints": ob.setup.get("absoluteTimeConstraints", None)})
+    hashes = dict({"ob": hash_content(ob_content),
+                   "acq": hash_content(_template_content(ob.acquisition)),
+                   "tpl": [hash_content(_template_content(template)) for template in ob.templates]})
+    return hashes
+
+
+def same_fields(remote, fields):
+    """
+    True if an OB on P2 has the values of the fields set by p2Gravity
+    @param remote: the OB as returned by P2
+    @param fields: the fields of the local OB (see ObservingBlock.p2_fields)
+    """
+    for section in fields:
+        for key in fields[section]:
+            if not(remote.get(section, dict({})).get(key, None) == fields[section][key]):
+                return False
+    return True
+
+
+def format_tag(hashes):
+    return SYNC_TAG.format("ob={};acq={};tpl={}".format(hashes["ob"], hashes["acq"], ",".join(hashes["tpl"])))
+
+
+def parse_tag(comments):
+    """ return the hashes stored in the userComments of an OB, or None if the OB is not tagged """
+    if comments is None:
+        return None
+    match = SYNC_TAG_REGEXP.search(comments)
+    if match is None:
+        return None
+    hashes = dict({"tpl": []})
+    for item in match.group(1).split(";"):
+        key, value = item.split("=", 1)
+        if key == "tpl":
+            hashes["tpl"] = [h for h in value.split(",") if h != ""]
+        else:
+            hashes[key] = value
+    return hashes
+
+
+def tag_comments(comments, hashes):
+    """ replace (or add) the sync tag in the given userComments """
+    if comments is None:
+        comments = ""
+    return SYNC_TAG_REGEXP.sub("", comments) + " " + format_tag(hashes)
+
+
+def plan_sync(api, obs, container_id, prune = False):
+    """
+    Compare the given OBs with the content of the container, and return the list of actions to perform.
+    Each action is a dict with keys 'action' (create, update, skip or delete), 'label', 'ob' (the generated
+    ObservingBlock, None for delete), and for existing OBs 'ob_id', 'remote' (the OB from P2), 'version' and 'hashes'
+    (the hashes found in the remote OB, None if it was not tagged).
+    @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+    @param obs: list of generated and resolved ObservingBlocks
+    @param container_id: id of the container where the OBs are
+    @param prune: if True, tagged OBs of the container which are not in obs are deleted
+    """
+    items, _ = api.getItems(container_id)
+    existing = dict({})
+    for item in items:
+        if item["itemType"] == "OB":
+            existing.setdefault(item["name"], []).append(item)
+    actions = []
+    for ob in obs:
+        if len(existing.get(ob.label, [])) == 0:
+            actions.append(dict({"action": "create", "label": ob.label, "ob": ob}))
+            continue
+        item = existing[ob.label].pop(0)
+        remote, version = api.getOB(item["obId"])
+        hashes = parse_tag(remote["obsDescription"].get("userComments", None))
+        action = dict({"action": "update", "label": ob.label, "ob": ob, "ob_id": item["obId"], "remote": remote, "version": version, "hashes": hashes})
+        # (the hashes do not see the changes made on P2 since the last upload)
+        if (hashes == ob_hashes(ob)) and same_fields(remote, ob.p2_fields()):
+            action["action"] = "skip"
+        actions.append(action)
+    # remaining OBs of the container
+    for label in existing:
+        for item in existing[label]:
+            remote, version = api.getOB(item["obId"])
+            hashes = parse_tag(remote["obsDescription"].get("userComments", None))
+            # we never touch OBs which were not created by p2Gravity
+            if prune and not(hashes is None):
+                actions.append(dict({"action": "delete", "label": label, "ob": None, "ob_id": item["obId"], "remote": remote, "version": version, "hashes": hashes}))
+    return actions
+
+
+def print_plan(actions):
+    """ print a summary of the actions returned by plan_sync """
+    counts = dict({"create": 0, "update": 0, "skip": 0, "delete": 0})
+    for action in actions:
+        counts[action["action"]] = counts[action["action"]] + 1
+        common.printinf("{:>6}: {}".format(action["action"], action["label"]))
+    common.printinf("Sync plan: {} to create, {} to update, {} to skip, {} to delete".format(counts["create"], counts["update"], counts["skip"], counts["delete"]))
+    return counts
+
+
+def apply_update(api, action):
+    """
+    Patch an existing OB on P2 with only the calls required
+    @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+    @param action: an 'update' action returned by plan_sync
+    """
+    ob = action["ob"]
+    local = ob_hashes(ob)
+    remote = action["hashes"]
+    ob.ob_id = action["ob_id"]
+    ob.ob = action["remote"]
+    ob.version = action["version"]
+    # (all the fields set by p2Gravity are written, whatever their values on P2)
+    ob.p2_save_ob(api)
+    local_templates = [ob.acquisition] + ob.templates
+    templates, _ = api.getTemplates(ob.ob_id)
+    same_layout = [t["templateName"] for t in templates] == [t.template_name for t in local_templates]
+    if same_layout and not(remote is None) and (len(remote["tpl"]) == len(local["tpl"])):
+        # only update templates which changed
+        remote_hashes = [remote["acq"]] + remote["tpl"]
+        local_hashes = [local["acq"]] + local["tpl"]
+        for k in range(len(local_templates)):
+            if remote_hashes[k] == local_hashes[k]:
+                continue
+            tpl, version = api.getTemplate(ob.ob_id, templates[k]["templateId"])
+            local_templates[k].ob_id = ob.ob_id
+            local_templates[k].tpl = tpl
+            local_templates[k].version = version
+            local_templates[k].p2_update(api)
+    else:
+        # the templates are not the same, we replace all of them
+        for t in templates:
+            _, version = api.getTemplate(ob.ob_id, t["templateId"])
+            api.deleteTemplate(ob.ob_id, t["templateId"], version)
+        ob.p2_create_templates(api)
+        for template in local_templates:
+            template.p2_update(api)
+    if (remote is None) or (remote["ob"] != local["ob"]):
+        ob.p2_update_utctime(api)
+    return None
+
+
+def apply_delete(api, action):
+    """
+    Delete an OB from P2
+    @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+    @param action: a 'delete' action returned by plan_sync
+    """
+    common.printinf("Deleting OB '{}'".format(action["label"]))
+    api.deleteOB(action["ob_id"], action["version"])
+    return None
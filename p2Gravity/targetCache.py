@@ -0,0 +1,89 @@
+#coding: utf8
+"""A persistent cache of the targets resolved on Simbad.
+
+The cache is a small SQLite database (in the p2Gravity cache dir by default) which stores, for each object name,
+the values required to populate the OB and acquisition templates: coordinates, proper motions, parallax and magnitudes.
+"""
+
+from . import common
+
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# default expiry of the entries (in days), and max number of entries kept in the cache
+DEFAULT_TTL = 30
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def normalize_name(name):
+    """ names are case insensitive in the cache, and multiple spaces are ignored """
+    return " ".join(str(name).split()).lower()
+
+
+class TargetCache(object):
+    def __init__(self, path = None, ttl = DEFAULT_TTL, max_entries = DEFAULT_MAX_ENTRIES):
+        """
+        @param path: path to the SQLite file. Default to targets.sqlite in the p2Gravity cache dir
+        @param ttl: time (in days) after which an entry is considered as expired. None to never expire
+        @param max_entries: maximum number of entries in the cache. Least recently used entries are evicted first
+        """
+        if path is None:
+            path = os.path.join(common.get_cache_dir(), "targets.sqlite")
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread = False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS targets (name TEXT PRIMARY KEY, record TEXT, created REAL, accessed REAL)")
+        self._db.commit()
+        return None
+
+    def get(self, name):
+        """
+        Return the record of the given object, or None if it is not in the cache or has expired
+        """
+        key = normalize_name(name)
+        with self._lock:
+            row = self._db.execute("SELECT record, created FROM targets WHERE name = ?", (key, )).fetchone()
+            if row is None:
+                return None
+            record, created = row
+            if not(self.ttl is None) and (time.time() - created > self.ttl*86400.):
+                return None
+            self._db.execute("UPDATE targets SET accessed = ? WHERE name = ?", (time.time(), key))
+            self._db.commit()
+        return json.loads(record)
+
+    def put(self, name, record):
+        """
+        Store the record of the given object, and evict the oldest entries if the cache is full
+        """
+        key = normalize_name(name)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO targets (name, record, created, accessed) VALUES (?, ?, ?, ?)", (key, json.dumps(record), now, now))
+            self._evict()
+            self._db.commit()
+        return None
+
+    def _evict(self):
+        """ remove expired entries, and least recently used ones if there are more than max_entries """
+        if not(self.ttl is None):
+            self._db.execute("DELETE FROM targets WHERE created < ?", (time.time() - self.ttl*86400., ))
+        if not(self.max_entries is None):
+            self._db.execute("DELETE FROM targets WHERE name NOT IN (SELECT name FROM targets ORDER BY accessed DESC LIMIT ?)", (int(self.max_entries), ))
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM targets")
+            self._db.commit()
+        return None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+        return None
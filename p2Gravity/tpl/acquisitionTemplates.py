@@ -30,6 +30,24 @@ class AcquisitionTemplate(Template):
     COU.AG.PMA -- -10...10 (0) -- GS proper motion in RA
     COU.AG.PMD -- -10...10 (0) --GS proper motion in DEC
     """
+    SCHEMA = dict({"SEQ.FT.MODE": dict({"values": ["AUTO", 1, 2, 7, 9]}),
+                   "SEQ.MET.MODE": dict({"values": ["ON", "FAINT", "OFF"], "strict": True}),
+                   "SEQ.INS.SOBJ.MAG.K": dict({"min": -10, "max": 30}),
+                   "SEQ.INS.SOBJ.MAG.H": dict({"min": -10, "max": 30}),
+                   "SEQ.INS.SOBJ.DIAMETER": dict({"min": 0, "max": 300}),
+                   "SEQ.INS.SOBJ.VIS": dict({"min": 0, "max": 1}),
+                   "TEL.TARG.PARALLAX": dict({"min": -20, "max": 20}),
+                   "TEL.TARG.MAG.K": dict({"min": -10, "max": 30}),
+                   "TEL.TARG.MAG.H": dict({"min": -10, "max": 30}),
+                   "INS.SPEC.RES": dict({"values": ["LOW", "MED", "HIGH"], "strict": True}),
+                   "INS.FT.POL": dict({"values": ["IN", "OUT"], "strict": True}),
+                   "INS.SPEC.POL": dict({"values": ["IN", "OUT"], "strict": True}),
+                   "COU.AG.TYPE": dict({"values": ["DEFAULT", "ADAPT_OPT", "ADAPT_OPT_TCCD", "IR_AO_OFFAXIS"]}),
+                   "COU.NGS.SOURCE": dict({"values": ["SETUPFILE", "SCIENCE", "FT", "FTS"]}),
+                   "COU.NGS.MAG": dict({"min": 0, "max": 25}),
+                   "COU.AG.PMA": dict({"min": -10, "max": 10}),
+                   "COU.AG.PMD": dict({"min": -10, "max": 10})})
+
     def __init__(self, *args, **kwargs):
         super(AcquisitionTemplate, self).__init__(*args, **kwargs)
         self.template_name = 'GRAVITY_single_onaxis_acq'
@@ -242,6 +260,14 @@ class DualOnAxisAcq(AcquisitionTemplate):
     COU.AG.PMA -- -10...10 (0) -- GS proper motion in RA
     COU.AG.PMD -- -10...10 (0) --GS proper motion in DEC
     """
+    # the documentation gives 150...7000 mas, but the offsets can be negative, and the OB classes set smaller ones on
+    # purpose (e.g. 0 for the single star of an on-axis OB): only values beyond 7000 mas in any direction are reported
+    SCHEMA = dict({"TEL.TARG.DIAMETER": dict({"min": 0, "max": 300}),
+                   "TEL.TARG.VIS": dict({"min": 0, "max": 1}),
+                   "SEQ.INS.SOBJ.X": dict({"min": -7000, "max": 7000}),
+                   "SEQ.INS.SOBJ.Y": dict({"min": -7000, "max": 7000}),
+                   "SEQ.FI.MAG.H": dict({"min": -10, "max": 25})})
+
     def __init__(self, *args, **kwargs):
         super(DualOnAxisAcq, self).__init__(*args, **kwargs)
         self.template_name = 'GRAVITY_dual_onaxis_acq'
@@ -309,6 +335,8 @@ class DualOffAxisAcq(DualOnAxisAcq):
     COU.AG.PMA -- -10...10 (0) -- GS proper motion in RA
     COU.AG.PMD -- -10...10 (0) --GS proper motion in DEC
     """
+    SCHEMA = dict({"SEQ.PICKSC": dict({"values": ["T", "A", "F"]})})
+
     def __init__(self, *args, **kwargs):
         super(DualOffAxisAcq, self).__init__(*args, **kwargs)
         self.template_name = 'GRAVITY_dual_offaxis_acq'
@@ -356,6 +384,15 @@ class DualWideAcq(AcquisitionTemplate):
     COU.AG.PMA -- -10...10 (0) -- GS proper motion in RA
     COU.AG.PMD -- -10...10 (0) --GS proper motion in DEC
     """
+    SCHEMA = dict({"COU.FTS.PARALLAX": dict({"min": -20, "max": 20}),
+                   "COU.FTS.PMA": dict({"min": -10, "max": 10}),
+                   "COU.FTS.PMD": dict({"min": -10, "max": 10}),
+                   "COU.FTS.EPOCH": dict({"min": -2000, "max": 3000}),
+                   "COU.FTS.MAG.K": dict({"min": -10, "max": 30}),
+                   "COU.FTS.DIAMETER": dict({"min": 0, "max": 300}),
+                   "COU.FTS.VIS": dict({"min": 0, "max": 1}),
+                   "SEQ.FI.MAG.H": dict({"min": -10, "max": 25})})
+
     def __init__(self, *args, **kwargs):
         super(DualWideAcq, self).__init__(*args, **kwargs)
         self.template_name = 'GRAVITY_dual_wide_acq'
@@ -1,19 +1,21 @@
 #coding: utf8
 from .template import Template
 from .. import common
+from .. import sequence
 
-import numpy as np
-
-# to resolve planet position
-try:
-    import whereistheplanet
-    WHEREISTHEPLANET = True    
-except:
-    common.printwar("Cannot load whereistheplanet module. 'whereistheplanet' will not be available as a coord_syst.")
-    WHEREISTHEPLANET = False    
 
 
 class ScienceTemplate(Template): 
+    # the DITs and NDITs documented below and in the examples differ (e.g. NDIT 4...320 in the examples): the values of
+    # both are accepted, and they only give warnings
+    SCHEMA = dict({"DET2.DIT": dict({"values": [0.3, 1, 3, 5, 10, 30, 60, 100, 300]}),
+                   "DET2.NDIT.OBJECT": dict({"min": 4, "max": 320}),
+                   "DET2.NDIT.SKY": dict({"min": 4, "max": 320}),
+                   "SEQ.HWPOFF": dict({"min": -180, "max": 180}),
+                   "SEQ.SKY.X": dict({"min": -4000, "max": 4000}),
+                   "SEQ.SKY.Y": dict({"min": -4000, "max": 4000}),
+                   "SEQ.OBSSEQ": dict({"values": ["O", "S"], "split": True, "strict": True})})
+
     def __init__(self, *args, **kwargs):
         """
         This is the generic class of a science tamplate, with all fields common to all templates
@@ -37,6 +39,8 @@ class DualObsSwap(Template):
     Parameter -- Range (Default) -- Desciption
     SEQ.FT.MODE -- Auto 1 2 7 9 (Auto) -- FringeTracker mode
     """
+    SCHEMA = dict({"SEQ.FT.MODE": dict({"values": ["AUTO", 1, 2, 7, 9]})})
+
     def __init__(self, *args, **kwargs):
         super(DualObsSwap, self).__init__(*args, **kwargs)
         self.template_name = 'GRAVITY_dual_obs_swap'
@@ -89,6 +93,9 @@ class DualObsExp(ScienceTemplate):
     SEQ.SKY.Y -- -4000...4000 (2000) -- Sky offset in DEC (mas).
     SEQ.OBSSEQ -- O S (O S) -- Observing sequence of science (O) and sky (S) exposures.
     """
+    SCHEMA = dict({"SEQ.RELOFF.X": dict({"min": -1000, "max": 1000}),
+                   "SEQ.RELOFF.Y": dict({"min": -1000, "max": 1000})})
+
     def __init__(self, iscalib = False, *args, **kwargs):
         super(DualObsExp, self).__init__(*args, **kwargs)
         if iscalib:
@@ -106,54 +113,23 @@ class DualObsExp(ScienceTemplate):
         Calculate the correct expoure sequence (ESO format) and relative offsets
         from a list like "A B A B" and a dict of object ymls {"A": yml, "B": yml}
         """
-        # clear offsets and exposures
-        self["SEQ.RELOFF.X"] = []
-        self["SEQ.RELOFF.Y"] = []
-        exposures_ESO = "" 
-        # loop through exposures
-        for exposure in exposures:
-            # if sky, set offset to 0 (skyoffset is used instead)
-            if exposure.lower() == "sky":
-                self["SEQ.RELOFF.X"].append(0.)
-                self["SEQ.RELOFF.Y"].append(0.)                                                
-                exposures_ESO = exposures_ESO + " S"
-            else:
-                if not(exposure in objects_yml):
-                    common.printerr("Object with label {} from sequence not found in yml".format(exposure))                
-                obj_yml = objects_yml[exposure]
-                if "coord_syst" in obj_yml:
-                    if obj_yml["coord_syst"] == "radec":
-                        self["SEQ.RELOFF.X"].append(obj_yml["coord"][0])
-                        self["SEQ.RELOFF.Y"].append(obj_yml["coord"][1])
-                    elif obj_yml["coord_syst"] == "pasep":
-                        pa, sep = obj_yml["coord"]
-                        ra, dec = np.sin(np.deg2rad(pa))*sep, np.cos(np.deg2rad(pa))*sep
-                        self["SEQ.RELOFF.X"].append(ra)
-                        self["SEQ.RELOFF.Y"].append(dec)
-                    elif obj_yml["coord_syst"] == "whereistheplanet":
-                        if WHEREISTHEPLANET:
-                            common.printinf("Resolution of {} with whereistheplanet:".format(obj_yml["coord"]))
-                            if date is None:
-                                raise Exception("Date not given for Resolution of {} with whereistheplanet:".format(obj_yml["coord"]))                                
-                            ra, dec, sep, pa = whereistheplanet.predict_planet(obj_yml["coord"], date)
-                            self["SEQ.RELOFF.X"].append(ra[0])
-                            self["SEQ.RELOFF.Y"].append(dec[0])
-                        else: 
-                            common.printerr("whereistheplanet used as a coord_syst, but whereistheplanet module could not be loaded")
-                    else:
-                        common.printerr("Unknown coordinate system {}".format(obj_yml["coord_syst"]))
-                else:
-                    self["SEQ.RELOFF.X"].append(0.)
-                    self["SEQ.RELOFF.Y"].append(0.)  
-                # add the exposure in the ESO format
-                exposures_ESO = exposures_ESO + " O"                            
-                # don't forget that these offsets are cumulative, so we need to
-                # remove the previous cumsum from each newly calculated offset
-                # also round to 2 digits
-                self["SEQ.RELOFF.X"][-1] = round(self["SEQ.RELOFF.X"][-1] - np.sum(np.array(self["SEQ.RELOFF.X"][:-1])), 2)
-                self["SEQ.RELOFF.Y"][-1] = round(self["SEQ.RELOFF.Y"][-1] - np.sum(np.array(self["SEQ.RELOFF.Y"][:-1])), 2)
-                self.populate_from_yml(obj_yml)
-        self["SEQ.OBSSEQ"] = exposures_ESO
+        seq = sequence.compile_sequences([" ".join(exposures)], objects_yml)[0]
+        self.populate_offsets_from_sequence(seq, objects_yml, sequence.object_offsets(objects_yml, [seq], date = date))
+        return None
+
+    def populate_offsets_from_sequence(self, seq, objects_yml, offsets):
+        """
+        Set the exposure sequence (ESO format) and the relative offsets from a compiled Sequence
+        @param seq: the Sequence of this template (see sequence.compile_sequences)
+        @param objects_yml: dict of the object ymls of the OB
+        @param offsets: arrays (x, y) of the absolute offsets of the objects, see sequence.object_offsets
+        """
+        # these offsets are cumulative, so the relative offsets are the differences between successive objects
+        self["SEQ.RELOFF.X"], self["SEQ.RELOFF.Y"] = seq.relative_offsets(*offsets)
+        # the objects are then used in order, so that the last exposure of an object wins
+        for obj_label in seq.objects():
+            self.populate_from_yml(objects_yml[obj_label])
+        self["SEQ.OBSSEQ"] = " " + seq.eso()
         return None
 
     def populate_from_yml(self, yml):
@@ -1,8 +1,113 @@
 #coding: utf8
-import p2api
 import numpy as np
 
+from .. import common
+
+import os
+import json
+import threading
+
+
+def tpl_values(tpl):
+    """ return the parameters of a template returned by P2 as a dict name -> value """
+    return dict({param["name"]: param["value"] for param in tpl.get("parameters", [])})
+
+
+def same_value(value, reference):
+    """ compare a value of our params to the value of a P2 template parameter """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value == reference:
+        return True
+    return str(value) == str(reference)
+
+
+class TemplateDefaults(object):
+    """
+    The default values of the parameters of each template (e.g. GRAVITY_dual_obs_exp), as returned
+    by P2 at the creation of a template. Kept for the session, and also on disk if a path is given.
+    """
+    def __init__(self, path = None):
+        self.path = None
+        self.defaults = dict({})
+        self._lock = threading.Lock()
+        if not(path is None):
+            self.load(path)
+        return None
+
+    def load(self, path):
+        """ load the defaults from a json file, which is then updated with any new template seen """
+        self.path = path
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    self.defaults.update(json.load(f))
+            except ValueError:
+                common.printwar("Cannot read template defaults from {}. Ignoring it".format(path))
+        return None
+
+    def get(self, template_name):
+        """ return the dict of default values of the given template, or None if this template was never seen """
+        return self.defaults.get(template_name, None)
+
+    def update(self, template_name, tpl):
+        """ store the defaults of a template from the template returned by createTemplate """
+        values = tpl_values(tpl)
+        if len(values) == 0 or self.defaults.get(template_name, None) == values:
+            return None
+        with self._lock:
+            self.defaults[template_name] = values
+            if not(self.path is None):
+                with open(self.path, "w") as f:
+                    json.dump(self.defaults, f, indent = 1, default = str)
+        return None
+
+
+# shared by all templates
+DEFAULT_TEMPLATE_DEFAULTS = TemplateDefaults()
+
+def check_value(name, value, rule):
+    """
+    Check a parameter value against its rule in a template schema. Return the list of problems (empty if valid)
+    @param rule: dict with either 'min' and 'max', or 'values' (allowed values). Lists of values are checked
+    element by element, and strings with 'split' are checked word by word. Rules with 'strict' are the ones
+    which stop an OB (see Template.check_params)
+    """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        values = list(value)
+    elif rule.get("split", False):
+        values = str(value).split()
+    else:
+        values = [value]
+    problems = []
+    for v in values:
+        if "values" in rule:
+            if not(str(v).upper() in [str(allowed).upper() for allowed in rule["values"]]):
+                try:
+                    valid = float(v) in [float(allowed) for allowed in rule["values"]]
+                except (TypeError, ValueError):
+                    valid = False
+                if not(valid):
+                    problems.append("{} = {} is not one of {}".format(name, v, rule["values"]))
+        else:
+            try:
+                number = float(v)
+            except (TypeError, ValueError):
+                problems.append("{} = {} is not a number".format(name, v))
+                continue
+            if (number < rule["min"]) or (number > rule["max"]):
+                problems.append("{} = {} is not within {}...{}".format(name, v, rule["min"], rule["max"]))
+    return problems
+
+
 class Template(dict):
+    # allowed values of the parameters (see check_value), completed by each subclass from the P2 documentation.
+    # The ranges of the documentation are not always the ones of P2 (e.g. DET2.NDIT), so only the rules known to be
+    # enforced by P2 are 'strict', and the other ones only give warnings
+    SCHEMA = dict({})
+
     def __init__(self, *args, **kwargs):
         super(Template, self).__init__(*args, **kwargs)
         self.ob_id = None
@@ -29,22 +134,73 @@ class Template(dict):
 
     def _params(self):
         return dict(self)
+
+    @classmethod
+    def schema(cls):
+        """ return the schema of this template class, including the rules of its parent classes """
+        schema = dict({})
+        for klass in reversed(cls.__mro__):
+            schema.update(getattr(klass, "SCHEMA", dict({})))
+        return schema
+
+    def check_params(self, strict = True):
+        """
+        return the list of parameters which do not follow the schema of this template
+        @param strict: if True, only check the strict rules of the schema (errors). If False, only the other rules
+        (warnings)
+        """
+        schema = self.schema()
+        problems = []
+        for key in self:
+            if (key in schema) and (schema[key].get("strict", False) == strict):
+                problems = problems + check_value(key, self[key], schema[key])
+        return problems
             
     def p2_create(self, api, ob_id):
         tpl, version = api.createTemplate(ob_id, self.template_name)
         self.ob_id = ob_id        
         self.version = version
         self.tpl = tpl
+        DEFAULT_TEMPLATE_DEFAULTS.update(self.template_name, tpl)
         return None
         
-    def p2_update(self, api):
-        # at update, check that the number of values in OFFSETS is the same as in sequence
+    def pad_offsets(self):
+        """
+        Check that the number of values in OFFSETS is the same as in sequence, and add 0s to match length
+        """
         if "SEQ.RELOFF.X" in self:
             nobj = len(self["SEQ.OBSSEQ"].split())
-            # add 0s to match length
             self["SEQ.RELOFF.X"] = self["SEQ.RELOFF.X"]+[0]*(nobj-len(self["SEQ.RELOFF.X"]))
-            self["SEQ.RELOFF.Y"] = self["SEQ.RELOFF.Y"]+[0]*(nobj-len(self["SEQ.RELOFF.X"]))
-        tpl, version = api.setTemplateParams(self.ob_id, self.tpl, self.params, self.version)
+            self["SEQ.RELOFF.Y"] = self["SEQ.RELOFF.Y"]+[0]*(nobj-len(self["SEQ.RELOFF.Y"]))
+        return None
+
+    def changed_params(self):
+        """
+        Return the params which differ from the values currently in the P2 template
+        (or from the defaults of this template if the P2 template does not give them)
+        """
+        current = tpl_values(self.tpl)
+        if len(current) == 0:
+            current = DEFAULT_TEMPLATE_DEFAULTS.get(self.template_name)
+            if current is None:
+                return self.params
+        params = self.params
+        for key in params:
+            if not(key in current):
+                common.printwar("Parameter {} is not known in template {}".format(key, self.template_name))
+        return dict({key: params[key] for key in params if not(key in current) or not(same_value(params[key], current[key]))})
+
+    def p2_update(self, api):
+        # at update, check that the number of values in OFFSETS is the same as in sequence
+        self.pad_offsets()
+        params = self.changed_params()
+        # nothing to send if the template already has the correct values
+        if len(params) == 0:
+            return None
+        # version unknown (e.g. template of a duplicated OB)
+        if self.version is None:
+            self.tpl, self.version = api.getTemplate(self.ob_id, self.tpl["templateId"])
+        tpl, version = api.setTemplateParams(self.ob_id, self.tpl, params, self.version)
         self.version = version
         self.tpl = tpl
         return None
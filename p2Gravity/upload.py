@@ -0,0 +1,238 @@
+#coding: utf8
+"""Upload fully generated OBs to P2, possibly using a pool of threads.
+
+The calls for one OB are always made in order (createOB, templates, saveOB, template parameters, time constraints),
+but different OBs can be uploaded concurrently. OBs are still created in each container in the order in which they
+were submitted, so that their ordering in P2 (in particular in a concatenation) is the one from the yml.
+
+With clone = True, the first OB of each layout (same templates and constraints, see ObservingBlock.layout) is
+created as usual and used as a prototype: the next OBs with this layout are created with a single duplicateOB call,
+and only the parameters which differ from the prototype are then sent. If the prototype could not be uploaded,
+they are created as usual.
+
+If a journal is given (see journal.UploadJournal), each step of the uploads is recorded. With resume = True, the OBs
+which the journal shows as done in the same container are skipped, and the OBs which were only partially created
+are completed (missing templates and parameters) instead of being created again.
+"""
+
+from . import common
+from . import profiling
+from . import p2client
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+
+
+class UploadPool(object):
+    def __init__(self, api, jobs = 1, clone = False, journal = None, resume = False):
+        """
+        @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+        @param jobs: number of OBs uploaded concurrently. If 1, OBs are uploaded directly when submitted
+        @param clone: if True, OBs are created by duplicating a prototype OB with the same layout when possible
+        @param journal: the UploadJournal where the uploads are recorded, if any
+        @param resume: if True, OBs already uploaded (or partially uploaded) according to the journal are skipped (or completed)
+        """
+        self.api = api
+        self.jobs = jobs
+        self.clone = clone
+        self.journal = journal
+        self.resume = resume
+        # for each layout, the prototype OB and an event set when it has been uploaded
+        self._prototypes = dict({})
+        if jobs > 1:
+            self._executor = ThreadPoolExecutor(max_workers = jobs)
+        else:
+            self._executor = None
+        self._futures = []
+        self._results = []
+        # for each container, number of OBs submitted and number of OBs already created
+        self._submitted = dict({})
+        self._created = dict({})
+        self._condition = threading.Condition()
+        return None
+
+    def submit(self, ob, container_id):
+        """
+        Add an OB to the upload queue. Return a Future of its result dict
+        @param ob: an ObservingBlock, with templates generated and targets resolved
+        @param container_id: id of the container where to put the OB
+        """
+        state = None
+        if self.resume and not(self.journal is None):
+            state = self.journal.get(ob)
+            if not(state is None) and not(state["container_id"] == container_id):
+                state = None
+        if not(state is None) and (state["event"] == "done"):
+            common.printinf("OB '{}' already uploaded (OB {}). Skipping it".format(ob.label, state["ob_id"]))
+            result = dict({"label": ob.label, "success": True, "error": None, "skipped": True})
+            future = Future()
+            future.set_result(result)
+            if self._executor is None:
+                self._results.append(result)
+            else:
+                # keep the results in submission order
+                self._futures.append(future)
+            return future
+        prototype, entry = None, None
+        with self._condition:
+            turn = self._submitted.get(container_id, 0)
+            self._submitted[container_id] = turn + 1
+            self._created.setdefault(container_id, 0)
+            if self.clone:
+                layout = ob.layout()
+                if layout in self._prototypes:
+                    # a partially created OB is completed, not duplicated
+                    if state is None:
+                        prototype = self._prototypes[layout]
+                else:
+                    entry = dict({"ob": ob, "success": False, "done": threading.Event()})
+                    self._prototypes[layout] = entry
+        if self._executor is None:
+            future = Future()
+            future.set_result(self._upload(ob, container_id, turn, prototype, entry, state))
+            self._results.append(future.result())
+        else:
+            future = self._executor.submit(self._upload, ob, container_id, turn, prototype, entry, state)
+            self._futures.append(future)
+        return future
+
+    def _upload(self, ob, container_id, turn, prototype = None, entry = None, state = None):
+        """
+        Upload a single OB, waiting for its turn to be created in the container. Return a result dict
+        @param prototype: prototype entry of the layout of this OB, if it should be duplicated from it
+        @param entry: prototype entry to mark as done, if this OB is a prototype
+        @param state: state of the OB in the journal, if it was partially created and should be completed
+        """
+        with profiling.span("upload", ob = ob.label):
+            return self._upload_ob(ob, container_id, turn, prototype, entry, state)
+
+    def _record(self, ob, event, **values):
+        if not(self.journal is None):
+            self.journal.record_ob(ob, event, **values)
+        return None
+
+    def _resume_ob(self, ob, state):
+        """ complete an OB partially created. Return False if it does not exist anymore on P2 """
+        try:
+            ob.p2_resume(self.api, state["ob_id"])
+        except Exception as e:
+            if not(p2client.status_of(e) == 404):
+                raise
+            common.printwar("OB {} of the journal not found on P2. Creating OB '{}' again".format(state["ob_id"], ob.label))
+            return False
+        return True
+
+    def _template_ids(self, ob):
+        return [template.tpl["templateId"] for template in [ob.acquisition] + ob.templates]
+
+    def _upload_ob(self, ob, container_id, turn, prototype, entry, state = None):
+        result = dict({"label": ob.label, "success": False, "error": None})
+        try:
+            # wait for the previous OBs of this container to be created
+            with self._condition:
+                while self._created[container_id] < turn:
+                    self._condition.wait()
+            try:
+                # the prototype is always submitted before, so it cannot be waiting for us
+                if not(prototype is None):
+                    prototype["done"].wait()
+                    if not(prototype["success"]):
+                        prototype = None
+                resumed = not(state is None) and self._resume_ob(ob, state)
+                if resumed:
+                    self._record(ob, "templates", template_ids = self._template_ids(ob))
+                elif prototype is None:
+                    ob.p2_create_ob(self.api, container_id)
+                    self._record(ob, "ob", ob_id = ob.ob_id, container_id = container_id)
+                else:
+                    ob.p2_duplicate_ob(self.api, prototype["ob"].ob_id, container_id)
+                    self._record(ob, "ob", ob_id = ob.ob_id, container_id = container_id, prototype_id = prototype["ob"].ob_id)
+                    self._record(ob, "templates", template_ids = self._template_ids(ob))
+            finally:
+                with self._condition:
+                    self._created[container_id] = self._created[container_id] + 1
+                    self._condition.notify_all()
+            if resumed:
+                ob.p2_update(self.api)
+            elif prototype is None:
+                ob.p2_create_templates(self.api)
+                self._record(ob, "templates", template_ids = self._template_ids(ob))
+                ob.p2_update(self.api)
+            else:
+                # time constraints are copied with the OB
+                ob.p2_update(self.api, utctime = (ob.setup.get("absoluteTimeConstraints", None) != prototype["ob"].setup.get("absoluteTimeConstraints", None)))
+            self._record(ob, "done", version = ob.version)
+            result["success"] = True
+        except (Exception, SystemExit) as e:
+            # printerr uses sys.exit, which we do not want to propagate from a worker
+            result["error"] = "{}: {}".format(type(e).__name__, e)
+            common.printwar("Upload of OB '{}' failed ({})".format(ob.label, result["error"]))
+        finally:
+            if not(entry is None):
+                entry["success"] = result["success"]
+                entry["done"].set()
+        return result
+
+    def submit_call(self, label, function, *args):
+        """
+        Add any other P2 operation on an OB to the queue (e.g. to update or delete an existing OB).
+        These operations are not ordered with the creations.
+        @param label: label of the OB, used in the report
+        @param function: function called as function(api, *args)
+        """
+        if self._executor is None:
+            self._results.append(self._call(label, function, *args))
+        else:
+            self._futures.append(self._executor.submit(self._call, label, function, *args))
+        return None
+
+    def _call(self, label, function, *args):
+        result = dict({"label": label, "success": False, "error": None})
+        try:
+            with profiling.span(function.__name__, ob = label):
+                function(self.api, *args)
+            result["success"] = True
+        except (Exception, SystemExit) as e:
+            result["error"] = "{}: {}".format(type(e).__name__, e)
+            common.printwar("P2 operation on OB '{}' failed ({})".format(label, result["error"]))
+        return result
+
+    def wait(self):
+        """
+        Wait for all submitted OBs to be uploaded, and return the list of results (one dict per OB, in submission order)
+        """
+        for future in self._futures:
+            self._results.append(future.result())
+        self._futures = []
+        if not(self._executor is None):
+            self._executor.shutdown()
+            self._executor = None
+        return self._results
+
+
+def print_report(results):
+    """ print a summary of the upload results returned by UploadPool.wait """
+    failed = [r for r in results if not(r["success"])]
+    skipped = [r for r in results if r.get("skipped", False)]
+    if len(skipped) > 0:
+        common.printinf("{} OB(s) already uploaded according to the journal".format(len(skipped)))
+    common.printinf("{} OB(s) uploaded to P2, {} failed".format(len(results) - len(failed) - len(skipped), len(failed)))
+    for r in failed:
+        common.printwar("OB '{}' was not uploaded: {}".format(r["label"], r["error"]))
+    return None
+
+
+def upload_obs(api, obs, jobs = 1, clone = False, journal = None, resume = False):
+    """
+    Upload a list of OBs, and return the list of results
+    @param api: the p2 api object to send data to p2 (must be initialized beforehand)
+    @param obs: an iterable of (ob, container_id)
+    @param jobs: number of OBs uploaded concurrently
+    @param clone: if True, OBs are duplicated from a prototype with the same layout when possible
+    @param journal: the UploadJournal where the uploads are recorded, if any
+    @param resume: if True, continue the uploads recorded in the journal
+    """
+    pool = UploadPool(api, jobs = jobs, clone = clone, journal = journal, resume = resume)
+    for ob, container_id in obs:
+        pool.submit(ob, container_id)
+    return pool.wait()
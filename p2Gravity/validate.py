@@ -0,0 +1,75 @@
+#coding: utf8
+"""Validation of YML campaigns without Simbad or P2.
+
+All the OBs of the given files are generated (which checks the sequences, the objects and the coord_syst), and
+the parameters of their templates are checked against the schemas of the template classes (Template.SCHEMA, with
+the ranges and values documented in the template docstrings). Errors do not stop the check: all the problems of
+all the files are reported at once. The rules of the schemas which are not strict only give warnings.
+
+    create_obs.py --check *.yml
+
+The schemas can be printed as json:
+
+    python -m p2Gravity.validate --schema
+"""
+
+from . import common
+from . import tpl
+from . import pipeline
+
+import sys
+import json
+import argparse
+
+
+def template_classes(cls = tpl.Template):
+    """ return all the template classes (subclasses of Template) """
+    classes = []
+    for subclass in cls.__subclasses__():
+        classes = classes + [subclass] + [c for c in template_classes(subclass) if not(c is subclass)]
+    return list(dict.fromkeys(classes))
+
+
+def schemas():
+    """ return the schema of each template class, as a dict class name -> schema """
+    return dict({cls.__name__: cls.schema() for cls in template_classes()})
+
+
+def check_files(filenames, report = None):
+    """
+    Generate all the OBs of the given yml files and check them. Nothing is sent to Simbad or P2.
+    Return the ErrorReport, with the label of each OB prefixed by its file
+    @param filenames: list of paths to yml files
+    """
+    if report is None:
+        report = pipeline.ErrorReport()
+    batch_mode = common.BATCH_MODE
+    common.BATCH_MODE = True
+    try:
+        for filename in filenames:
+            try:
+                cfg = pipeline.load_yml(filename)
+            except Exception as e:
+                report.add(filename, "parse", e)
+                continue
+            file_report = pipeline.ErrorReport()
+            obs = list(pipeline.validate_obs(pipeline.generate_obs(cfg, report = file_report), report = file_report))
+            for error in file_report.errors:
+                report.add("{}:{}".format(filename, error.ob), error.stage, error)
+            common.printinf("{}: {} OB(s) valid, {} with errors".format(filename, len(obs), len(file_report.errors)))
+    finally:
+        common.BATCH_MODE = batch_mode
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Check yml files without Simbad or P2, or print the template schemas")
+    parser.add_argument("files", type = str, nargs = "*", help = "yml files to check")
+    parser.add_argument("--schema", action = "store_true", help = "print the schemas of all templates as json")
+    dargs = vars(parser.parse_args())
+    if dargs["schema"]:
+        print(json.dumps(schemas(), indent = 1))
+        sys.exit()
+    report = check_files(dargs["files"])
+    report.print_report()
+    sys.exit(1 if len(report.errors) > 0 else 0)
@@ -0,0 +1,67 @@
+#coding: utf8
+"""Helpers shared by the tests: OBs built from a yml configuration without querying Simbad, and a P2 client
+connected to the in-memory fake P2 server (see p2Gravity/fakeP2.py)"""
+
+import os
+import sys
+import copy
+
+import pytest
+
+# the tests are run from the root of the repository, without installing p2Gravity
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if not(ROOT in sys.path):
+    sys.path.insert(0, ROOT)
+
+from p2Gravity import pipeline
+from p2Gravity import fakeP2
+from p2Gravity import p2client
+from p2Gravity import resolver as simbad_resolver
+
+RUN_ID = "60.A-9252(M)"
+
+# a setup for the OBs of the tests
+SETUP = dict({"run_id": RUN_ID,
+              "date": "2023-07-14",
+              "folder": "p2Gravity_tests",
+              "INS.SPEC.RES": "HIGH",
+              "INS.SPEC.POL": "OUT",
+              "ISS.BASELINE": ["large"],
+              "ISS.VLTITYPE": ["snapshot"],
+              "concatenation": "none"})
+
+# Simbad records of the targets used in the tests (see resolver.RECORD_UNITS)
+RECORDS = dict({"HD142527": dict({"ra": 239.17, "dec": -42.32, "pmra": -11.2, "pmdec": -24.5, "plx_value": 6.3, "G": 8.2, "H": 5.7, "K": 5.0, "R": 8.0}),
+                "HD206893": dict({"ra": 325.23, "dec": -12.78, "pmra": 93.8, "pmdec": 0.1, "plx_value": 24.5, "G": 6.6, "H": 5.7, "K": 5.6, "R": 6.5}),
+                "Fomalhaut": dict({"ra": 344.41, "dec": -29.62, "G": 1.1, "H": 1.0, "K": 0.9, "R": 1.0})})
+
+
+def single_on(target, **kwargs):
+    """ the yml of a single_on OB on the given target, with additional keys """
+    ob_yml = dict({"mode": "single_on",
+                   "target": target,
+                   "objects": dict({"s": dict({"name": target, "DET2.DIT": 3, "DET2.NDIT.OBJECT": 32, "DET2.NDIT.SKY": 32})}),
+                   "sequence": ["s s sky", "s s"],
+                   "calib": False})
+    ob_yml.update(kwargs)
+    return ob_yml
+
+
+@pytest.fixture
+def make_obs():
+    """ return a function generating and resolving the OBs of a yml configuration, using the records of RECORDS """
+    def make(ob_ymls, setup = SETUP):
+        resolver = simbad_resolver.SimbadResolver(cache = None, offline = True, ambiguity = "first")
+        for name in RECORDS:
+            resolver.tables[name] = simbad_resolver.table_from_record(RECORDS[name])
+        cfg = dict({"setup": copy.deepcopy(setup), "ObservingBlocks": copy.deepcopy(ob_ymls)})
+        return list(pipeline.resolve_obs(pipeline.generate_obs(cfg, resolver = resolver), resolver = resolver))
+    return make
+
+
+@pytest.fixture
+def fake_api():
+    """ return a function creating a P2Client on a new in-memory fake P2 server, which retries without waiting """
+    def connect(**kwargs):
+        return p2client.P2Client(fakeP2.FakeP2Api(runs = [RUN_ID], **kwargs), backoff = 0.)
+    return connect
@@ -0,0 +1,45 @@
+#coding: utf8
+"""OBs created by duplicating another OB (create_obs.py --clone) must be identical to the ones created from scratch"""
+
+from conftest import SETUP, single_on
+
+from p2Gravity import pipeline
+from p2Gravity import upload
+
+# the OBs are all cloned from the first one, and none of them sets the same optional fields
+OB_YMLS = dict({"prototype": single_on("HD206893", description = "the prototype"),
+                "no_description": single_on("HD142527"),
+                "no_proper_motion": single_on("Fomalhaut"),
+                "described": single_on("HD142527", description = "another description")})
+
+
+def upload_all(api, obs, clone):
+    container_id = pipeline.ContainerIndex(api).get_container(SETUP)
+    results = upload.upload_obs(api, [(ob, container_id) for ob in obs], jobs = 1, clone = clone)
+    assert all([result["success"] for result in results])
+    items, _ = api.getItems(container_id)
+    return dict({item["name"]: api.getOB(item["obId"])[0] for item in items if item["itemType"] == "OB"})
+
+
+def content(ob):
+    """ the fields of an OB on P2 which p2Gravity sets """
+    return dict({"target": ob["target"], "constraints": ob["constraints"], "description": ob["obsDescription"]["name"]})
+
+
+def test_clone_same_as_plain(make_obs, fake_api):
+    plain = upload_all(fake_api(), make_obs(OB_YMLS), clone = False)
+    cloned_api = fake_api()
+    cloned = upload_all(cloned_api, make_obs(OB_YMLS), clone = True)
+    assert cloned_api.api.calls["duplicateOB"] == len(OB_YMLS) - 1
+    assert sorted(plain) == sorted(OB_YMLS)
+    for label in OB_YMLS:
+        assert content(cloned[label]) == content(plain[label])
+    assert cloned["no_description"]["obsDescription"]["name"] == ""
+    assert cloned["no_proper_motion"]["target"]["properMotionRa"] == 0
+    assert cloned["no_proper_motion"]["target"]["properMotionDec"] == 0
+
+
+def test_setup_constraints_in_layout(make_obs):
+    ob = make_obs(dict({"a": single_on("HD142527")}))[0]
+    constrained = make_obs(dict({"a": single_on("HD142527")}), setup = dict(SETUP, constraints = dict({"airmass": 1.6})))[0]
+    assert not(ob.layout() == constrained.layout())
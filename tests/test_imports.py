@@ -0,0 +1,20 @@
+#coding: utf8
+"""The import time budgets of p2Gravity (see benchmark.check_imports)"""
+
+import sys
+import json
+import subprocess
+
+from conftest import ROOT
+
+# check_imports is run in a new interpreter, in which nothing is imported yet
+CHECK = "import json\nfrom p2Gravity import benchmark\nresults, failures = benchmark.check_imports()\nprint(json.dumps(dict({'results': results, 'failures': failures})))\n"
+
+
+def test_check_imports():
+    output = subprocess.check_output([sys.executable, "-c", CHECK], cwd = ROOT).decode()
+    checked = json.loads(output.strip().splitlines()[-1])
+    assert len(checked["results"]) > 0
+    for name in checked["results"]:
+        assert checked["results"][name]["forbidden"] == [], name
+    assert checked["failures"] == []
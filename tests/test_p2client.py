@@ -0,0 +1,138 @@
+#coding: utf8
+"""Retries of the P2 calls (see p2client.P2Client), on the in-memory fake P2 server"""
+
+import pytest
+
+from conftest import RUN_ID
+
+from p2Gravity import fakeP2
+from p2Gravity import p2client
+
+
+class FailingApi(object):
+    """
+    A FakeP2Api whose next calls of some methods fail with a given http status, either before the call is
+    processed (the request never reached the server) or after (the object is created, but the answer is lost)
+    """
+    def __init__(self, api):
+        self.api = api
+        self.failures = dict({})
+        self.calls = dict({})
+        return None
+
+    def fail(self, method, status, after = False, times = 1):
+        self.failures.setdefault(method, []).extend([(status, after)]*times)
+        return None
+
+    def __getattr__(self, name):
+        function = getattr(self.api, name)
+        def method(*args):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if len(self.failures.get(name, [])) == 0:
+                return function(*args)
+            status, after = self.failures[name].pop(0)
+            if after:
+                function(*args)
+            raise fakeP2.P2Error(status, name, "fakeP2", "Injected error")
+        return method
+
+
+@pytest.fixture
+def server():
+    return FailingApi(fakeP2.FakeP2Api(runs = [RUN_ID]))
+
+
+@pytest.fixture
+def client(server):
+    return p2client.P2Client(server, retries = 3, backoff = 0.)
+
+
+@pytest.fixture
+def folder_id(server, client):
+    folder, _ = client.createFolder(server.api.runs[0]["containerId"], "folder")
+    return folder["containerId"]
+
+
+def names(server, container_id, item_type):
+    items, _ = server.api.getItems(container_id)
+    return [item["name"] for item in items if item["itemType"] == item_type]
+
+
+@pytest.mark.parametrize("after", [False, True])
+def test_create_ob_once(server, client, folder_id, after):
+    # a 504 may come after the OB was created, and a 503 before
+    server.fail("createOB", 504 if after else 503, after = after)
+    ob, version = client.createOB(folder_id, "OB")
+    assert names(server, folder_id, "OB") == ["OB"]
+    assert server.api.getOB(ob["obId"]) == (ob, version)
+    # reconciled from the listing of the container, or sent again
+    assert server.calls["createOB"] == (1 if after else 2)
+
+
+def test_lost_creates_reconciled(server, client, folder_id):
+    for method in ["createConcatenation", "createOB", "createTemplate", "duplicateOB"]:
+        server.fail(method, 504, after = True)
+    concatenation, _ = client.createConcatenation(folder_id, "concatenation")
+    ob, _ = client.createOB(folder_id, "OB")
+    template, _ = client.createTemplate(ob["obId"], "GRAVITY_single_acq")
+    copy, _ = client.duplicateOB(ob["obId"], folder_id)
+    assert names(server, folder_id, "Concatenation") == ["concatenation"]
+    assert names(server, folder_id, "OB") == ["OB", "OB"]
+    assert [t["templateId"] for t in server.api.getTemplates(ob["obId"])[0]] == [template["templateId"]]
+    assert not(copy["obId"] == ob["obId"])
+    # the index of the containers knows the reconciled items
+    assert client.find_item("concatenation", folder_id)["containerId"] == concatenation["containerId"]
+    assert len(client.getItems(folder_id)[0]) == 3
+
+
+def test_lost_create_not_retried_without_reconcile(server, client, folder_id):
+    # a create called without its wrapper cannot be reconciled: the error is raised rather than risking a duplicate
+    server.fail("createOB", 504, after = True)
+    with pytest.raises(fakeP2.P2Error):
+        client.call("createOB", folder_id, "OB")
+    assert names(server, folder_id, "OB") == ["OB"]
+
+
+def test_conflict_refreshes_version(server, client, folder_id):
+    ob, version = client.createOB(folder_id, "OB")
+    # the OB was changed meanwhile (e.g. in the web interface)
+    server.api.saveOB(dict(ob, name = "changed"), version)
+    ob["name"] = "saved"
+    saved, new_version = client.saveOB(ob, version)
+    assert saved["name"] == "saved"
+    assert server.api.getOB(ob["obId"]) == (saved, new_version)
+    assert server.calls["saveOB"] == 2
+    assert server.calls["getOB"] == 1
+    # the index of the container has the new name
+    assert client.find_item("saved", folder_id)["obId"] == ob["obId"]
+
+
+def test_template_conflict_refreshes_version(server, client, folder_id):
+    ob, _ = client.createOB(folder_id, "OB")
+    template, version = client.createTemplate(ob["obId"], "GRAVITY_single_acq")
+    server.api.setTemplateParams(ob["obId"], template, dict({"SEQ.FT.MODE": 1}), version)
+    template, _ = client.setTemplateParams(ob["obId"], template, dict({"SEQ.FT.MODE": 2}), version)
+    assert server.calls["setTemplateParams"] == 2
+    assert server.calls["getTemplate"] == 1
+
+
+def test_shared_budget(server, client, folder_id):
+    ob, version = client.createOB(folder_id, "OB")
+    # conflicts and transient errors are counted together: retries+1 attempts in total
+    for k in range(2):
+        server.fail("saveOB", 412)
+        server.fail("saveOB", 503)
+    with pytest.raises(fakeP2.P2Error) as error:
+        client.saveOB(ob, version)
+    assert p2client.status_of(error.value) == 503
+    assert server.calls["saveOB"] == client.retries + 1
+    # and the calls go through again once the server is back
+    client.saveOB(ob, server.api.getOB(ob["obId"])[1])
+
+
+def test_create_budget(server, client, folder_id):
+    server.fail("createOB", 503, times = client.retries + 1)
+    with pytest.raises(fakeP2.P2Error):
+        client.createOB(folder_id, "OB")
+    assert server.calls["createOB"] == client.retries + 1
+    assert names(server, folder_id, "OB") == []
@@ -0,0 +1,43 @@
+#coding: utf8
+"""The orbits sampled on a grid of dates (see planets.sample_orbits) must be the predictions of whereistheplanet"""
+
+import numpy as np
+import pytest
+
+from p2Gravity import planets
+
+whereistheplanet = pytest.importorskip("whereistheplanet")
+
+MJDS = [60140., 60150.5, 60300.]
+# a single orbit, a multi-planet fit, and a dynamical mass
+PLANETS = ["hd206893b", "betapicc", "hd72946b"]
+
+
+def predict(name, mjd, seed):
+    """ whereistheplanet.predict_planet, as arrays in the order of sample_orbits """
+    np.random.seed(seed)
+    prediction = whereistheplanet.predict_planet(name, mjd)
+    return np.array([prediction[k][j] for k in range(4) for j in range(2)])
+
+
+def sample(name, mjds, seed):
+    np.random.seed(seed)
+    return np.array(planets.sample_orbits(name, mjds))
+
+
+@pytest.mark.parametrize("name", PLANETS)
+def test_grid_same_as_predict_planet(name):
+    # with the same draws of the posterior, all the dates of the grid are the predictions of whereistheplanet
+    grid = sample(name, MJDS, seed = 1)
+    for k in range(len(MJDS)):
+        assert np.allclose(grid[:, k], predict(name, MJDS[k], seed = 1))
+
+
+def test_fallback_to_predict_planet(monkeypatch):
+    # the internals of whereistheplanet used to sample all dates at once changed
+    def _sample_orbits(*args):
+        raise AttributeError("module 'whereistheplanet' has no attribute 'multi_dict'")
+    monkeypatch.setattr(planets, "_sample_orbits", _sample_orbits)
+    grid = sample(PLANETS[0], MJDS[0:1], seed = 2)
+    assert np.allclose(grid[:, 0], predict(PLANETS[0], MJDS[0], seed = 2))
+    assert grid.shape == (8, 1)
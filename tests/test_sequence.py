@@ -0,0 +1,89 @@
+#coding: utf8
+"""Golden test of the compiled sequences (see sequence): the offsets and exposure sequences of the dual-field
+templates of the examples must be the ones computed exposure by exposure before the sequences were compiled"""
+
+import os
+import glob
+
+import numpy as np
+import pytest
+
+from conftest import ROOT
+
+from p2Gravity import tpl
+from p2Gravity import pipeline
+
+# the parameters of the templates set from the sequences
+SEQUENCE_KEYS = ["SEQ.RELOFF.X", "SEQ.RELOFF.Y", "SEQ.SKY.X", "SEQ.SKY.Y", "SEQ.OBSSEQ"]
+
+
+def baseline_offsets(template, exposures, objects_yml):
+    """
+    The computation of DualObsExp.populate_offsets_from_object_yml before the sequences were compiled: the offset of
+    each exposure is computed in turn, and the sum of the previous ones is removed from it
+    """
+    template["SEQ.RELOFF.X"] = []
+    template["SEQ.RELOFF.Y"] = []
+    exposures_ESO = ""
+    for exposure in exposures:
+        if exposure.lower() == "sky":
+            template["SEQ.RELOFF.X"].append(0.)
+            template["SEQ.RELOFF.Y"].append(0.)
+            exposures_ESO = exposures_ESO + " S"
+            continue
+        obj_yml = objects_yml[exposure]
+        if not("coord_syst" in obj_yml):
+            x, y = 0., 0.
+        elif obj_yml["coord_syst"] == "radec":
+            x, y = obj_yml["coord"][0], obj_yml["coord"][1]
+        elif obj_yml["coord_syst"] == "pasep":
+            pa, sep = obj_yml["coord"]
+            x, y = np.sin(np.deg2rad(pa))*sep, np.cos(np.deg2rad(pa))*sep
+        else:
+            pytest.skip("coord_syst {} requires whereistheplanet".format(obj_yml["coord_syst"]))
+        template["SEQ.RELOFF.X"].append(round(x - np.sum(np.array(template["SEQ.RELOFF.X"])), 2))
+        template["SEQ.RELOFF.Y"].append(round(y - np.sum(np.array(template["SEQ.RELOFF.Y"])), 2))
+        exposures_ESO = exposures_ESO + " O"
+        template.populate_from_yml(obj_yml)
+    template["SEQ.OBSSEQ"] = exposures_ESO
+    return None
+
+
+def example_obs():
+    """ (file, label) of the dual-field OBs of the examples """
+    obs = []
+    for filename in sorted(glob.glob(os.path.join(ROOT, "examples", "*.yml"))):
+        cfg = pipeline.load_yml(filename)
+        for label in cfg["ObservingBlocks"]:
+            if cfg["ObservingBlocks"][label]["mode"].startswith("dual"):
+                obs.append((os.path.basename(filename), label))
+    return obs
+
+
+def generate(filename, label):
+    cfg = pipeline.load_yml(os.path.join(ROOT, "examples", filename))
+    cfg["ObservingBlocks"] = dict({label: cfg["ObservingBlocks"][label]})
+    return list(pipeline.generate_obs(cfg))[0]
+
+
+def sequence_params(ob):
+    templates = [ob.acquisition] + ob.templates
+    return [dict({key: template[key] for key in SEQUENCE_KEYS + ["SEQ.INS.SOBJ.X", "SEQ.INS.SOBJ.Y"] if key in template}) for template in templates]
+
+
+def test_dual_examples_found():
+    modes = [generate(filename, label).ob_type for filename, label in example_obs()]
+    assert "DualOnOb" in modes
+    assert "DualOffOb" in modes
+
+
+@pytest.mark.parametrize("filename, label", example_obs())
+def test_same_as_baseline(monkeypatch, filename, label):
+    compiled = sequence_params(generate(filename, label))
+    def populate_offsets_from_sequence(template, seq, objects_yml, offsets):
+        baseline_offsets(template, seq.labels, objects_yml)
+        return None
+    monkeypatch.setattr(tpl.DualObsExp, "populate_offsets_from_sequence", populate_offsets_from_sequence)
+    baseline = sequence_params(generate(filename, label))
+    assert any([len(params) > 0 for params in compiled])
+    assert compiled == baseline
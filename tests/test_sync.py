@@ -0,0 +1,62 @@
+#coding: utf8
+"""Incremental synchronisation of OBs with a container (see sync): an OB updated in place must be the same as
+an OB uploaded from scratch"""
+
+from conftest import SETUP, single_on
+
+from p2Gravity import sync
+from p2Gravity import upload
+from p2Gravity import pipeline
+
+# the OB on P2 was uploaded from an older version of the yml, with fields which the new one does not set
+OLD_YMLS = dict({"ob": single_on("HD206893", description = "an old description")})
+NEW_YMLS = dict({"ob": single_on("Fomalhaut")})
+
+
+def upload_all(api, obs):
+    container_id = pipeline.ContainerIndex(api).get_container(SETUP)
+    results = upload.upload_obs(api, [(ob, container_id) for ob in obs])
+    assert all([result["success"] for result in results])
+    return container_id
+
+
+def run_sync(api, obs, container_id):
+    actions = sync.plan_sync(api, obs, container_id)
+    for action in actions:
+        if action["action"] == "update":
+            sync.apply_update(api, action)
+    return [action["action"] for action in actions]
+
+
+def get_obs(api, container_id):
+    items, _ = api.getItems(container_id)
+    return [api.getOB(item["obId"])[0] for item in items if item["itemType"] == "OB"]
+
+
+def content(ob):
+    """ the OB on P2, without its id """
+    return dict({key: ob[key] for key in ob if not(key == "obId")})
+
+
+def test_update_same_as_upload(make_obs, fake_api):
+    fresh_api = fake_api()
+    fresh = get_obs(fresh_api, upload_all(fresh_api, make_obs(NEW_YMLS)))
+    api = fake_api()
+    container_id = upload_all(api, make_obs(OLD_YMLS))
+    assert run_sync(api, make_obs(NEW_YMLS), container_id) == ["update"]
+    updated = get_obs(api, container_id)
+    assert [content(ob) for ob in updated] == [content(ob) for ob in fresh]
+    # and nothing is left to do
+    assert run_sync(api, make_obs(NEW_YMLS), container_id) == ["skip"]
+
+
+def test_changed_on_p2(make_obs, fake_api):
+    api = fake_api()
+    container_id = upload_all(api, make_obs(NEW_YMLS))
+    uploaded = get_obs(api, container_id)[0]
+    # the tag of the OB is unchanged, but its proper motion was edited on P2
+    remote, version = api.getOB(uploaded["obId"])
+    remote["target"]["properMotionRa"] = 0.01
+    api.saveOB(remote, version)
+    assert run_sync(api, make_obs(NEW_YMLS), container_id) == ["update"]
+    assert content(get_obs(api, container_id)[0]) == content(uploaded)
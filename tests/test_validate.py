@@ -0,0 +1,38 @@
+#coding: utf8
+"""Checks of the template parameters against the schemas (pipeline.validate_obs)"""
+
+import pytest
+
+from conftest import SETUP, single_on
+
+from p2Gravity import common
+from p2Gravity import pipeline
+
+
+def with_ndit(ndit):
+    ob_yml = single_on("HD142527")
+    ob_yml["objects"]["s"]["DET2.NDIT.OBJECT"] = ndit
+    ob_yml["objects"]["s"]["DET2.NDIT.SKY"] = ndit
+    return dict({"ob": ob_yml})
+
+
+@pytest.mark.parametrize("ndit", [4, 32, 320])
+def test_documented_ndit_valid(make_obs, ndit):
+    ob = make_obs(with_ndit(ndit))[0]
+    assert ob.check_params() == []
+    assert ob.check_params(strict = False) == []
+
+
+def test_unconfirmed_range_only_warns(make_obs):
+    obs = make_obs(with_ndit(1000))
+    assert obs[0].check_params() == []
+    assert len(obs[0].check_params(strict = False)) > 0
+    assert list(pipeline.validate_obs(obs)) == obs
+
+
+def test_strict_rule_stops(make_obs):
+    obs = make_obs(dict({"ob": single_on("HD142527")}), setup = dict(SETUP, **{"INS.SPEC.RES": "ULTRA"}))
+    assert len(obs[0].check_params()) > 0
+    report = pipeline.ErrorReport()
+    assert list(pipeline.validate_obs(obs, report = report)) == []
+    assert len(report.errors) == 1